@@ -0,0 +1,126 @@
+import os
+import time
+
+import metrics
+from lazy import lazy_import
+
+forecast_frame = lazy_import("forecast_frame")
+
+# На сколько часов вперёд сравниваются прогнозы
+ALERT_HORIZON_HOURS = int(os.getenv('ALERT_HORIZON_HOURS', '12'))
+# Похолодание (°C на одно и то же время), о котором стоит предупредить
+ALERT_TEMP_DROP = float(os.getenv('ALERT_TEMP_DROP', '5'))
+# Не чаще одного оповещения пользователю за это время (секунды)
+ALERT_COOLDOWN = int(os.getenv('ALERT_COOLDOWN', '10800'))
+
+ALERT_CHANGES = metrics.counter("weather_alert_changes_total", "Изменения прогноза, найденные по городам", ["kind"])
+ALERT_RECIPIENTS = metrics.counter(
+    "weather_alert_recipients_total", "Подписчики городов с изменившимся прогнозом", ["result"])
+
+
+class CityIndex:
+    # Кто подписан на какой город: city_id -> {user_id}. Обновляется при каждом изменении пользователя,
+    # поэтому рассылка по городу не перебирает всех пользователей
+    def __init__(self):
+        self._users = {}
+        self._city = {}
+
+    def set(self, user_id, city_id):
+        # city_id=None - пользователь больше ни на что не подписан
+        old = self._city.get(user_id)
+        if old == city_id:
+            return
+        if old is not None:
+            users = self._users[old]
+            users.discard(user_id)
+            if not users:
+                del self._users[old]
+        if city_id is None:
+            del self._city[user_id]
+        else:
+            self._city[user_id] = city_id
+            self._users.setdefault(city_id, set()).add(user_id)
+
+    def users(self, city_id):
+        return self._users.get(city_id, ())
+
+    def cities(self):
+        return list(self._users)
+
+    def __len__(self):
+        return len(self._city)
+
+
+class AlertEngine:
+    # Оповещения об изменении прогноза. Каждый новый прогноз города сравнивается с предыдущим
+    # один раз, сколько бы у города ни было подписчиков, и найденные изменения расходятся
+    # по подписчикам из index. Пользователь получает не больше одного оповещения за cooldown секунд.
+    def __init__(self, horizon_hours=ALERT_HORIZON_HOURS, temp_drop=ALERT_TEMP_DROP, cooldown=ALERT_COOLDOWN):
+        self.horizon = horizon_hours * 3600
+        self.temp_drop = temp_drop
+        self.cooldown = cooldown
+        self.index = CityIndex()
+        self._last = {}  # city_id -> прогноз, с которым сравнивается следующий
+        self._sent = {}  # user_id -> время последнего оповещения
+
+    def quiet(self, city_id, now=None):
+        # Ночью по местному времени города оповещения не шлются. Город при этом не сравнивается:
+        # утром новый прогноз сравнится с вечерним, и изменения за ночь не потеряются
+        frame = self._last.get(city_id)
+        if frame is None:
+            return False
+        hour = int((now or time.time()) + frame.tz_offset) % 86400 // 3600
+        return not forecast_frame.DAY_START_HOUR <= hour <= forecast_frame.DAY_END_HOUR
+
+    def observe(self, city_id, frame, now=None):
+        # -> [(вид, данные)] - изменения относительно прошлого прогноза города на ближайшие часы.
+        # Первый прогноз города только запоминается
+        now = now or time.time()
+        previous = self._last.get(city_id)
+        self._last[city_id] = frame
+        if previous is None or previous.version == frame.version:
+            return []
+        start, end = now, now + self.horizon
+        changes = []
+        windows = forecast_frame.new_rain(previous, frame, start, end)
+        if windows:
+            changes.append(("rain", windows))
+        drop = forecast_frame.temp_drop(previous, frame, start, end)
+        if drop is not None and drop[1] - drop[2] >= self.temp_drop:
+            changes.append(("cold", drop))
+        for kind, _ in changes:
+            ALERT_CHANGES.inc(kind=kind)
+        return changes
+
+    def recipients(self, city_id, now=None):
+        # Подписчики города, которым можно отправить оповещение сейчас; отправка им сразу отмечается
+        now = now or time.time()
+        ready = []
+        for user_id in self.index.users(city_id):
+            if now - self._sent.get(user_id, float('-inf')) < self.cooldown:
+                ALERT_RECIPIENTS.inc(result="cooldown")
+                continue
+            self._sent[user_id] = now
+            ready.append(user_id)
+        ALERT_RECIPIENTS.inc(len(ready), result="queued")
+        return ready
+
+    def expire(self, now=None):
+        # Забываем истёкшие паузы и прогнозы городов, у которых не осталось подписчиков
+        now = now or time.time()
+        self._sent = {user_id: at for user_id, at in self._sent.items() if now - at < self.cooldown}
+        for city_id in [city_id for city_id in self._last if not self.index.users(city_id)]:
+            del self._last[city_id]
+
+
+def format_alert(name, changes):
+    lines = [f"🔔 {name}: прогноз изменился"]
+    for kind, data in changes:
+        if kind == "rain":
+            hhmm = forecast_frame.hhmm
+            ranges = [f"с {hhmm(start)} по {hhmm(end)}" if start != end else f"в {hhmm(start)}" for start, end in data]
+            lines.append("🌧️ Ожидается дождь: " + ", ".join(ranges))
+        elif kind == "cold":
+            minute, before, after = data
+            lines.append(f"🌡️ Похолодание: к {forecast_frame.hhmm(minute)} {round(after)}°C вместо {round(before)}°C")
+    return "\n".join(lines)
@@ -0,0 +1,107 @@
+# Оповещения об изменении прогноза: три прохода check_alerts по пользователям с подписками.
+# Первый запоминает прогнозы, ко второму в ближайших часах появляется дождь и холодает, к третьему
+# холодает ещё сильнее, но все подписчики ещё на паузе после второго оповещения. Для сравнения -
+# то же сравнение прогнозов по каждому пользователю отдельно, как при проверке без индекса городов.
+# Запуск: python benchmarks/alerts.py [--users 20000]
+import argparse
+import asyncio
+import copy
+import datetime
+import json
+import random
+import tempfile
+import time
+
+from common import make_payload, register_cities
+from fakes import FakeBot, FakeProviders, import_bot
+
+
+def payloads(rnd):
+    # Прогноз с текущего 3-часового отрезка; пояс подобран так, чтобы у города был день
+    now = datetime.datetime.now(datetime.timezone.utc)
+    start = now.replace(hour=now.hour - now.hour % 3, minute=0, second=0, microsecond=0)
+    tz_offset = (12 - now.hour) * 3600
+    base = make_payload(rnd, start, tz_offset)
+    for item in base["list"][:6]:
+        item.pop("rain", None)
+        item["weather"] = [{"description": "облачно с прояснениями"}]
+    rain = copy.deepcopy(base)
+    for item in rain["list"][:4]:
+        item["main"]["temp"] -= 7
+    for item in rain["list"][1:3]:
+        item["rain"] = {"3h": 1.2}
+        item["weather"] = [{"description": "дождь"}]
+    colder = copy.deepcopy(rain)
+    for item in colder["list"][:4]:
+        item["main"]["temp"] -= 7
+    return [base, rain, colder]
+
+
+async def check_pass(bot, providers, payload, cities):
+    providers.responses["/data/2.5/forecast"] = payload
+    for city_id in cities:
+        bot.forecast_cache.invalidate(city_id)
+    before_calls = sum(providers.calls.values())
+    before_sent = bot.send_queue.bot.sent
+    cooldown = bot.alerts.ALERT_RECIPIENTS.value(result="cooldown")
+    changes = sum(bot.alerts.ALERT_CHANGES.value(kind=kind) for kind in ("rain", "cold"))
+    started = time.perf_counter()
+    await bot.check_alerts()
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "provider_requests": sum(providers.calls.values()) - before_calls,
+        "changes": sum(bot.alerts.ALERT_CHANGES.value(kind=kind) for kind in ("rain", "cold")) - changes,
+        "sent": bot.send_queue.bot.sent - before_sent,
+        "cooldown": bot.alerts.ALERT_RECIPIENTS.value(result="cooldown") - cooldown,
+    }
+
+
+def per_user(bot, frames, users):
+    # Без индекса: прогноз сравнивается заново для каждого пользователя
+    engine = bot.alerts.AlertEngine()
+    now = time.time()
+    started = time.perf_counter()
+    for frame in frames:
+        for user_id in range(users):
+            engine.observe(user_id, frame, now)
+    return round(time.perf_counter() - started, 3)
+
+
+async def run(args):
+    bot = import_bot(tempfile.mkdtemp(prefix="weather_alerts_"), LOG_LEVEL="WARNING", ALERT_INTERVAL=0)
+    providers = FakeProviders(latency=args.provider_latency)
+    bot.http_client.configure(providers.transport())
+    bot.user_store.open()
+    cities = register_cities(bot.city_registry)
+    rnd = random.Random(7)
+    for user_id in range(1, args.users + 1):
+        city_id = rnd.choice(cities)
+        bot.user_states[user_id] = bot.UserRecord.from_dict(
+            {"cities": [city_id], "notify_city": city_id, "send_time": "08:00"})
+        bot.alert_engine.index.set(user_id, bot.alert_city(bot.user_states[user_id]))
+    bot.send_queue = bot.SendQueue(global_rate=1e9, per_chat_rate=1e9, per_chat_burst=1e9, workers=64)
+    bot.send_queue.start(FakeBot())
+    passes = [await check_pass(bot, providers, payload, cities) for payload in payloads(rnd)]
+    await bot.send_queue.stop()
+    await bot.http_client.close()
+    frames = [bot.forecast_frame.ForecastFrame.from_payload(payload) for payload in payloads(random.Random(7))]
+    return {
+        "benchmark": "alerts",
+        "users": args.users,
+        "cities": len(cities),
+        "passes": passes,
+        "per_user_provider_requests": args.users,
+        "per_user_diff_seconds": per_user(bot, frames, args.users),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
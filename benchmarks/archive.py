@@ -0,0 +1,127 @@
+# Архив прогнозов за год по тысячам городов: запись ответа, сжатие суток, размер на диске,
+# чтение "вчера" для краткой сводки и недели для тренда (memmap), год одного города и удаление
+# старых суток. Данные за год пишутся сразу столбцами, как их дописали бы процессы бота.
+# Запуск: python benchmarks/archive.py [--cities 1000] [--days 365]
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from common import ROOT, make_payload  # noqa: F401  (добавляет корень репозитория в sys.path)
+from suite import pct
+from forecast_archive import COLUMNS, RAW_SUFFIX, ForecastArchive, day_name
+from forecast_frame import ForecastFrame
+
+TZ_OFFSET = 10800
+SLOTS = 8  # 3-часовых отрезков в сутках
+
+
+def write_raw(path, day, cities, fetches, rng):
+    # Сутки от одного процесса: fetches ответов на город, в каждом - все отрезки суток
+    n = len(cities) * SLOTS
+    city = np.repeat(cities, SLOTS)
+    dt = day * 86400 + np.tile(np.arange(SLOTS) * 10800, len(cities))
+    season = 10 - 15 * np.cos(2 * np.pi * (day % 365) / 365)
+    directory = os.path.join(path, day_name(day) + RAW_SUFFIX, "bench")
+    os.makedirs(directory)
+    files = {name: open(os.path.join(directory, name), "ab") for name in COLUMNS}
+    for i in range(fetches):
+        columns = {
+            "city": city, "dt": dt, "fetched": np.full(n, day * 86400 - 86400 + i * 3600),
+            "temp": season + rng.normal(0, 4, n), "wind": rng.uniform(0, 10, n),
+            "rain": np.where(rng.random(n) < 0.2, rng.uniform(0, 3, n), 0),
+            "humidity": rng.uniform(40, 99, n), "pressure": rng.uniform(990, 1030, n),
+            "clouds": rng.uniform(0, 100, n),
+        }
+        for name, dtype in COLUMNS.items():
+            files[name].write(columns[name].astype(dtype).tobytes())
+    for f in files.values():
+        f.close()
+
+
+def timed(fn, calls):
+    values = []
+    for args in calls:
+        started = time.perf_counter()
+        fn(*args)
+        values.append(time.perf_counter() - started)
+    return {"p50_us": round(pct(values, 0.5) * 1e6, 1), "p99_us": round(pct(values, 0.99) * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cities", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--fetches", type=int, default=3, help="ответов на город в сутки (версий прогноза)")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    path = tempfile.mkdtemp(prefix="weather_archive_")
+    rng = np.random.default_rng(1)
+    rnd = random.Random(1)
+    today = int(time.time() // 86400)
+    cities = np.arange(1, args.cities + 1)
+
+    # Запись ответа /forecast так, как её делает fetch_forecast
+    archive = ForecastArchive(path, retention_days=args.days + 10)
+    archive.open()
+    frames = [ForecastFrame.from_payload(make_payload(rnd)) for _ in range(50)]
+    append = timed(lambda i: archive.append(i, frames[i % len(frames)]), [(i,) for i in range(args.queries)])
+    archive.close()
+    for name in os.listdir(path):
+        shutil.rmtree(os.path.join(path, name))
+
+    started = time.perf_counter()
+    for day in range(today - args.days, today):
+        write_raw(path, day, cities, args.fetches, rng)
+    generated = time.perf_counter() - started
+    raw_bytes = archive.stats()["bytes"]
+    started = time.perf_counter()
+    compacted, _ = archive.compact()
+    compact_seconds = time.perf_counter() - started
+    stats = archive.stats()
+
+    # Чтение - новым экземпляром (как после перезапуска бота): memmap открываются по первому запросу
+    reader = ForecastArchive(path, retention_days=args.days + 10)
+    picks = [int(rnd.choice(cities)) for _ in range(args.queries)]
+    yesterday = (today - 1) * 86400 - TZ_OFFSET
+    brief = timed(reader.read, [(city, yesterday, yesterday + 86400) for city in picks])
+    trend = timed(reader.daylight_temps, [(city, TZ_OFFSET, today - 7, today - 1) for city in picks])
+    year_start = (today - args.days) * 86400
+    year = timed(reader.read, [(city, year_start, today * 86400) for city in picks[:20]])
+    dt, values = reader.read(picks[0], year_start, today * 86400)
+
+    # Удаление: оставляем последние 30 суток
+    started = time.perf_counter()
+    _, removed = ForecastArchive(path, retention_days=30).compact()
+    retention_seconds = time.perf_counter() - started
+    print(json.dumps({
+        "benchmark": "archive",
+        "cities": args.cities,
+        "days": args.days,
+        "append": append,
+        "generate_seconds": round(generated, 2),
+        "raw_mb": round(raw_bytes / 2 ** 20, 1),
+        "compacted_days": compacted,
+        "compact_seconds": round(compact_seconds, 2),
+        "compact_ms_per_day": round(compact_seconds / max(compacted, 1) * 1000, 2),
+        "archive_mb": round(stats["bytes"] / 2 ** 20, 1),
+        "bytes_per_city_day": round(stats["bytes"] / args.cities / args.days, 1),
+        "read_yesterday": brief,
+        "read_week_daylight": trend,
+        "read_year": year,
+        "year_rows": len(dt),
+        "year_temp_mean": round(float(statistics.mean(values["temp"])), 2),
+        "retention_removed": removed,
+        "retention_seconds": round(retention_seconds, 3),
+    }))
+    shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Серии повторных нажатий: каждый пользователь несколько раз подряд жмёт "Показать погоду".
+# Апдейты идут через webhook, как в benchmarks/webhook.py. Сравниваются прогоны со склейкой
+# повторов и без неё (coalesce=None): сколько ответов получил пользователь, сколько раз
+# выполнился обработчик и как быстро пришёл первый ответ.
+# Запуск: python benchmarks/bursts.py [--users 300] [--taps 5]
+import argparse
+import asyncio
+import itertools
+import json
+import tempfile
+import time
+from collections import defaultdict, deque
+
+from common import ROOT  # noqa: F401  (добавляет корень репозитория в sys.path)
+from fakes import FakeProviders, FakeRequest, import_bot
+from suite import pct
+from webhook import post_updates
+
+SETUP = ["/start", "Добавить город 🏙️", "Москва", "Москва", "Домой 🏠"]
+TAP = "Показать погоду 🌦️"
+
+
+async def wait_replies(replies, expected, timeout):
+    deadline = time.perf_counter() + timeout
+    while sum(len(r) for r in replies.values()) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def run_once(bot, args, coalesce, first_user):
+    replies = defaultdict(list)
+    first_reply = {}
+    burst_started = {}
+
+    def on_send(chat_id, text):
+        replies[chat_id].append(text)
+        if chat_id in burst_started and chat_id not in first_reply:
+            first_reply[chat_id] = time.perf_counter() - burst_started[chat_id]
+
+    # post_shutdown предыдущего прогона закрыл базу и остановил очередь отправки
+    bot.user_store.open()
+    bot.city_registry.open()
+    bot.send_queue = bot.SendQueue(global_rate=1e9, per_chat_rate=1e9, per_chat_burst=1e9, workers=64)
+    request = FakeRequest(latency=args.bot_latency, on_send=on_send)
+    app = bot.build_application("123456:TEST", request=request)
+    if not coalesce:
+        bot.update_processor.coalesce = None
+    server = await bot.start_webhook(app, url="https://bench.invalid/telegram")
+    users = range(first_user, first_user + args.users)
+    update_ids = itertools.count(1)
+    connections = min(args.connections, args.users)
+
+    async def send(updates):
+        lanes = [[] for _ in range(connections)]
+        for user_id, text in updates:
+            lanes[user_id % connections].append((user_id, text))
+        sent_at = defaultdict(deque)
+        await asyncio.gather(*(post_updates(server.port, bot.WEBHOOK_PATH, bot.WEBHOOK_SECRET, lane, update_ids, sent_at)
+                               for lane in lanes))
+
+    await send([(user_id, text) for text in SETUP for user_id in users])
+    await wait_replies(replies, args.users * len(SETUP), args.timeout)
+    replies.clear()
+
+    handled_before = bot.HANDLER_SECONDS.count(handler="weather")
+    started = time.perf_counter()
+    for user_id in users:
+        burst_started[user_id] = started
+    # Нажатия одного пользователя идут подряд, без ожидания ответа - как двойной тап
+    await send([(user_id, TAP) for _ in range(args.taps) for user_id in users])
+    await wait_replies(replies, args.users * (1 if coalesce else args.taps), args.timeout)
+    await asyncio.sleep(0.2)  # вдруг придут лишние ответы
+    elapsed = time.perf_counter() - started
+    handled = bot.HANDLER_SECONDS.count(handler="weather") - handled_before
+    await bot.stop_webhook(app, server)
+    latencies = list(first_reply.values())
+    return {
+        "coalesce": coalesce,
+        "users": args.users,
+        "taps": args.users * args.taps,
+        "handler_runs": handled,
+        "replies": sum(len(r) for r in replies.values()),
+        "users_without_reply": sum(1 for user_id in users if not replies.get(user_id)),
+        "first_reply_p50_ms": round(pct(latencies, 0.5) * 1000, 2) if latencies else None,
+        "first_reply_p99_ms": round(pct(latencies, 0.99) * 1000, 2) if latencies else None,
+        "seconds": round(elapsed, 3),
+        "coalesced": bot.update_processor.coalesced,
+    }
+
+
+async def run(args, workdir):
+    bot = import_bot(workdir, WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=0, WEBHOOK_SECRET="bench-secret",
+                     LOG_LEVEL="WARNING")
+    bot.http_client.configure(FakeProviders(latency=args.provider_latency).transport())
+    results = []
+    for i, coalesce in enumerate((False, True)):
+        results.append(await run_once(bot, args, coalesce, first_user=1 + i * args.users))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--taps", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    parser.add_argument("--bot-latency", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    for result in asyncio.run(run(args, tempfile.mkdtemp(prefix="weather_bursts_"))):
+        print(json.dumps({"benchmark": "bursts", **result}))
+
+
+if __name__ == '__main__':
+    main()
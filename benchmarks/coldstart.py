@@ -0,0 +1,172 @@
+# Холодный старт процесса бота: сколько стоит import main и какие тяжёлые зависимости он тянет,
+# сколько идёт main.py --check и через сколько после запуска процесса пользователь получает первый
+# ответ. Для последнего дочерний процесс поднимает бота в режиме webhook (Bot API и провайдеры -
+# заглушки), а этот процесс сразу шлёт ему апдейты - как Telegram, накопивший их за время простоя.
+# Запуск: python benchmarks/coldstart.py [--users 10000] [--repeat 5]
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from common import CITY_IDS, ROOT, make_state, register_cities
+
+HEAVY_MODULES = ("telegram", "telegram.ext", "apscheduler", "numpy", "httpx", "timezonefinder")
+TOKEN = "123456:BENCHMARKxxxxxxxxxxxxxxxxxxxxx"
+
+
+def bench_env(workdir):
+    env = dict(os.environ)
+    # Байткод пишется и используется, как в обычной установке: иначе каждый запуск компилирует исходники
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env.update(USER_DB_FILE=os.path.join(workdir, "users.db"), METRICS_PORT="0", LOG_LEVEL="WARNING",
+               TRANSLATION_CACHE_FILE=os.path.join(workdir, "translations.json"),
+               GEOCODE_CACHE_FILE=os.path.join(workdir, "geocode.json"),
+               TELEGRAM_TOKEN=TOKEN, OPENWEATHER_API_KEY="bench", WEBHOOK_LISTEN="127.0.0.1",
+               WEBHOOK_PORT="0", WEBHOOK_SECRET="bench-secret")
+    return env
+
+
+def run_python(workdir, *args, cwd=None):
+    # Файлы бота - в workdir (пути в окружении абсолютные); cwd=ROOT - для python -c "import main"
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, *args], cwd=cwd or workdir, env=bench_env(workdir),
+                            capture_output=True, text=True)
+    return time.perf_counter() - started, result
+
+
+def import_times(workdir, repeat):
+    run_python(workdir, "-c", "import main", cwd=ROOT)  # прогрев: байткод и файловый кэш
+    interpreter, wall, cumulative = [], [], []
+    for _ in range(repeat):
+        interpreter.append(run_python(workdir, "-c", "pass", cwd=ROOT)[0])
+        elapsed, result = run_python(workdir, "-X", "importtime", "-c", "import main", cwd=ROOT)
+        wall.append(elapsed)
+        # Строка "import time: self | cumulative | main" - последняя для модуля main
+        line = [row for row in result.stderr.splitlines() if row.rstrip().endswith("| main")][-1]
+        cumulative.append(int(line.split("|")[1]) / 1e6)
+    _, result = run_python(workdir, "-c", "import json, sys, main; "
+                           f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))", cwd=ROOT)
+    return {
+        "import_main_ms": round(statistics.median(cumulative) * 1000, 1),
+        "process_wall_ms": round(statistics.median(wall) * 1000, 1),
+        "interpreter_ms": round(statistics.median(interpreter) * 1000, 1),
+        "heavy_modules_loaded": json.loads(result.stdout),
+    }
+
+
+def check_time(workdir, repeat):
+    if not os.path.exists(os.path.join(ROOT, "config.py")):
+        return None  # в дереве без --check
+    runs = [run_python(workdir, os.path.join(ROOT, "main.py"), "--check") for _ in range(repeat)]
+    return {"check_wall_ms": round(statistics.median(elapsed for elapsed, _ in runs) * 1000, 1),
+            "exit_code": runs[-1][1].returncode}
+
+
+async def first_update(workdir, users):
+    # Секунды от запуска процесса: webhook слушает, ответ на /start, первый прогноз
+    from webhook import post_updates
+    started = time.perf_counter()
+    child = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), "--child", cwd=workdir, env=bench_env(workdir),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+    ready = json.loads(await child.stdout.readline())
+    listening = time.perf_counter() - started
+    update_ids = itertools.count(1)
+    sent_at = defaultdict(list)
+    # Пользователь 1 есть в базе, и у него выбран город: "Показать погоду" сразу даёт прогноз
+    await post_updates(ready["port"], "/telegram", "bench-secret",
+                       [(10 ** 9, "/start"), (1, "Показать погоду 🌦️")], update_ids, sent_at)
+    replies = {}
+    while len(replies) < 2:
+        reply = json.loads(await child.stdout.readline())
+        replies.setdefault(reply["chat_id"], time.perf_counter() - started)
+    child.stdin.close()
+    await child.wait()
+    return {
+        "users": users,
+        "listening_s": round(listening, 3),
+        "first_reply_s": round(replies[10 ** 9], 3),
+        "first_forecast_s": round(replies[1], 3),
+        "child_import_s": ready["import_s"],
+        "child_load_s": ready["load_s"],
+        "child_start_s": ready["start_s"],
+    }
+
+
+def child():
+    # Дочерний процесс: настоящий main поверх заглушек. fakes импортируется после загрузки
+    # пользователей: он тянет telegram, и это время попадает в start_s, как и у бота без заглушек
+    started = time.perf_counter()
+    import main as bot
+    imported = time.perf_counter()
+    bot.load_user_states()
+    bot.restore_subscriptions()
+    loaded = time.perf_counter()
+    from fakes import FakeProviders, FakeRequest
+
+    def on_send(chat_id, text):
+        print(json.dumps({"chat_id": chat_id}), flush=True)
+
+    async def serve():
+        bot.http_client.configure(FakeProviders().transport())
+        app = bot.build_application(bot.TELEGRAM_TOKEN, request=FakeRequest(on_send=on_send))
+        server = await bot.start_webhook(app, url=None)
+        print(json.dumps({"port": server.port, "import_s": round(imported - started, 3),
+                          "load_s": round(loaded - imported, 3),
+                          "start_s": round(time.perf_counter() - loaded, 3)}), flush=True)
+        await asyncio.to_thread(sys.stdin.read)
+        await bot.stop_webhook(app, server)
+
+    asyncio.run(serve())
+
+
+def seed(users):
+    # База с пользователями; отдельным процессом, чтобы замеряющий процесс не держал импортированный main
+    import main as bot
+    rnd = random.Random(1)
+    bot.user_store.open()
+    register_cities(bot.city_registry)
+    rows = [(user_id, json.dumps(make_state(rnd), ensure_ascii=False)) for user_id in range(1, users + 1)]
+    # Пользователь 1 получает прогноз по первому городу без выбора из списка
+    rows[0] = (1, json.dumps({"cities": [CITY_IDS[0]], "notify_city": CITY_IDS[0], "send_time": None}))
+    bot.user_store._write(rows, [])
+    bot.user_store.close()
+    bot.city_registry.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+    if args.seed:
+        seed(args.users)
+        return
+    workdir = tempfile.mkdtemp(prefix="weather_coldstart_")
+    _, result = run_python(workdir, os.path.abspath(__file__), "--seed", "--users", str(args.users))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    result = {"benchmark": "coldstart", **import_times(workdir, args.repeat)}
+    result.update(check_time(workdir, args.repeat) or {})
+    runs = [asyncio.run(first_update(workdir, args.users)) for _ in range(args.repeat)]
+    for key in ("listening_s", "first_reply_s", "first_forecast_s", "child_import_s", "child_load_s", "child_start_s"):
+        result[key] = round(statistics.median(run[key] for run in runs), 3)
+    result["users"] = args.users
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
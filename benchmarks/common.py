@@ -0,0 +1,58 @@
+# Общие данные для бенчмарков. Скрипты запускаются из корня репозитория: python benchmarks/<name>.py
+import datetime
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+CITIES = [
+    ("Москва", "Europe/Moscow"), ("Санкт-Петербург", "Europe/Moscow"), ("Новосибирск", "Asia/Novosibirsk"),
+    ("Екатеринбург", "Asia/Yekaterinburg"), ("Казань", "Europe/Moscow"), ("Владивосток", "Asia/Vladivostok"),
+    ("Калининград", "Europe/Kaliningrad"), ("Самара", "Europe/Samara"), ("Омск", "Asia/Omsk"),
+    ("Иркутск", "Asia/Irkutsk"), ("Минск", "Europe/Minsk"), ("Алматы", "Asia/Almaty"),
+]
+TIMES = ["07:00", "07:30", "08:00", "08:30", "09:00", "18:00", "19:00", "06:45"]
+
+
+# id городов CITIES в свежем реестре бота (см. register_cities): 1, 2, ... по порядку
+CITY_IDS = tuple(range(1, len(CITIES) + 1))
+
+
+def register_cities(registry, tz=None):
+    # Города CITIES в реестре бота, с условными координатами; tz - один пояс для всех вместо своих
+    registry.open()
+    return [registry.add(name, 50 + i, 30 + 5 * i, tz or city_tz).id for i, (name, city_tz) in enumerate(CITIES)]
+
+
+def make_state(rnd):
+    picked = rnd.sample(CITY_IDS, rnd.randint(1, 3))
+    state = {
+        "cities": picked,
+        "send_time": rnd.choice(TIMES) if rnd.random() < 0.8 else None,
+        "notify_city": picked[0],
+    }
+    return state
+
+
+def make_payload(rnd, start=None, tz_offset=10800):
+    # Синтетический ответ /forecast: 40 трёхчасовых отрезков, как у OpenWeather
+    start = start or datetime.datetime(2026, 10, 18, tzinfo=datetime.timezone.utc)
+    descs = ["ясно", "облачно с прояснениями", "небольшой дождь", "пасмурно", "дождь", "снег"]
+    items = []
+    for i in range(40):
+        moment = start + datetime.timedelta(hours=3 * i)
+        desc = rnd.choice(descs)
+        item = {
+            "dt": int(moment.timestamp()),
+            "dt_txt": moment.strftime("%Y-%m-%d %H:%M:%S"),
+            "main": {"temp": round(rnd.uniform(-5, 20), 2), "humidity": rnd.randint(40, 99), "pressure": rnd.randint(990, 1030)},
+            "weather": [{"description": desc}],
+            "wind": {"speed": round(rnd.uniform(0, 10), 2)},
+            "clouds": {"all": rnd.randint(0, 100)},
+        }
+        if "дождь" in desc:
+            item["rain"] = {"3h": round(rnd.uniform(0.1, 3), 2)}
+        items.append(item)
+    return {"cod": "200", "cnt": 40, "list": items, "city": {"name": "Moscow", "timezone": tz_offset}}
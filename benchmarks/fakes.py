@@ -0,0 +1,179 @@
+# Заглушки для офлайн-бенчмарков: ответы провайдеров из fixtures/, бот и апдейты Telegram без сети.
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import time
+from collections import Counter
+
+import httpx
+from telegram import Chat, Message, Update, User
+from telegram.request import BaseRequest
+
+from common import ROOT  # noqa: F401  (добавляет корень репозитория в sys.path)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Ответ getMe
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "WeatherBot", "username": "weather_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeProviders:
+    # Отвечает на запросы OpenWeather, TimezoneDB и libretranslate записанными ответами.
+    # outage - имитация сбоя: HTTP-статус (например, 503) или "hang" - ответа нет вовсе;
+    # error_rate - доля запросов, на которые отвечаем 503 (errors - сколько их было).
+    # spread=False - все города рядом с Москвой, в одном часовом поясе
+    def __init__(self, latency=0.0, error_rate=0.0, spread=True):
+        self.latency = latency
+        self.outage = None
+        self.error_rate = error_rate
+        self.spread = spread
+        self.errors = 0
+        self.calls = Counter()
+        self.responses = {
+            "/geo/1.0/direct": load_fixture("geocode"),
+            "/v2.1/get-time-zone": load_fixture("timezonedb"),
+            "/translate": load_fixture("translate"),
+            "/data/2.5/forecast": load_fixture("forecast"),
+        }
+
+    async def handle(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.url.path
+        self.calls[path] += 1
+        if self.outage == "hang":
+            # Как зависший сервер: соединение есть, ответа нет, пока клиент не сдастся по таймауту
+            timeout = request.extensions.get("timeout", {}).get("read") or 10.0
+            await asyncio.sleep(timeout)
+            raise httpx.ReadTimeout("read timed out", request=request)
+        if self.outage is not None:
+            return httpx.Response(self.outage, json={"cod": str(self.outage), "message": "unavailable"})
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return httpx.Response(503, json={"cod": "503", "message": "unavailable"})
+        data = self.responses.get(path)
+        if path == "/geo/1.0/direct":
+            data = self.geocode(request.url.params.get("q", ""))
+        if data is None:
+            return httpx.Response(404, json={"cod": "404", "message": "not found"})
+        return httpx.Response(200, json=data)
+
+    def geocode(self, query):
+        # Свои координаты для каждого названия (по хешу), иначе все города склеились бы в один
+        digest = hashlib.blake2b(query.lower().encode(), digest_size=4).digest()
+        if self.spread:
+            lat = 40 + digest[0] / 255 * 25
+            lon = 20 + int.from_bytes(digest[1:3], "big") / 65535 * 120
+        else:
+            lat = 55 + digest[0] / 255
+            lon = 37 + int.from_bytes(digest[1:3], "big") / 65535
+        return [{**self.responses["/geo/1.0/direct"][0], "name": query, "local_names": {"ru": query},
+                 "lat": round(lat, 4), "lon": round(lon, 4)}]
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+
+class FakeBot:
+    # Вместо Bot API: запоминает количество отправок, по желанию с задержкой
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        return None
+
+
+class FakeRequest(BaseRequest):
+    # Сетевой слой Bot API: настоящий Bot сериализует запросы, а ответы приходят отсюда.
+    # on_send(chat_id, text) вызывается на каждый sendMessage - по нему харнесс считает задержку.
+    def __init__(self, latency=0.0, on_send=None):
+        self.latency = latency
+        self.on_send = on_send
+        self.calls = Counter()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method == "sendMessage":
+            self._message_id += 1
+            chat_id = int(params["chat_id"])
+            if self.on_send is not None:
+                self.on_send(chat_id, params.get("text"))
+            result = {"message_id": self._message_id, "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "text": params.get("text")}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class WorkerSetup:
+    # Вызывается в процессе-воркере (см. workers.serve_worker): провайдеры - из fixtures/,
+    # Bot API - настоящий Bot поверх FakeRequest, чтобы сериализация запросов стоила как в бою
+    def __init__(self, provider_latency=0.0, bot_latency=0.0):
+        self.provider_latency = provider_latency
+        self.bot_latency = bot_latency
+
+    def __call__(self):
+        import http_client
+        from telegram import Bot
+        http_client.configure(FakeProviders(self.provider_latency).transport())
+        return Bot("123456:TEST", request=FakeRequest(self.bot_latency))
+
+
+def import_bot(workdir, **env):
+    # Все файлы бота (база, кэши) - во временном каталоге; env - дополнительные настройки до импорта
+    os.chdir(workdir)
+    os.environ["USER_DB_FILE"] = os.path.join(workdir, "users.db")
+    os.environ["TRANSLATION_CACHE_FILE"] = os.path.join(workdir, "translations.json")
+    os.environ["GEOCODE_CACHE_FILE"] = os.path.join(workdir, "geocode.json")
+    os.environ.setdefault("METRICS_PORT", "0")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    import main as bot
+    return bot
+
+
+def update_payload(text, user_id, update_id):
+    # Апдейт в том виде, в каком его присылает Telegram
+    message = {"message_id": update_id, "date": int(time.time()),
+               "chat": {"id": user_id, "type": "private"},
+               "from": {"id": user_id, "is_bot": False, "first_name": "user"}, "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def make_update(text, user_id=1, update_id=1):
+    user = User(user_id, "user", False)
+    message = Message(update_id, datetime.datetime.now(datetime.timezone.utc), Chat(user_id, "private"),
+                      from_user=user, text=text)
+    return Update(update_id, message=message)
@@ -0,0 +1,150 @@
+# Форматирование прогноза: старые циклы по data['list'] против ForecastFrame.
+# Запуск: python benchmarks/forecast.py [число ответов]
+import json
+import random
+import sys
+import time
+
+from common import make_payload
+
+import main as bot
+from forecast_frame import ForecastFrame, daily_summary, daylight_summary
+
+
+# Реализация до перехода на ForecastFrame, для сравнения
+def legacy_brief(city, data):
+    temps, winds, rain_hours = [], [], []
+    for item in data['list']:
+        hour = int(item['dt_txt'][11:13])
+        if 6 <= hour <= 21:
+            temps.append(item['main']['temp'])
+            winds.append(item['wind']['speed'])
+            if 'rain' in item and item['rain'].get('3h', 0) > 0:
+                rain_hours.append(item['dt_txt'][11:16])
+    if not temps:
+        return f"Нет данных о прогнозе на световой день для {city}."
+    temp_max = max(temps)
+    temp_min = min(temps)
+    wind_avg = round(sum(winds) / len(winds), 1)
+    rain_hours = sorted(set(rain_hours), key=lambda x: x)
+    rain_ranges = []
+    if rain_hours:
+        start = end = rain_hours[0]
+        for h in rain_hours[1:]:
+            prev_hour = int(end[:2])
+            curr_hour = int(h[:2])
+            if curr_hour == prev_hour + 3:
+                end = h
+            else:
+                rain_ranges.append((start, end))
+                start = end = h
+        rain_ranges.append((start, end))
+        # Если дождь почти весь день (например, с 6 до 21)
+        day_start, day_end = "06:00", "21:00"
+        if len(rain_ranges) == 1 and rain_ranges[0][0] == day_start and rain_ranges[0][1] == day_end:
+            rain_text = "Дождь весь день"
+        elif len(rain_ranges) == 1 and rain_ranges[0][0] == rain_ranges[0][1]:
+            rain_text = f"Дождь ожидается в {rain_ranges[0][0]}"
+        else:
+            rain_text = "Дождь:\n" + '\n'.join([f"• с {r[0]} по {r[1]}" if r[0] != r[1] else f"• в {r[0]}" for r in rain_ranges])
+    else:
+        rain_text = "Без дождя"
+    return f"{city}:\n{rain_text}\nВетер: {wind_avg} м/с\nТемпература: от {temp_min}°C до {temp_max}°C"
+
+def legacy_5days(city, data):
+    import datetime
+    days = {}
+    for item in data['list']:
+        date = item['dt_txt'][:10]
+        temp = item['main']['temp']
+        desc = item['weather'][0]['description']
+        wind = item['wind']['speed']
+        humidity = item['main'].get('humidity')
+        pressure = item['main'].get('pressure')
+        rain = item.get('rain', {}).get('3h', 0)
+        clouds = item.get('clouds', {}).get('all', 0)
+        if date not in days:
+            days[date] = {"temps": [], "descs": [], "winds": [], "humidity": [], "pressure": [], "rain": [], "clouds": []}
+        days[date]["temps"].append(temp)
+        days[date]["descs"].append(desc)
+        days[date]["winds"].append(wind)
+        days[date]["humidity"].append(humidity)
+        days[date]["pressure"].append(pressure)
+        days[date]["rain"].append(rain)
+        days[date]["clouds"].append(clouds)
+    msg = f"Прогноз на 5 дней для {city}:\n"
+    weather_emojis = {
+        "ясно": "☀️",
+        "облачно": "☁️",
+        "дождь": "🌧️",
+        "небольшой дождь": "🌦️",
+        "гроза": "⛈️",
+        "снег": "❄️",
+        "переменная облачность": "🌤️",
+        "облачно с прояснениями": "🌤️",
+        "туман": "🌫️"
+    }
+    for i, (date, info) in enumerate(days.items()):
+        if i >= 5:
+            break
+        dt = datetime.datetime.strptime(date, "%Y-%m-%d")
+        weekday = dt.strftime("%A")
+        weekday_ru = {
+            "Monday": "Пн",
+            "Tuesday": "Вт",
+            "Wednesday": "Ср",
+            "Thursday": "Чт",
+            "Friday": "Пт",
+            "Saturday": "Сб",
+            "Sunday": "Вс"
+        }[weekday]
+        date_fmt = dt.strftime("%d.%m.%Y")
+        t_min = int(min(info["temps"]))
+        t_max = int(max(info["temps"]))
+        wind_avg = round(sum(info["winds"]) / len(info["winds"]), 1)
+        rain_sum = round(sum(info["rain"]), 1)
+        desc_main = max(set(info["descs"]), key=info["descs"].count).capitalize()
+        emoji = ""
+        for k, v in weather_emojis.items():
+            if k in desc_main.lower():
+                emoji = v
+                break
+        msg += f"\n{weekday_ru} {date_fmt} {emoji} {desc_main}: {t_min}…{t_max}°C, 💨 {wind_avg} м/с"
+        if rain_sum > 0:
+            msg += f", 🌧️ {rain_sum} мм"
+    return msg
+
+
+def timed(fn, items):
+    started = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rnd = random.Random(1)
+    payloads = [make_payload(rnd) for _ in range(count)]
+
+    legacy = timed(lambda p: (legacy_brief("Москва", p), legacy_5days("Москва", p)), payloads)
+    started = time.perf_counter()
+    frames = [ForecastFrame.from_payload(p) for p in payloads]
+    parse = time.perf_counter() - started
+    reductions = timed(lambda f: (daylight_summary(f), daily_summary(f)), frames)
+    formatted = timed(lambda f: (bot.format_weather_brief("Москва", f), bot.format_weather_5days("Москва", f)), frames)
+
+    print(json.dumps({
+        "benchmark": "forecast",
+        "payloads": count,
+        "legacy_us_per_payload": round(legacy / count * 1e6, 1),
+        "parse_us_per_payload": round(parse / count * 1e6, 1),
+        "reductions_us_per_payload": round(reductions / count * 1e6, 1),
+        "format_us_per_payload": round(formatted / count * 1e6, 1),
+        "legacy_format_payloads_per_s": round(count / legacy),
+        "cached_format_payloads_per_s": round(count / formatted),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Поведение при сбое сервиса погоды: прогнозы городов успели устареть, и в этот момент провайдер
+# начинает отвечать 503 или перестаёт отвечать вовсе. Меряется, сколько ждёт пользователь,
+# сколько ответов пришло с устаревшим прогнозом, сколько с ошибкой и сколько запросов ушло провайдеру.
+# --unprotected - для сравнения: без предохранителей, повторов и устаревших прогнозов.
+# Запуск: python benchmarks/outage.py [--outage 503|hang] [--requests 2000]
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+
+import httpx
+
+from common import register_cities
+from fakes import FakeProviders, import_bot
+from suite import pct
+
+ERROR_PREFIXES = ("Ошибка", "Сервис погоды временно недоступен", "Не удалось")
+
+
+async def ask(bot, cities, concurrency):
+    latencies = []
+    texts = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(city):
+        async with limit:
+            started = time.perf_counter()
+            texts.append(await bot.get_weather_brief(city))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(city) for city in cities))
+    return latencies, texts, time.perf_counter() - started
+
+
+def summarize(latencies, texts, elapsed):
+    return {
+        "seconds": round(elapsed, 3),
+        "latency_p50_ms": round(pct(latencies, 0.5) * 1000, 2),
+        "latency_p99_ms": round(pct(latencies, 0.99) * 1000, 2),
+        "fresh": sum(1 for t in texts if not t.startswith("⚠️") and not t.startswith(ERROR_PREFIXES)),
+        "stale": sum(1 for t in texts if t.startswith("⚠️")),
+        "errors": sum(1 for t in texts if t.startswith(ERROR_PREFIXES)),
+    }
+
+
+async def run(args):
+    env = {"FORECAST_CACHE_TTL": 1, "LOG_LEVEL": "ERROR"}
+    if args.unprotected:
+        env.update(FORECAST_STALE_TTL=0, BREAKER_THRESHOLD=10 ** 9, HTTP_RETRIES=0)
+    bot = import_bot(tempfile.mkdtemp(prefix="weather_outage_"), **env)
+    # Таймаут зависшего провайдера короче боевого, чтобы прогон не занимал минуты
+    bot.http_client.ENDPOINT_TIMEOUTS["forecast"] = httpx.Timeout(args.timeout, connect=1.0)
+    providers = FakeProviders(latency=args.provider_latency)
+    bot.http_client.configure(providers.transport())
+    cities = [bot.city_registry.get(city_id) for city_id in register_cities(bot.city_registry)]
+    cached, cold = cities[:-2], cities[-2:]  # cold - ещё ни разу не запрашивались
+    await ask(bot, cached, len(cached))
+    await asyncio.sleep(1.1)  # все прогнозы просрочены
+
+    providers.outage = args.outage
+    before = sum(providers.calls.values())
+    rnd = random.Random(3)
+    outage = summarize(*await ask(bot, rnd.choices(cached + cold, k=args.requests), args.concurrency))
+    outage["provider_requests"] = sum(providers.calls.values()) - before
+    outage["breakers"] = {host: state for (host,), state in bot.http_client.breaker_states()}
+
+    # После сбоя: опрашиваем все города, пока каждый не ответит свежим прогнозом
+    providers.outage = None
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.recovery_limit:
+        latencies, texts, _ = await ask(bot, cached + cold, args.concurrency)
+        if summarize(latencies, texts, 0)["fresh"] == len(texts):
+            break
+        await asyncio.sleep(0.1)
+    recovered = {"seconds": round(time.perf_counter() - started, 3), "all_fresh": len(texts) == summarize(latencies, texts, 0)["fresh"]}
+    await bot.http_client.close()
+    return {"benchmark": "outage", "mode": args.outage, "unprotected": args.unprotected,
+            "requests": args.requests, "outage": outage, "recovered": recovered,
+            "forecast_cache": bot.forecast_cache.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outage", default="503", help="HTTP-статус или hang")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=3.0, help="таймаут чтения /forecast в прогоне")
+    parser.add_argument("--recovery-limit", type=float, default=60)
+    parser.add_argument("--unprotected", action="store_true")
+    args = parser.parse_args()
+    if args.outage != "hang":
+        args.outage = int(args.outage)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
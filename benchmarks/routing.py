@@ -0,0 +1,83 @@
+# Стоимость маршрутизации одного текстового апдейта: старая цепочка Regex-обработчиков
+# с каскадом флагов против словаря кнопок и шага диалога.
+# Запуск: python benchmarks/routing.py [повторов]
+import datetime
+import json
+import sys
+import time
+
+from common import ROOT  # noqa: F401  (добавляет корень репозитория в sys.path)
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import CommandHandler, MessageHandler, filters
+
+import main as bot
+from models import Dialog
+
+OLD_PATTERNS = [
+    "^Добавить город 🏙️$", "^Удалить город 🗑️$", "^Мои города 📋$", "^Расписание уведомлений 🕒$",
+    "^Остановить уведомления ❌$", "^Показать погоду 🌦️$", "^Посмотреть погоду 🌍$", "^Установить время ⏰$",
+    "^Помощь /help$|^/help$", "^Домой 🏠$",
+]
+OLD_FLAGS = ["choose_time_city_mode", "add_mode", "remove_mode", "choose_city_mode", "choose_time_mode", "custom_time_mode"]
+TEXTS = ["Добавить город 🏙️", "Домой 🏠", "Установить время ⏰", "Москва", "08:00", "Показать погоду 🌦️(пока нет)"]
+
+
+def make_update(text):
+    message = Message(1, datetime.datetime.now(), Chat(1, 'private'), from_user=User(1, 'u', False), text=text)
+    return Update(1, message=message)
+
+
+def old_route(handlers, fallback, state, update):
+    for handler in handlers:
+        if handler.check_update(update):
+            return handler
+    if fallback.check_update(update):
+        for flag in OLD_FLAGS:
+            if state.get(flag):
+                return flag
+    return None
+
+
+def new_route(handlers, text_handler, update):
+    for handler in handlers:
+        if handler.check_update(update):
+            return handler
+    if text_handler.check_update(update):
+        text = update.message.text
+        return bot.BUTTON_HANDLERS.get(text) or bot.DIALOG_HANDLERS.get(bot.get_dialog(update.effective_user.id))
+    return None
+
+
+def bench(fn, updates, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for update in updates:
+            fn(update)
+    return (time.perf_counter() - started) / (repeats * len(updates)) * 1e9
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    updates = [make_update(text) for text in TEXTS]
+    commands = [CommandHandler('start', bot.start), CommandHandler('help', bot.help_cmd)]
+    old_handlers = commands + [MessageHandler(filters.Regex(p), bot.help_cmd) for p in OLD_PATTERNS]
+    old_fallback = MessageHandler(filters.TEXT & ~filters.COMMAND, bot.city_handler)
+    new_text = MessageHandler(filters.TEXT & ~filters.COMMAND, bot.route_text)
+    old_state = {flag: False for flag in OLD_FLAGS}
+    old_state["custom_time_mode"] = True
+    bot.set_dialog(1, Dialog.CUSTOM_TIME)
+
+    old_ns = bench(lambda u: old_route(old_handlers, old_fallback, old_state, u), updates, repeats)
+    new_ns = bench(lambda u: new_route(commands, new_text, u), updates, repeats)
+    print(json.dumps({
+        "benchmark": "routing",
+        "updates": repeats * len(updates),
+        "regex_chain_ns_per_update": round(old_ns),
+        "table_ns_per_update": round(new_ns),
+        "speedup": round(old_ns / new_ns, 2),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+# Сквозная нагрузка на настоящий процесс бота: python main.py в режиме webhook, внешние сервисы -
+# стенды из standins.py. Пользователи проходят путь "добавить город -> выбрать время -> посмотреть
+# погоду", а затем все получают уведомление в одну и ту же минуту - как утренняя волна в 08:00,
+# только через --wave-lead секунд после старта. Отчёт: пропускная способность, p50/p99 задержки
+# ответов и доставки уведомлений, потерянные сообщения, ошибки от стендов и код выхода бота.
+# Запуск: python benchmarks/soak.py [--users 100] [--workers 0] [--provider-error-rate 0.02]
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import math
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from zoneinfo import ZoneInfo
+
+import httpx
+
+from common import ROOT
+from fakes import FakeProviders, update_payload
+from standins import BotApiServer, ProviderServers
+from suite import pct
+
+TOKEN = "123456:SOAKxxxxxxxxxxxxxxxxxxxxxxxxx"
+SECRET = "soak-secret"
+WEBHOOK_PATH = "/telegram"
+# Города стендов стоят рядом с Москвой (FakeProviders(spread=False)), время уведомления - московское
+TIMEZONE = ZoneInfo("Europe/Moscow")
+STEPS = [
+    ("start", "/start"),
+    ("add_city", "Добавить город 🏙️"),
+    ("city_input", "{city}"),
+    ("choose_city", "{city}"),
+    ("custom_time", "Ввести своё время"),
+    ("set_time", "{time}"),
+    ("weather", "Показать погоду 🌦️(пока нет)"),
+    ("five_days", "Посмотреть погоду(пока нет) 🌍"),
+]
+ERROR_PREFIXES = ("Ошибка", "Сервис погоды временно недоступен", "Не удалось")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def bot_env(args, workdir, providers, bot_api, port):
+    env = dict(os.environ)
+    env.update(providers.env())
+    env.update(TELEGRAM_TOKEN=TOKEN, TELEGRAM_API_URL=bot_api.url, OPENWEATHER_API_KEY="soak",
+               TIMEZONEDB_API_KEY="soak", WEBHOOK_URL="https://soak.invalid" + WEBHOOK_PATH,
+               WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=str(port), WEBHOOK_PATH=WEBHOOK_PATH, WEBHOOK_SECRET=SECRET,
+               USER_DB_FILE=os.path.join(workdir, "users.db"),
+               FORECAST_STORE_FILE=os.path.join(workdir, "forecasts.db"),
+               TRANSLATION_CACHE_FILE=os.path.join(workdir, "translations.json"),
+               GEOCODE_CACHE_FILE=os.path.join(workdir, "geocode.json"),
+               METRICS_PORT="0", LOG_LEVEL="WARNING", WORKERS=str(args.workers),
+               TELEGRAM_GLOBAL_RATE=str(args.telegram_rate), PREFETCH_JITTER="1")
+    return env
+
+
+async def start_bot(args, workdir, providers, bot_api):
+    port = free_port()
+    log = open(os.path.join(workdir, "bot.log"), "wb")
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, "main.py"), cwd=workdir,
+        env=bot_env(args, workdir, providers, bot_api, port), stdout=log, stderr=log)
+    # Бот готов, когда зарегистрировал webhook: к этому моменту его HTTP сервер уже слушает
+    deadline = time.monotonic() + args.start_timeout
+    while not bot_api.calls["setWebhook"]:
+        if process.returncode is not None or time.monotonic() > deadline:
+            raise RuntimeError("бот не запустился, см. " + log.name)
+        await asyncio.sleep(0.05)
+    return process, port
+
+
+def summary(values, scale=1000, digits=1):
+    if not values:
+        return None, None
+    return round(pct(values, 0.5) * scale, digits), round(pct(values, 0.99) * scale, digits)
+
+
+async def run(args, workdir):
+    replies = defaultdict(asyncio.Queue)  # chat_id -> (время получения, текст) на шаге настройки
+    notified = defaultdict(list)  # chat_id -> время получения уведомлений
+    phase = "setup"
+
+    def on_send(chat_id, text):
+        if phase == "setup":
+            replies[chat_id].put_nowait((time.perf_counter(), text))
+        else:
+            notified[chat_id].append(time.time())
+
+    providers = ProviderServers(FakeProviders(latency=args.provider_latency, error_rate=args.provider_error_rate,
+                                              spread=False))
+    bot_api = BotApiServer(TOKEN, latency=args.bot_latency, error_rate=args.bot_error_rate,
+                           error_status=args.bot_error_status, on_send=on_send)
+    await providers.start()
+    await bot_api.start()
+    started = time.perf_counter()
+    process, port = await start_bot(args, workdir, providers, bot_api)
+    startup = time.perf_counter() - started
+
+    # Уведомление - в начале минуты, не раньше чем через --wave-lead секунд
+    wave_at = math.ceil((time.time() + args.wave_lead) / 60) * 60
+    wave_time = datetime.datetime.fromtimestamp(wave_at, TIMEZONE).strftime("%H:%M")
+    cities = [f"Город {i}" for i in range(1, args.cities + 1)]
+    latencies = defaultdict(list)
+    error_replies = 0
+    dropped = 0
+    update_ids = itertools.count(1)
+    url = f"http://127.0.0.1:{port}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async def user(client, user_id):
+        nonlocal error_replies, dropped
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        city = cities[user_id % len(cities)]
+        for step, template in STEPS:
+            text = template.format(city=city, time=wave_time)
+            sent = time.perf_counter()
+            response = await client.post(url, json=update_payload(text, user_id, next(update_ids)), headers=headers)
+            response.raise_for_status()
+            try:
+                received, reply = await asyncio.wait_for(replies[user_id].get(), args.step_timeout)
+            except asyncio.TimeoutError:
+                # Ответ потерян: дальше диалог всё равно разойдётся с ожидаемым
+                dropped += len(STEPS) - [name for name, _ in STEPS].index(step)
+                return False
+            latencies[step].append(received - sent)
+            if reply and reply.startswith(ERROR_PREFIXES):
+                error_replies += 1
+            await asyncio.sleep(random.uniform(0, args.think))
+        return True
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    setup_started = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        completed = await asyncio.gather(*(user(client, user_id) for user_id in range(1, args.users + 1)))
+    setup_seconds = time.perf_counter() - setup_started
+    late = time.time() > wave_at - 1
+    extra_replies = sum(queue.qsize() for queue in replies.values())
+
+    phase = "wave"
+    subscribed = sum(completed)
+    deadline = wave_at + args.wave_timeout
+    while time.time() < deadline and sum(1 for times in notified.values() if times) < subscribed:
+        await asyncio.sleep(0.1)
+    process.send_signal(signal.SIGTERM)
+    exit_code = await asyncio.wait_for(process.wait(), 60)
+    await bot_api.stop()
+    await providers.stop()
+
+    delays = [times[0] - wave_at for times in notified.values()]
+    all_latencies = [value for values in latencies.values() for value in values]
+    updates = len(all_latencies)
+    delivered = sum(1 for times in notified.values() if times)
+    wave_span = max(t for times in notified.values() for t in times) - wave_at if delivered else None
+    p50, p99 = summary(all_latencies)
+    delay_p50, delay_p99 = summary(delays, scale=1, digits=3)
+    return {
+        "benchmark": "soak",
+        "users": args.users,
+        "workers": args.workers,
+        "startup_s": round(startup, 3),
+        "setup": {
+            "updates": updates,
+            "seconds": round(setup_seconds, 3),
+            "updates_per_s": round(updates / setup_seconds, 1),
+            "latency_p50_ms": p50,
+            "latency_p99_ms": p99,
+            "steps_p50_ms": {step: summary(values)[0] for step, values in latencies.items()},
+            "dropped_replies": dropped,
+            "extra_replies": extra_replies,
+            "error_replies": error_replies,
+            "finished_after_wave": late,
+        },
+        "wave": {
+            "at": wave_time,
+            "subscribed": subscribed,
+            "delivered": delivered,
+            "dropped": subscribed - delivered,
+            "duplicates": sum(len(times) - 1 for times in notified.values() if times),
+            "delay_p50_s": delay_p50,
+            "delay_p99_s": delay_p99,
+            "messages_per_s": round(delivered / wave_span, 1) if wave_span else None,
+        },
+        "injected": {"provider_errors": providers.providers.errors, "bot_api_errors": bot_api.errors},
+        "provider_requests": dict(providers.providers.calls),
+        "bot_api_calls": dict(bot_api.calls),
+        "bot_exit_code": exit_code,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--cities", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=0, help="WORKERS бота")
+    parser.add_argument("--connections", type=int, default=40, help="как max_connections у setWebhook")
+    parser.add_argument("--ramp", type=float, default=5.0, help="пользователи начинают в течение стольких секунд")
+    parser.add_argument("--think", type=float, default=0.5, help="пауза пользователя между шагами, до")
+    parser.add_argument("--telegram-rate", type=float, default=30, help="TELEGRAM_GLOBAL_RATE бота")
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    parser.add_argument("--provider-error-rate", type=float, default=0.0)
+    parser.add_argument("--bot-latency", type=float, default=0.02)
+    parser.add_argument("--bot-error-rate", type=float, default=0.0)
+    parser.add_argument("--bot-error-status", type=int, default=429)
+    parser.add_argument("--wave-lead", type=float, default=60, help="через сколько секунд после старта волна")
+    parser.add_argument("--wave-timeout", type=float, default=60)
+    parser.add_argument("--step-timeout", type=float, default=30)
+    parser.add_argument("--start-timeout", type=float, default=60)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="weather_soak_")
+    print(json.dumps(asyncio.run(run(args, workdir)), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
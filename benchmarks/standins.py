@@ -0,0 +1,148 @@
+# Локальные стенды вместо внешних сервисов для сквозных прогонов настоящего процесса бота (main.py):
+# Bot API (TELEGRAM_API_URL) и OpenWeather, TimezoneDB, libretranslate (OPENWEATHER_URL, TIMEZONEDB_URL,
+# TRANSLATE_URL) - HTTP-серверы на 127.0.0.1 с настраиваемой задержкой и долей ошибок.
+# Отдельно: python benchmarks/standins.py - поднимает стенды и печатает окружение для main.py
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+from urllib.parse import parse_qs
+
+import httpx
+
+from common import ROOT  # noqa: F401  (добавляет корень репозитория в sys.path)
+from fakes import BOT_USER, FakeProviders
+from http_server import HttpServer
+
+# Переменная окружения бота -> пути, которые обслуживает этот сервис
+PROVIDER_PATHS = {
+    "OPENWEATHER_URL": ("/geo/1.0/direct", "/data/2.5/forecast"),
+    "TIMEZONEDB_URL": ("/v2.1/get-time-zone",),
+    "TRANSLATE_URL": ("/translate",),
+}
+BOT_METHODS = ("getMe", "setWebhook", "deleteWebhook", "getWebhookInfo", "getUpdates", "sendMessage",
+               "setMyCommands", "close", "logOut")
+
+
+class ProviderServers:
+    # Каждый сервис - на своём порту (предохранители у бота - на хост), ответы - от FakeProviders
+    def __init__(self, providers, host="127.0.0.1"):
+        self.providers = providers
+        self.host = host
+        self.servers = {name: HttpServer(host, 0) for name in PROVIDER_PATHS}
+
+    async def start(self):
+        for name, server in self.servers.items():
+            for path in PROVIDER_PATHS[name]:
+                server.route("GET", path, self.handle)
+                server.route("POST", path, self.handle)
+            await server.start()
+
+    async def stop(self):
+        for server in self.servers.values():
+            await server.stop()
+
+    def env(self):
+        return {name: f"http://{self.host}:{server.port}" for name, server in self.servers.items()}
+
+    async def handle(self, request):
+        params = {key: values[-1] for key, values in request.query.items()}
+        response = await self.providers.handle(
+            httpx.Request(request.method, f"http://{self.host}{request.path}", params=params))
+        return response.status_code, "application/json", response.content
+
+
+class BotApiServer:
+    # Bot API: sendMessage уходит в on_send(chat_id, text), остальные методы просто отвечают "ok".
+    # error_rate - доля sendMessage, на которые отвечаем error_status: 429 с retry_after, как flood
+    # control Telegram (бот повторит отправку), или, например, 502 (сообщение не дойдёт)
+    def __init__(self, token, latency=0.0, error_rate=0.0, error_status=429, retry_after=1, on_send=None,
+                 host="127.0.0.1"):
+        self.token = token
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.on_send = on_send
+        self.calls = Counter()
+        self.errors = 0
+        self._message_id = 0
+        self.server = HttpServer(host, 0)
+
+    @property
+    def url(self):
+        return f"http://{self.server.host}:{self.server.port}"
+
+    async def start(self):
+        for method in BOT_METHODS:
+            self.server.route("POST", f"/bot{self.token}/{method}", self._handler(method))
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+    def _handler(self, method):
+        async def handle(request):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            self.calls[method] += 1
+            if request.headers.get("content-type", "").startswith("application/json"):
+                params = json.loads(request.body or b"{}")
+            else:
+                params = {key: values[-1] for key, values in parse_qs(request.body.decode()).items()}
+            if method != "sendMessage":
+                return self._ok(BOT_USER if method == "getMe" else True)
+            if self.error_rate and random.random() < self.error_rate:
+                self.errors += 1
+                return self._error()
+            self._message_id += 1
+            chat_id = int(params["chat_id"])
+            if self.on_send is not None:
+                self.on_send(chat_id, params.get("text"))
+            return self._ok({"message_id": self._message_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+                             "text": params.get("text")})
+        return handle
+
+    def _ok(self, result):
+        return 200, "application/json", json.dumps({"ok": True, "result": result})
+
+    def _error(self):
+        body = {"ok": False, "error_code": self.error_status, "description": "injected error"}
+        if self.error_status == 429:
+            body.update(description=f"Too Many Requests: retry after {self.retry_after}",
+                        parameters={"retry_after": self.retry_after})
+        return self.error_status, "application/json", json.dumps(body)
+
+
+async def serve(args):
+    providers = ProviderServers(FakeProviders(latency=args.provider_latency, error_rate=args.provider_error_rate))
+    bot_api = BotApiServer(args.token, latency=args.bot_latency, error_rate=args.bot_error_rate,
+                           on_send=lambda chat_id, text: print(f"-> {chat_id}: {text}", flush=True))
+    await providers.start()
+    await bot_api.start()
+    env = {**providers.env(), "TELEGRAM_API_URL": bot_api.url, "TELEGRAM_TOKEN": args.token}
+    print(json.dumps(env), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await bot_api.stop()
+        await providers.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--token", default="123456:STANDINxxxxxxxxxxxxxxxxxxxxxx")
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    parser.add_argument("--provider-error-rate", type=float, default=0.0)
+    parser.add_argument("--bot-latency", type=float, default=0.02)
+    parser.add_argument("--bot-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Время старта и пиковая память при восстановлении N пользователей из базы.
+# Запуск: python benchmarks/startup.py [N]
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import make_state, register_cities
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    workdir = tempfile.mkdtemp(prefix="weather_bench_")
+    os.chdir(workdir)
+    os.environ["USER_DB_FILE"] = os.path.join(workdir, "users.db")
+    import main as bot
+
+    rnd = random.Random(1)
+    bot.user_store.open()
+    register_cities(bot.city_registry)
+    bot.user_store._write([(user_id, json.dumps(make_state(rnd), ensure_ascii=False))
+                           for user_id in range(1, users + 1)], [])
+    bot.user_store.close()
+
+    started = time.perf_counter()
+    bot.load_user_states()
+    loaded = time.perf_counter()
+    restored = bot.restore_subscriptions()
+    done = time.perf_counter()
+
+    # Память меряем вторым проходом: tracemalloc сильно замедляет загрузку
+    bot.user_store.close()
+    bot.user_states = {}
+    bot.dispatcher = bot.NotificationDispatcher()
+    tracemalloc.start()
+    bot.load_user_states()
+    bot.restore_subscriptions()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        "benchmark": "startup",
+        "users": users,
+        "subscriptions": restored,
+        "buckets": len(bot.dispatcher.buckets),
+        "load_seconds": round(loaded - started, 3),
+        "restore_seconds": round(done - loaded, 3),
+        "total_seconds": round(done - started, 3),
+        "peak_traced_mb": round(peak / 2**20, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# Офлайн-набор бенчмарков: обработчики, форматирование прогноза, сохранение, рассылка.
+# Запуск: python benchmarks/suite.py [--out results.json] [--baseline old.json]
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+from common import make_state, register_cities
+from fakes import FakeBot, FakeProviders, import_bot, load_fixture, make_update
+
+# Сценарий нового пользователя: (имя шага в отчёте, текст сообщения)
+FLOW = [
+    ("start", "/start"),
+    ("add_city", "Добавить город 🏙️"),
+    ("add_city_input", "Москва"),
+    ("choose_city", "Москва"),
+    ("choose_time", "08:00"),
+    ("weather", "Показать погоду 🌦️(пока нет)"),
+    ("view_weather", "Посмотреть погоду(пока нет) 🌍"),
+    ("show_cities", "Мои города 📋"),
+    ("show_schedule", "Расписание уведомлений 🕒"),
+    ("go_home", "Домой 🏠"),
+]
+
+
+def fast_queue(bot, fake_bot):
+    # Лимиты Telegram здесь не интересны: меряем собственную стоимость кода
+    bot.send_queue = bot.SendQueue(global_rate=1e9, per_chat_rate=1e9, per_chat_burst=1e9, workers=64)
+    bot.send_queue.start(fake_bot)
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def bench_handlers(bot, users):
+    timings = {step: [] for step, _ in FLOW}
+    for user_id in range(1, users + 1):
+        for update_id, (step, text) in enumerate(FLOW):
+            update = make_update(text, user_id, update_id)
+            started = time.perf_counter()
+            if text == "/start":
+                await bot.start(update, None)
+            else:
+                await bot.route_text(update, None)
+            timings[step].append(time.perf_counter() - started)
+    results = {}
+    for step, values in timings.items():
+        results[f"handler_{step}_mean_us"] = round(statistics.mean(values) * 1e6, 1)
+        results[f"handler_{step}_p50_us"] = round(pct(values, 0.5) * 1e6, 1)
+        results[f"handler_{step}_p99_us"] = round(pct(values, 0.99) * 1e6, 1)
+    return results
+
+
+def bench_formatting(bot, repeats):
+    frame = bot.forecast_frame.ForecastFrame.from_payload(load_fixture("forecast"))
+    started = time.perf_counter()
+    for _ in range(repeats):
+        bot.format_weather_brief("Москва", frame)
+    brief = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(repeats):
+        bot.format_weather_5days("Москва", frame)
+    five = time.perf_counter() - started
+    # Готовый текст из кэша сводок: так его получает каждый подписчик города при рассылке
+    started = time.perf_counter()
+    for _ in range(repeats):
+        bot.with_wish(bot.summary_cache.get("brief", 1, "Москва", frame, bot.format_weather_brief))
+    cached = time.perf_counter() - started
+    payload = load_fixture("forecast")
+    started = time.perf_counter()
+    for _ in range(repeats):
+        bot.forecast_frame.ForecastFrame.from_payload(payload)
+    parse = time.perf_counter() - started
+    return {
+        "format_brief_per_s": round(repeats / brief),
+        "format_5days_per_s": round(repeats / five),
+        "brief_cached_per_s": round(repeats / cached),
+        "parse_forecast_per_s": round(repeats / parse),
+    }
+
+
+def bench_saving(bot, workdir, sizes):
+    rnd = random.Random(1)
+    results = {}
+    for size in sizes:
+        states = {user_id: make_state(rnd) for user_id in range(size)}
+        # Как было: полная перезапись users.json на каждое изменение
+        path = os.path.join(workdir, f"legacy_{size}.json")
+        started = time.perf_counter()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(states, f, ensure_ascii=False, indent=2)
+        results[f"save_full_rewrite_{size}_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        # Сейчас: одна изменённая запись в SQLite
+        records = {user_id: bot.UserRecord.from_dict(state) for user_id, state in states.items()}
+        store = bot.UserStore(os.path.join(workdir, f"users_{size}.db"),
+                              lambda user_id: records[user_id].to_dict() if user_id in records else None)
+        store.open()
+        store._write([(user_id, json.dumps(r.to_dict(), ensure_ascii=False)) for user_id, r in records.items()], [])
+        samples = []
+        for user_id in rnd.sample(range(size), 50):
+            records[user_id].send_time = "09:00"
+            started = time.perf_counter()
+            store._dirty.add(user_id)
+            store.flush_sync()
+            samples.append(time.perf_counter() - started)
+        store.close()
+        results[f"save_incremental_{size}_ms"] = round(statistics.median(samples) * 1000, 3)
+    return results
+
+
+async def bench_fanout(bot, providers, users):
+    rnd = random.Random(2)
+    bot.user_states.clear()
+    for user_id in range(100000, 100000 + users):
+        bot.user_states[user_id] = bot.UserRecord.from_dict(make_state(rnd))
+    bot.forecast_cache._entries.clear()
+    before = sum(providers.calls.values())
+    started = time.perf_counter()
+    await bot.send_weather_job(list(bot.user_states))
+    elapsed = time.perf_counter() - started
+    return {
+        "fanout_users": users,
+        "fanout_seconds": round(elapsed, 3),
+        "fanout_messages_per_s": round(users / elapsed),
+        "fanout_provider_requests": sum(providers.calls.values()) - before,
+    }
+
+
+async def run(args, workdir):
+    bot = import_bot(workdir)
+    bot.user_store.open()
+    register_cities(bot.city_registry)
+    providers = FakeProviders(latency=args.provider_latency)
+    bot.http_client.configure(providers.transport())
+    fake_bot = FakeBot()
+    fast_queue(bot, fake_bot)
+    results = {}
+    results.update(await bench_handlers(bot, args.users))
+    results.update(bench_formatting(bot, args.repeats))
+    results.update(bench_saving(bot, workdir, args.save_sizes))
+    results.update(await bench_fanout(bot, providers, args.fanout_users))
+    await bot.send_queue.stop()
+    await bot.http_client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--fanout-users", type=int, default=10000)
+    parser.add_argument("--save-sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    workdir = tempfile.mkdtemp(prefix="weather_suite_")
+    results = asyncio.run(run(args, workdir))
+    report = {
+        "suite": "offline",
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            old = json.load(f)["results"]
+        # Отношение к прошлому запуску: для *_us/_ms/_seconds меньше - лучше, для *_per_s - больше
+        report["vs_baseline"] = {key: round(value / old[key], 3) for key, value in results.items()
+                                 if isinstance(value, (int, float)) and old.get(key)}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Память и размер сериализации: старые dict-состояния против UserRecord.
+# Запуск: python benchmarks/user_model.py [N]
+import gc
+import json
+import random
+import sys
+import tracemalloc
+
+from common import make_state
+
+from models import UserRecord
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rnd = random.Random(1)
+    # Исходные данные как в базе: по JSON-строке на пользователя
+    rows = [json.dumps(make_state(rnd), ensure_ascii=False) for _ in range(users)]
+
+    legacy, legacy_bytes = measure(lambda: {i: json.loads(row) for i, row in enumerate(rows)})
+    records, record_bytes = measure(lambda: {i: UserRecord.from_dict(json.loads(row)) for i, row in enumerate(rows)})
+
+    compact = (",", ":")
+    legacy_file = len(json.dumps(legacy, ensure_ascii=False, indent=2).encode())
+    legacy_rows = sum(len(json.dumps(s, ensure_ascii=False).encode()) for s in legacy.values())
+    record_rows = sum(len(json.dumps(r.to_dict(), ensure_ascii=False, separators=compact).encode()) for r in records.values())
+
+    print(json.dumps({
+        "benchmark": "user_model",
+        "users": users,
+        "dict_bytes_per_user": round(legacy_bytes / users, 1),
+        "record_bytes_per_user": round(record_bytes / users, 1),
+        "users_json_file_bytes": legacy_file,
+        "dict_serialized_bytes_per_user": round(legacy_rows / users, 1),
+        "record_serialized_bytes_per_user": round(record_rows / users, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
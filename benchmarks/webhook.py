@@ -0,0 +1,128 @@
+# Сквозной прогон режима webhook без Telegram: синтетические апдейты идут POST-запросами
+# во встроенный HTTP сервер, ответы бота перехватываются на уровне сетевого слоя Bot API.
+# Задержка - от отправки апдейта до ответа пользователю (sendMessage).
+# Запуск: python benchmarks/webhook.py [--users 200] [--concurrency 1 64]
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from collections import defaultdict, deque
+
+from common import ROOT  # noqa: F401  (добавляет корень репозитория в sys.path)
+from fakes import FakeProviders, FakeRequest, import_bot, update_payload
+from suite import FLOW, pct
+
+# Начало ответа на каждый шаг FLOW: так видно, что апдейты пользователя обработаны по порядку
+EXPECTED_REPLIES = ["Привет", "Введите название города", "✅ Город", "✅ Город", "⏰ Уведомления",
+                    "Москва:", "Прогноз на 5 дней", "Ваши города", "Уведомления настроены", "Главное меню"]
+
+
+async def post_updates(port, path, secret, updates, update_ids, sent_at):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for user_id, text in updates:
+            body = json.dumps(update_payload(text, user_id, next(update_ids))).encode()
+            head = (f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+                    f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n")
+            sent_at[user_id].append(time.perf_counter())
+            writer.write(head.encode() + body)
+            status = await reader.readline()
+            length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            if b" 200 " not in status:
+                raise RuntimeError(f"webhook ответил {status!r}")
+    finally:
+        writer.close()
+
+
+async def run_once(bot, providers, args, concurrency, first_user):
+    sent_at = defaultdict(deque)
+    latencies = []
+    replies = defaultdict(list)
+
+    def on_send(chat_id, text):
+        queue = sent_at.get(chat_id)
+        if queue:
+            latencies.append(time.perf_counter() - queue.popleft())
+        replies[chat_id].append(text)
+
+    # post_shutdown предыдущего прогона закрыл базу
+    bot.user_store.open()
+    bot.city_registry.open()
+    bot.user_states.clear()
+    bot.dialogs.clear()
+    bot.send_queue = bot.SendQueue(global_rate=1e9, per_chat_rate=1e9, per_chat_burst=1e9, workers=64)
+    request = FakeRequest(latency=args.bot_latency, on_send=on_send)
+    app = bot.build_application("123456:TEST", request=request, concurrency=concurrency)
+    server = await bot.start_webhook(app, url="https://bench.invalid/telegram")
+    users = range(first_user, first_user + args.users)
+    expected = args.users * len(FLOW)
+    update_ids = iter(range(1, expected + 1))
+
+    started = time.perf_counter()
+    # Как Telegram: несколько постоянных соединений, пользователь закреплён за одним из них,
+    # поэтому его апдейты приходят по порядку; ответ на POST ждём, ответа бота - нет
+    connections = [[] for _ in range(min(args.connections, args.users))]
+    for _, text in FLOW:
+        for user_id in users:
+            connections[user_id % len(connections)].append((user_id, text))
+    await asyncio.gather(*(post_updates(server.port, bot.WEBHOOK_PATH, bot.WEBHOOK_SECRET, updates,
+                                        update_ids, sent_at) for updates in connections))
+    deadline = time.perf_counter() + args.timeout
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await bot.stop_webhook(app, server)
+
+    out_of_order = sum(
+        1 for user_id in users
+        if [text.startswith(prefix) for text, prefix in zip(replies[user_id], EXPECTED_REPLIES)].count(False)
+        or len(replies[user_id]) != len(FLOW))
+    return {
+        "concurrency": concurrency,
+        "users": args.users,
+        "updates": expected,
+        "seconds": round(elapsed, 3),
+        "updates_per_s": round(expected / elapsed),
+        "latency_p50_ms": round(pct(latencies, 0.5) * 1000, 2) if latencies else None,
+        "latency_p99_ms": round(pct(latencies, 0.99) * 1000, 2) if latencies else None,
+        "lost": expected - len(latencies),
+        "users_out_of_order": out_of_order,
+        "provider_requests": sum(providers.calls.values()),
+    }
+
+
+async def run(args, workdir):
+    bot = import_bot(workdir, WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=0, WEBHOOK_SECRET="bench-secret",
+                     LOG_LEVEL="WARNING")
+    providers = FakeProviders(latency=args.provider_latency)
+    bot.http_client.configure(providers.transport())
+    results = []
+    for i, concurrency in enumerate(args.concurrency):
+        # Каждый прогон - новые пользователи, чтобы кэши прогнозов и геокодинга были в одинаковом состоянии
+        bot.forecast_cache._entries.clear()
+        results.append(await run_once(bot, providers, args, concurrency, first_user=1 + i * args.users))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 64])
+    parser.add_argument("--connections", type=int, default=40, help="как max_connections у setWebhook")
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    parser.add_argument("--bot-latency", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    results = asyncio.run(run(args, tempfile.mkdtemp(prefix="weather_webhook_")))
+    for result in results:
+        print(json.dumps({"benchmark": "webhook", **result}))
+
+
+if __name__ == '__main__':
+    main()
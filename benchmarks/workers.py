@@ -0,0 +1,98 @@
+# Рассылка одного слота уведомлений воркерами-процессами: 1 процесс против N.
+# Пользователи пишутся в базу с временем отправки на ближайшую минуту, дальше всё идёт
+# настоящим путём: расписание воркера, общий кэш прогнозов, очередь отправки, Bot API (заглушка).
+# Запуск: python benchmarks/workers.py [--users 20000] [--workers 1 4]
+import argparse
+import datetime
+import json
+import random
+import sqlite3
+import tempfile
+import time
+from zoneinfo import ZoneInfo
+
+from common import CITY_IDS, register_cities
+from fakes import WorkerSetup, import_bot
+
+TZ = "Europe/Moscow"
+
+
+def next_slot(min_lead):
+    # Ближайшая целая минута, до которой не меньше min_lead секунд
+    now = datetime.datetime.now(datetime.timezone.utc)
+    slot = (now + datetime.timedelta(seconds=min_lead + 60)).replace(second=0, microsecond=0)
+    return slot, slot.astimezone(ZoneInfo(TZ)).strftime("%H:%M")
+
+
+def write_users(bot, users, send_time):
+    rnd = random.Random(3)
+    rows = []
+    for user_id in range(1, users + 1):
+        city_ids = rnd.sample(CITY_IDS, rnd.randint(1, 3))
+        state = {"cities": city_ids, "notify_city": city_ids[0], "send_time": send_time}
+        rows.append((user_id, json.dumps(state, ensure_ascii=False)))
+    bot.user_store._write(rows, [])
+
+
+def wait_events(coordinator, kind, count, timeout):
+    events = []
+    deadline = time.monotonic() + timeout
+    while len(events) < count and time.monotonic() < deadline:
+        events.extend(e for e in coordinator.drain_events() if e[0] == kind)
+        time.sleep(0.05)
+    return events
+
+
+def run_once(bot, args, shards, store_path):
+    slot, send_time = next_slot(args.lead)
+    write_users(bot, args.users, send_time)
+    with sqlite3.connect(store_path) as conn:
+        conn.execute("DELETE FROM forecasts")
+    coordinator = bot.Coordinator(shards, WorkerSetup(args.provider_latency, args.bot_latency))
+    coordinator.start()
+    try:
+        ready = wait_events(coordinator, "ready", shards, timeout=60)
+        # Пользователь, которого нет в базе: подписка приходит через координатор, как из обработчика
+        extra_id = args.users + 1
+        coordinator.route(extra_id, {"cities": [1], "notify_city": 1, "send_time": send_time})
+        wait = (slot - datetime.datetime.now(datetime.timezone.utc)).total_seconds() + args.timeout
+        jobs = wait_events(coordinator, "job", shards, timeout=wait)
+    finally:
+        coordinator.stop()
+    planned = slot.timestamp()
+    return {
+        "workers": shards,
+        "users": args.users + 1,
+        "ready": len(ready),
+        "sent": sum(e[2]["sent"] for e in jobs),
+        "failed": sum(e[2]["failed"] for e in jobs),
+        "makespan_seconds": round(max(e[2]["finished"] for e in jobs) - planned, 3) if jobs else None,
+        "shard_seconds": [e[2]["seconds"] for e in sorted(jobs, key=lambda e: e[1])],
+        "forecast_fetches": sum(e[2]["forecast_store"]["fetched"] for e in jobs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--provider-latency", type=float, default=0.05)
+    parser.add_argument("--bot-latency", type=float, default=0.0)
+    parser.add_argument("--lead", type=float, default=10, help="минимум секунд до слота на запуск воркеров")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="weather_workers_")
+    store_path = f"{workdir}/forecasts.db"
+    # Лимиты Telegram здесь не интересны: меряем, сколько успевают подготовить и отправить процессы
+    bot = import_bot(workdir, FORECAST_STORE_FILE=store_path, TELEGRAM_GLOBAL_RATE=1e9,
+                     TELEGRAM_PER_CHAT_RATE=1e9, PREFETCH_JITTER=1, LOG_LEVEL="WARNING")
+    bot.user_store.open()
+    # Все города - в одном поясе, чтобы весь слот уведомлений пришёлся на одну минуту
+    register_cities(bot.city_registry, tz=TZ)
+    bot.open_forecast_store()
+    for shards in args.workers:
+        print(json.dumps({"benchmark": "workers", **run_once(bot, args, shards, store_path)}))
+
+
+if __name__ == '__main__':
+    main()
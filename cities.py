@@ -0,0 +1,121 @@
+import json
+import sqlite3
+from dataclasses import dataclass, field
+
+from forecast_cache import normalize_city
+
+# Точность ключа по координатам: 0.01° - около километра. Разные написания одного города
+# геокодер отдаёт с одинаковыми координатами, а соседние города так не склеиваются
+COORD_PRECISION = 2
+# Языки, названия на которых сохраняются из local_names геокодера
+LANGUAGES = ("ru", "en")
+
+
+def coord_key(lat, lon):
+    return f"{lat:.{COORD_PRECISION}f},{lon:.{COORD_PRECISION}f}"
+
+
+@dataclass(slots=True)
+class City:
+    id: int
+    lat: float | None
+    lon: float | None
+    tz: str | None
+    names: dict = field(default_factory=dict)  # язык -> название
+
+    @property
+    def name(self):
+        return self.names.get("ru") or self.names.get("en") or next(iter(self.names.values()), f"#{self.id}")
+
+
+class CityRegistry:
+    # Общий реестр городов в SQLite: один город - одна запись с координатами, часовым поясом
+    # и названиями, пользователи ссылаются на неё по id. Запись создаётся при первом геокодинге;
+    # все написания, под которыми город уже искали (aliases), ведут к той же записи.
+    # Пишет только основной процесс, воркеры читают (get() дочитывает новые записи из базы).
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self._by_id = {}
+        self._by_coords = {}
+        self._aliases = {}  # нормализованное название -> id
+
+    def open(self):
+        if self.conn is not None:
+            return
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cities (id INTEGER PRIMARY KEY, coord_key TEXT UNIQUE, "
+                          "lat REAL, lon REAL, tz TEXT, names TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS city_aliases (alias TEXT PRIMARY KEY, city_id INTEGER NOT NULL)")
+        self.conn.commit()
+        for row in self.conn.execute("SELECT id, lat, lon, tz, names FROM cities"):
+            self._remember(City(row[0], row[1], row[2], row[3], json.loads(row[4])))
+        self._aliases = dict(self.conn.execute("SELECT alias, city_id FROM city_aliases"))
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _remember(self, city):
+        self._by_id[city.id] = city
+        if city.lat is not None:
+            self._by_coords[coord_key(city.lat, city.lon)] = city
+        return city
+
+    def get(self, city_id):
+        city = self._by_id.get(city_id)
+        if city is None and city_id is not None and self.conn is not None:
+            # Город мог добавить другой процесс уже после того, как мы прочитали реестр
+            row = self.conn.execute("SELECT id, lat, lon, tz, names FROM cities WHERE id = ?",
+                                    (city_id,)).fetchone()
+            if row is not None:
+                city = self._remember(City(row[0], row[1], row[2], row[3], json.loads(row[4])))
+        return city
+
+    def find(self, name):
+        # Город по любому из известных написаний; без обращения к геокодеру
+        return self.get(self._aliases.get(normalize_city(name)))
+
+    def add(self, name, lat, lon, tz, names=None):
+        # Город по результату геокодинга названия name. Если по этим координатам город уже есть,
+        # name становится ещё одним его написанием. lat = lon = None - координаты неизвестны
+        # (перенос старых записей, когда геокодер не ответил): такой город запрашивается по названию,
+        # а координаты получит при следующем успешном геокодинге того же названия.
+        names = {lang: value for lang, value in (names or {}).items() if lang in LANGUAGES and value}
+        names.setdefault("ru", name)
+        alias = normalize_city(name)
+        city = self._by_coords.get(coord_key(lat, lon)) if lat is not None else None
+        unlocated = self._by_id.get(self._aliases.get(alias))
+        if city is None and lat is not None and unlocated is not None and unlocated.lat is None:
+            city = unlocated
+            city.lat, city.lon = lat, lon
+            self._by_coords[coord_key(lat, lon)] = city
+        if city is None:
+            cur = self.conn.execute(
+                "INSERT INTO cities (coord_key, lat, lon, tz, names) VALUES (?, ?, ?, ?, ?)",
+                (coord_key(lat, lon) if lat is not None else None, lat, lon, tz,
+                 json.dumps(names, ensure_ascii=False)))
+            city = self._remember(City(cur.lastrowid, lat, lon, tz, names))
+        else:
+            # Уже известные названия не меняем: их видят пользователи в своих списках
+            city.names = {**names, **city.names}
+            city.tz = city.tz or tz
+            self.conn.execute(
+                "UPDATE cities SET coord_key = ?, lat = ?, lon = ?, tz = ?, names = ? WHERE id = ?",
+                (coord_key(city.lat, city.lon) if city.lat is not None else None, city.lat, city.lon,
+                 city.tz, json.dumps(city.names, ensure_ascii=False), city.id))
+        aliases = {alias, *(normalize_city(value) for value in city.names.values())}
+        self.conn.executemany("INSERT OR REPLACE INTO city_aliases (alias, city_id) VALUES (?, ?)",
+                              [(a, city.id) for a in aliases])
+        self.conn.commit()
+        for a in aliases:
+            self._aliases[a] = city.id
+        return city
+
+    def stats(self):
+        return {"cities": len(self._by_id), "located": len(self._by_coords), "aliases": len(self._aliases)}
@@ -0,0 +1,102 @@
+import os
+import re
+
+from dotenv import load_dotenv
+
+# .env читается здесь: config импортируется первым, до модулей, которые читают свои настройки при импорте
+load_dotenv()
+
+USER_DATA_FILE = 'users.json'
+USER_DB_FILE = os.getenv('USER_DB_FILE', 'users.db')
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+# Сервер Bot API: свой (telegram-bot-api) или локальная заглушка для нагрузочных прогонов
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
+TIMEZONEDB_API_KEY = os.getenv('TIMEZONEDB_API_KEY')
+FORECAST_CACHE_TTL = int(os.getenv('FORECAST_CACHE_TTL', '600'))
+FORECAST_CACHE_SIZE = int(os.getenv('FORECAST_CACHE_SIZE', '1024'))
+# Сколько ещё хранить просроченный прогноз на случай недоступности сервиса погоды
+FORECAST_STALE_TTL = int(os.getenv('FORECAST_STALE_TTL', '21600'))
+# Сколько ждать обновления просроченного прогноза, прежде чем ответить старыми данными
+FORECAST_STALE_WAIT = float(os.getenv('FORECAST_STALE_WAIT', '1.5'))
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', '50'))
+PREFETCH_LEAD = int(os.getenv('PREFETCH_LEAD', '180'))
+PREFETCH_JITTER = float(os.getenv('PREFETCH_JITTER', '20'))
+PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', '10'))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_PER_CHAT_RATE = float(os.getenv('TELEGRAM_PER_CHAT_RATE', '1'))
+# В режиме воркеров: доля TELEGRAM_GLOBAL_RATE для основного процесса (ответы пользователям и оповещения),
+# остальное поровну делят воркеры
+TELEGRAM_COORDINATOR_SHARE = float(os.getenv('TELEGRAM_COORDINATOR_SHARE', '0.25'))
+# Эндпоинт /metrics (формат Prometheus); по умолчанию выключен, включается заданием порта (например, 9108)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Сколько апдейтов обрабатывается одновременно (апдейты одного пользователя - всё равно по очереди)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '64'))
+# Режим webhook включается, если задан публичный WEBHOOK_URL; иначе - polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token; без него запрос отклоняется.
+# В режиме webhook обязателен и один на все экземпляры бота: каждый из них регистрирует webhook заново
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Число процессов-воркеров для рассылки уведомлений; 0 - всё в одном процессе
+WORKERS = int(os.getenv('WORKERS', '0'))
+# Общий для процессов кэш ответов /forecast (только в режиме воркеров)
+FORECAST_STORE_FILE = os.getenv('FORECAST_STORE_FILE', 'forecasts.db')
+# История полученных прогнозов (forecast_archive.py) для сравнения со вчерашним днём и тренда:
+# каталог и сколько суток хранить. По умолчанию не ведётся - включается заданием каталога
+FORECAST_ARCHIVE_DIR = os.getenv('FORECAST_ARCHIVE_DIR', '')
+FORECAST_ARCHIVE_DAYS = int(os.getenv('FORECAST_ARCHIVE_DAYS', '400'))
+# Как часто сверять прогнозы городов подписчиков и оповещать об изменениях (например, 1800);
+# по умолчанию 0 - оповещения выключены: каждый проход запрашивает прогноз всех городов с подписчиками
+ALERT_INTERVAL = int(os.getenv('ALERT_INTERVAL', '0'))
+
+# Токен бота: "<id бота>:<ключ>"
+TOKEN_RE = re.compile(r'^\d+:[A-Za-z0-9_-]{20,}$')
+# Символы, которые Telegram допускает в secret_token webhook
+WEBHOOK_SECRET_RE = re.compile(r'^[A-Za-z0-9_-]{1,256}$')
+
+
+def validate():
+    # -> (ошибки, предупреждения). Проверяются только значения настроек: без сети и без файлов
+    errors, warnings = [], []
+    if not TELEGRAM_TOKEN:
+        errors.append("TELEGRAM_TOKEN не задан в .env")
+    elif not TOKEN_RE.match(TELEGRAM_TOKEN):
+        errors.append("TELEGRAM_TOKEN не похож на токен бота (<id>:<ключ>)")
+    if not OPENWEATHER_API_KEY:
+        warnings.append("OPENWEATHER_API_KEY не задан: не будет ни поиска городов, ни прогнозов")
+    if not TELEGRAM_API_URL.startswith(("https://", "http://")):
+        errors.append(f"TELEGRAM_API_URL должен начинаться с https:// или http://: {TELEGRAM_API_URL}")
+    if WEBHOOK_URL and not WEBHOOK_URL.startswith("https://"):
+        errors.append("WEBHOOK_URL должен начинаться с https:// (Telegram не шлёт апдейты по http)")
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        errors.append("WEBHOOK_SECRET не задан: в режиме webhook он обязателен")
+    if WEBHOOK_SECRET and not WEBHOOK_SECRET_RE.match(WEBHOOK_SECRET):
+        errors.append("WEBHOOK_SECRET: допустимы только A-Z, a-z, 0-9, _ и -, не длиннее 256 символов")
+    if not WEBHOOK_PATH.startswith("/"):
+        errors.append("WEBHOOK_PATH должен начинаться с /")
+    if not 0 <= WEBHOOK_PORT <= 65535:
+        errors.append(f"WEBHOOK_PORT вне диапазона: {WEBHOOK_PORT}")
+    if not 0 <= METRICS_PORT <= 65535:
+        errors.append(f"METRICS_PORT вне диапазона: {METRICS_PORT}")
+    positive = {
+        "FORECAST_CACHE_TTL": FORECAST_CACHE_TTL, "FORECAST_CACHE_SIZE": FORECAST_CACHE_SIZE,
+        "NOTIFY_CONCURRENCY": NOTIFY_CONCURRENCY, "PREFETCH_CONCURRENCY": PREFETCH_CONCURRENCY,
+        "TELEGRAM_GLOBAL_RATE": TELEGRAM_GLOBAL_RATE, "TELEGRAM_PER_CHAT_RATE": TELEGRAM_PER_CHAT_RATE,
+        "UPDATE_CONCURRENCY": UPDATE_CONCURRENCY, "FORECAST_ARCHIVE_DAYS": FORECAST_ARCHIVE_DAYS,
+    }
+    non_negative = {
+        "FORECAST_STALE_TTL": FORECAST_STALE_TTL, "FORECAST_STALE_WAIT": FORECAST_STALE_WAIT,
+        "PREFETCH_LEAD": PREFETCH_LEAD, "PREFETCH_JITTER": PREFETCH_JITTER, "WORKERS": WORKERS,
+        "ALERT_INTERVAL": ALERT_INTERVAL,
+    }
+    errors += [f"{name} должен быть больше нуля: {value}" for name, value in positive.items() if value <= 0]
+    errors += [f"{name} не может быть отрицательным: {value}" for name, value in non_negative.items() if value < 0]
+    if WORKERS > 0 and not 0 < TELEGRAM_COORDINATOR_SHARE < 1:
+        errors.append(f"TELEGRAM_COORDINATOR_SHARE должен быть больше 0 и меньше 1: {TELEGRAM_COORDINATOR_SHARE}")
+    if PREFETCH_JITTER >= PREFETCH_LEAD > 0:
+        warnings.append("PREFETCH_JITTER не меньше PREFETCH_LEAD: прогрев может не успеть к рассылке")
+    return errors, warnings
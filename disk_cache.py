@@ -0,0 +1,47 @@
+import json
+import os
+import threading
+
+
+class PersistentDict:
+    # Небольшой словарь, который хранится в JSON-файле и переживает перезапуск бота.
+    # Запись атомарная: сначала во временный файл, потом os.replace.
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._load().get(key, default)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+    def set(self, key, value):
+        with self._lock:
+            data = self._load()
+            if data.get(key) == value:
+                return
+            data[key] = value
+            self._save(data)
+
+    def _save(self, data):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,106 @@
+import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+
+def _zone(tz_name):
+    try:
+        return ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def next_fire(tz_name, send_time, now):
+    # Ближайший момент (UTC), когда в часовом поясе tz_name наступит send_time ("ЧЧ:ММ").
+    # Считаем через zoneinfo каждый раз, поэтому переход на летнее время учитывается сам.
+    zone = _zone(tz_name)
+    hour, minute = map(int, send_time.split(":"))
+    local_today = now.astimezone(zone).date()
+    for days in range(3):
+        day = local_today + datetime.timedelta(days=days)
+        fire = datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=zone).astimezone(datetime.timezone.utc)
+        if fire > now:
+            return fire
+    return fire
+
+
+class NotificationDispatcher:
+    # Подписки хранятся корзинами (часовой пояс, время отправки) -> пользователи.
+    # Корзин намного меньше, чем пользователей, поэтому пробуждение одно на занятый слот,
+    # а добавление или удаление подписки - O(1).
+    def __init__(self):
+        self.buckets = {}  # (tz, "ЧЧ:ММ") -> set(user_id)
+        self.subscriptions = {}  # user_id -> (tz, "ЧЧ:ММ")
+        self._fire_at = {}  # (tz, "ЧЧ:ММ") -> datetime UTC следующей отправки
+        self._wake = None
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def subscribe(self, user_id, tz_name, send_time, now=None):
+        # Возвращает True, если ближайшее пробуждение сдвинулось раньше и его нужно перепланировать
+        key = (tz_name or DEFAULT_TIMEZONE, send_time)
+        old_key = self.subscriptions.get(user_id)
+        if old_key == key:
+            return False
+        if old_key is not None:
+            self._discard(user_id, old_key)
+        self.subscriptions[user_id] = key
+        reschedule = False
+        users = self.buckets.get(key)
+        if users is None:
+            users = self.buckets[key] = set()
+            now = now or datetime.datetime.now(datetime.timezone.utc)
+            fire = self._fire_at[key] = next_fire(key[0], send_time, now)
+            if self._wake is None or fire < self._wake:
+                self._wake = fire
+                reschedule = True
+        users.add(user_id)
+        return reschedule
+
+    def bulk_load(self, entries, now=None):
+        # Восстановление при старте: entries - (user_id, tz, "ЧЧ:ММ"); время запуска считается один раз на корзину
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        for user_id, tz_name, send_time in entries:
+            key = (tz_name or DEFAULT_TIMEZONE, send_time)
+            self.subscriptions[user_id] = key
+            users = self.buckets.get(key)
+            if users is None:
+                users = self.buckets[key] = set()
+            users.add(user_id)
+        for key in self.buckets:
+            if key not in self._fire_at:
+                self._fire_at[key] = next_fire(key[0], key[1], now)
+
+    def unsubscribe(self, user_id):
+        key = self.subscriptions.pop(user_id, None)
+        if key is not None:
+            self._discard(user_id, key)
+
+    def _discard(self, user_id, key):
+        users = self.buckets.get(key)
+        if users is None:
+            return
+        users.discard(user_id)
+        if not users:
+            del self.buckets[key]
+            del self._fire_at[key]
+
+    def next_wake(self):
+        self._wake = min(self._fire_at.values(), default=None)
+        return self._wake
+
+    def upcoming(self, until):
+        # Корзины, которые сработают не позже until: [(время отправки, пользователи)]
+        return [(fire, list(self.buckets[key])) for key, fire in self._fire_at.items() if fire <= until]
+
+    def pop_due(self, now=None):
+        # Пользователи всех корзин, чьё время уже наступило; для этих корзин считаем следующий запуск
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        due = []
+        for key, fire in list(self._fire_at.items()):
+            if fire <= now:
+                due.extend(self.buckets[key])
+                self._fire_at[key] = next_fire(key[0], key[1], now)
+        return due
@@ -0,0 +1,263 @@
+import datetime
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from forecast_frame import DAY_END_HOUR, DAY_START_HOUR, EPOCH
+
+logger = logging.getLogger(__name__)
+
+# Столбцы архива: city и dt - индекс, fetched - когда получен ответ (только в несжатых сутках),
+# остальное - значения прогноза на 3-часовой отрезок
+INDEX = {"city": np.int32, "dt": np.int64}
+VALUES = ("temp", "wind", "rain", "humidity", "pressure", "clouds")
+COLUMNS = {**INDEX, "fetched": np.int64, **{name: np.float32 for name in VALUES}}
+RAW_SUFFIX = ".raw"
+TMP_SUFFIX = ".tmp"
+# Отрезки суток ещё могут прийти в течение этого времени после их конца: первый отрезок ответа
+# /forecast бывает уже начавшимся. Сжимаются только сутки, закончившиеся раньше
+SETTLE_SECONDS = 3 * 3600
+# Сколько сжатых суток держать открытыми (memmap), чтобы не открывать файлы на каждый запрос:
+# открытые столбцы занимают только адресное пространство, поэтому хватает на год с запасом
+OPEN_SEGMENTS = 512
+
+
+def day_name(day):
+    return (EPOCH + datetime.timedelta(days=int(day))).isoformat()
+
+
+def parse_day(name):
+    try:
+        return (datetime.date.fromisoformat(name) - EPOCH).days
+    except ValueError:
+        return None
+
+
+def latest(columns):
+    # По строке на (город, отрезок) - из самого свежего ответа; строки упорядочены по (city, dt)
+    order = np.lexsort((columns["fetched"], columns["dt"], columns["city"]))
+    city, dt = columns["city"][order], columns["dt"][order]
+    last = np.append((city[1:] != city[:-1]) | (dt[1:] != dt[:-1]), True)
+    keep = order[last]
+    return {name: values[keep] for name, values in columns.items()}
+
+
+def _read_column(path, dtype):
+    # memmap пустого файла не создаётся
+    if not os.path.exists(path) or os.path.getsize(path) < np.dtype(dtype).itemsize:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class _Segment(dict):
+    # Столбцы сжатых суток: файл столбца отображается в память при первом обращении к нему
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def __missing__(self, name):
+        values = self[name] = _read_column(os.path.join(self.directory, name), COLUMNS[name])
+        return values
+
+
+class ForecastArchive:
+    # История прогнозов по городам - столбцы фиксированной ширины, каталог на сутки UTC.
+    # Пока сутки не закончились, каждый процесс дописывает свои строки в <дата>.raw/<writer>/,
+    # в конец файлов столбцов, поэтому общая блокировка между процессами не нужна.
+    # compact() сводит закончившиеся сутки в <дата>/: по строке на (город, отрезок), отсортировано
+    # по (city, dt), так что город читается двоичным поиском по memmap без чтения всего файла.
+    def __init__(self, path, retention_days=400, writer="main"):
+        self.path = path
+        self.retention_days = retention_days
+        self.writer = writer
+        self._files = {}  # сутки -> {столбец: файл}, куда дописывает этот процесс
+        self._versions = {}  # city_id -> версия последнего записанного прогноза
+        self._segments = OrderedDict()  # сутки -> {столбец: memmap} сжатых суток
+        self._lock = threading.Lock()
+        self.appended = 0
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def close(self):
+        with self._lock:
+            for files in self._files.values():
+                for f in files.values():
+                    f.close()
+            self._files.clear()
+            self._segments.clear()
+
+    def append(self, city_id, frame, now=None):
+        # Отрезки ответа на ближайшие сутки - они к концу суток станут историей; дальние ещё
+        # не раз обновятся. Тот же ответ (та же версия) второй раз не пишется
+        if self._versions.get(city_id) == frame.version:
+            return 0
+        now = int(now or time.time())
+        mask = frame.dt < now + 86400
+        dt = frame.dt[mask]
+        days = dt // 86400
+        with self._lock:
+            self._versions[city_id] = frame.version
+            for day in np.unique(days):
+                rows = days == day
+                n = int(rows.sum())
+                columns = {"city": np.full(n, city_id), "dt": dt[rows], "fetched": np.full(n, now)}
+                for name in VALUES:
+                    columns[name] = getattr(frame, name)[mask][rows]
+                files = self._writer_files(int(day))
+                for name, dtype in COLUMNS.items():
+                    files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+            self.appended += len(dt)
+        return len(dt)
+
+    def _writer_files(self, day):
+        files = self._files.get(day)
+        if files is None:
+            # Прошедшие сутки этому процессу больше не нужны: их сожмёт compact()
+            for old in [old for old in self._files if old < day - 1]:
+                for f in self._files.pop(old).values():
+                    f.close()
+            directory = os.path.join(self.path, day_name(day) + RAW_SUFFIX, self.writer)
+            os.makedirs(directory, exist_ok=True)
+            files = self._files[day] = {name: open(os.path.join(directory, name), "ab", buffering=0)
+                                        for name in COLUMNS}
+        return files
+
+    def _raw(self, day, city_id=None):
+        # Строки несжатых суток от всех процессов (только города city_id, если задан)
+        base = os.path.join(self.path, day_name(day) + RAW_SUFFIX)
+        parts = []
+        for writer in sorted(os.listdir(base)) if os.path.isdir(base) else []:
+            columns = {name: _read_column(os.path.join(base, writer, name), dtype) for name, dtype in COLUMNS.items()}
+            # Процесс мог упасть посреди записи строки: берём только целые строки
+            rows = min(len(values) for values in columns.values())
+            columns = {name: values[:rows] for name, values in columns.items()}
+            if city_id is not None:
+                mask = columns["city"] == city_id
+                columns = {name: values[mask] for name, values in columns.items()}
+            parts.append(columns)
+        if not parts:
+            return None
+        return latest({name: np.concatenate([part[name] for part in parts]) for name in COLUMNS})
+
+    def _compacted(self, day):
+        # Вызывается под self._lock: compact() в другом потоке подменяет каталог суток тоже под ней
+        segment = self._segments.get(day)
+        if segment is not None:
+            self._segments.move_to_end(day)
+            return segment
+        directory = os.path.join(self.path, day_name(day))
+        if not os.path.isdir(directory):
+            return None
+        segment = self._segments[day] = _Segment(directory)
+        while len(self._segments) > OPEN_SEGMENTS:
+            self._segments.popitem(last=False)
+        return segment
+
+    def _compacted_rows(self, day, city_id, names):
+        # Строки города из сжатых суток; None - сутки не сжаты. Столбцы отображаются лениво,
+        # и каталог могли подменить между обращениями к ним (досжатие опоздавших строк в другом
+        # процессе): тогда длины столбцов расходятся, и сутки отображаются заново
+        with self._lock:
+            for _ in range(2):
+                segment = self._compacted(day)
+                if segment is None:
+                    return None
+                rows = len(segment["city"])
+                if all(len(segment[name]) == rows for name in names):
+                    lo, hi = np.searchsorted(segment["city"], [city_id, city_id + 1])
+                    return {name: segment[name][lo:hi] for name in names}
+                self._segments.pop(day, None)
+        return None
+
+    def read(self, city_id, start, end, fields=("temp",)):
+        # -> (dt, {поле: значения}) отрезков города в [start, end) (unix-время), по возрастанию dt
+        dts, values = [], {name: [] for name in fields}
+        for day in range(int(start // 86400), int((end - 1) // 86400) + 1):
+            part = self._compacted_rows(day, city_id, ("dt", *fields))
+            if part is None:
+                part = self._raw(day, city_id)
+                if part is None:
+                    continue
+            dts.append(np.asarray(part["dt"]))
+            for name in fields:
+                values[name].append(np.asarray(part[name]))
+        if not dts:
+            return np.empty(0, dtype=np.int64), {name: np.empty(0, dtype=np.float32) for name in fields}
+        dt = np.concatenate(dts)
+        mask = (dt >= start) & (dt < end)
+        return dt[mask], {name: np.concatenate(parts)[mask] for name, parts in values.items()}
+
+    def daylight_temps(self, city_id, tz_offset, first_day, last_day):
+        # Дневные (по местному времени) мин. и макс. температуры за местные дни first_day..last_day:
+        # {местный день: (мин, макс)}; дни без данных пропускаются
+        dt, values = self.read(city_id, first_day * 86400 - tz_offset, (last_day + 1) * 86400 - tz_offset)
+        local = dt + tz_offset
+        hours = local % 86400 // 3600
+        daylight = (hours >= DAY_START_HOUR) & (hours <= DAY_END_HOUR)
+        days, temps = local[daylight] // 86400, values["temp"][daylight]
+        return {int(day): (float(temps[days == day].min()), float(temps[days == day].max()))
+                for day in np.unique(days)}
+
+    def compact(self, now=None):
+        # Сводит закончившиеся сутки и удаляет каталоги суток старше retention_days -> (сжато, удалено)
+        now = now or time.time()
+        settled = int((now - SETTLE_SECONDS) // 86400)  # сутки раньше этих закончились
+        expired = int(now // 86400) - self.retention_days
+        compacted = removed = 0
+        for name in sorted(os.listdir(self.path)):
+            day = parse_day(name.removesuffix(RAW_SUFFIX).removesuffix(TMP_SUFFIX))
+            if day is None:
+                continue
+            path = os.path.join(self.path, name)
+            if day < expired:
+                with self._lock:
+                    self._segments.pop(day, None)
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+            elif name.endswith(RAW_SUFFIX) and day < settled:
+                self._compact_day(day)
+                compacted += 1
+        return compacted, removed
+
+    def _compact_day(self, day):
+        with self._lock:
+            for f in self._files.pop(day, {}).values():
+                f.close()
+        raw = self._raw(day)
+        final = os.path.join(self.path, day_name(day))
+        if raw is None:
+            shutil.rmtree(final + RAW_SUFFIX)
+            return
+        with self._lock:
+            segment = self._compacted(day)
+            if segment is not None:
+                old = {name: np.asarray(segment[name]) for name in (*INDEX, *VALUES)}
+        if segment is not None:
+            # Строки, дописанные уже после сжатия суток: сводим вместе с прежними
+            old["fetched"] = np.zeros(len(old["dt"]), dtype=np.int64)
+            raw = latest({name: np.concatenate([old[name], raw[name]]) for name in COLUMNS})
+        tmp = final + TMP_SUFFIX
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, dtype in COLUMNS.items():
+            if name != "fetched":
+                raw[name].astype(dtype).tofile(os.path.join(tmp, name))
+        # Читатели этого процесса видят либо прежние сутки целиком, либо новые
+        with self._lock:
+            self._segments.pop(day, None)
+            if segment is not None:
+                shutil.rmtree(final)
+            os.replace(tmp, final)
+        shutil.rmtree(final + RAW_SUFFIX)
+        logger.debug("Архив: сутки %s сжаты, строк %s", day_name(day), len(raw["dt"]))
+
+    def stats(self):
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(self.path) for name in files)
+        days = sum(1 for name in os.listdir(self.path) if parse_day(name) is not None)
+        return {"days": days, "bytes": size, "appended": self.appended}
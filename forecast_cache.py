@@ -0,0 +1,146 @@
+import asyncio
+import functools
+import random
+import time
+from collections import OrderedDict
+
+
+def normalize_city(city):
+    return " ".join(city.split()).lower()
+
+
+class ForecastCache:
+    # TTL + LRU кэш прогнозов. Одновременные промахи по одному ключу ждут один общий запрос.
+    # Просроченная запись хранится ещё stale_ttl секунд: если провайдер не отвечает, get_or_stale
+    # отдаёт её вместе с возрастом, а загрузка продолжается в фоне. После n неудачных загрузок
+    # подряд get_or_stale retry_base * 2^n секунд (не больше retry_max) не ждёт загрузку по этому ключу.
+    def __init__(self, ttl=600, max_size=1024, stale_ttl=0, stale_wait=1.5, retry_base=5.0, retry_max=30.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale_ttl = stale_ttl
+        self.stale_wait = stale_wait
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._entries = OrderedDict()  # key -> (payload, expires_at, fetched_at)
+        self._inflight = {}  # key -> asyncio.Task загрузки
+        self._retry = {}  # key -> (неудач подряд, не раньше какого момента пробовать снова)
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.stale = 0
+        self.failed = 0
+
+    def _lookup(self, key, now):
+        # Запись, если её ещё можно отдать хотя бы как просроченную
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] + self.stale_ttl <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def peek(self, key):
+        now = time.monotonic()
+        entry = self._lookup(key, now)
+        if entry is None or entry[1] <= now:
+            return None
+        return entry[0]
+
+    def peek_stale(self, key):
+        # (payload, возраст в секундах) для записи, в том числе просроченной
+        now = time.monotonic()
+        entry = self._lookup(key, now)
+        if entry is None:
+            return None
+        return entry[0], now - entry[2]
+
+    def ttl_left(self, key):
+        # Сколько секунд запись ещё будет свежей (0, если её нет)
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        return max(0.0, entry[1] - time.monotonic())
+
+    def put(self, key, payload):
+        now = time.monotonic()
+        self._entries[key] = (payload, now + self.ttl, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._retry.pop(key, None)
+
+    async def get(self, key, loader, refresh=False):
+        # refresh=True - загрузить заново, даже если запись ещё свежая (для прогрева)
+        if not refresh:
+            payload = self.peek(key)
+            if payload is not None:
+                self.hits += 1
+                return payload
+        # shield: отмена одного из ждущих не прерывает общую загрузку - её результат нужен остальным и кэшу
+        return await asyncio.shield(self._load(key, loader))
+
+    async def get_or_stale(self, key, loader):
+        # -> (payload, None) для свежих данных или (payload, возраст), если отдана просроченная запись
+        payload = self.peek(key)
+        if payload is not None:
+            self.hits += 1
+            return payload, None
+        stale = self.peek_stale(key)
+        if stale is None:
+            return await asyncio.shield(self._load(key, loader)), None
+        # Загрузка запускается всегда (одна на ключ) и продолжается в фоне. Обычно провайдер отвечает
+        # быстро, и пользователь получит свежие данные; если нет - ждём не дольше stale_wait, а после
+        # недавней неудачи по этому ключу не ждём вовсе
+        task = self._load(key, loader)
+        retry = self._retry.get(key)
+        if retry is None or retry[1] <= time.monotonic():
+            try:
+                payload = await asyncio.wait_for(asyncio.shield(task), self.stale_wait)
+            except Exception:
+                # Таймаут ожидания или ошибка провайдера - в обоих случаях отдаём то, что есть
+                payload = None
+            # Провайдер ответил, но без прогноза (например, ошибкой в теле ответа) - тоже отдаём то, что есть
+            if payload is not None:
+                return payload, None
+        self.stale += 1
+        return stale
+
+    def _load(self, key, loader):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            return task
+        self.misses += 1
+        task = asyncio.get_running_loop().create_task(self._run_loader(key, loader))
+        self._inflight[key] = task
+        task.add_done_callback(functools.partial(self._loaded, key))
+        return task
+
+    async def _run_loader(self, key, loader):
+        payload = await loader()
+        if payload is not None:
+            self.put(key, payload)
+        return payload
+
+    def _loaded(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        # exception() заодно помечает исключение полученным: фоновую загрузку может никто не ждать
+        if task.exception() is None:
+            self._retry.pop(key, None)
+            return
+        self.failed += 1
+        failures = self._retry[key][0] if key in self._retry else 0
+        delay = min(self.retry_max, self.retry_base * 2 ** failures) * random.uniform(0.5, 1.0)
+        self._retry[key] = (failures + 1, time.monotonic() + delay)
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "shared": self.shared,
+                "stale": self.stale, "failed": self.failed}
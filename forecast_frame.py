@@ -0,0 +1,209 @@
+import datetime
+import hashlib
+
+import numpy as np
+
+DAY_START_HOUR = 6
+DAY_END_HOUR = 21
+SLOT_HOURS = 3
+EPOCH = datetime.date(1970, 1, 1)
+
+
+class ForecastFrame:
+    # Ответ /forecast в виде столбцов NumPy. Разбирается один раз при получении,
+    # все сводки дальше - векторные операции над этими массивами.
+    __slots__ = ("dt", "tz_offset", "local_day", "local_minute", "temp", "wind", "rain",
+                 "humidity", "pressure", "clouds", "desc_code", "descs", "version")
+
+    def __init__(self, dt, tz_offset, temp, wind, rain, humidity, pressure, clouds, desc_code, descs):
+        self.dt = dt
+        self.tz_offset = tz_offset
+        local = dt + tz_offset
+        self.local_day = local // 86400
+        self.local_minute = (local % 86400) // 60
+        self.temp = temp
+        self.wind = wind
+        self.rain = rain
+        self.humidity = humidity
+        self.pressure = pressure
+        self.clouds = clouds
+        self.desc_code = desc_code
+        self.descs = descs
+        # Отпечаток содержимого: одинаковые ответы дают одну версию, любое изменение - новую
+        digest = hashlib.blake2b(digest_size=8)
+        for column in (dt, temp, wind, rain, humidity, pressure, clouds, desc_code):
+            digest.update(column.tobytes())
+        digest.update(f"{tz_offset}|{'|'.join(descs)}".encode())
+        self.version = digest.hexdigest()
+
+    def __len__(self):
+        return len(self.dt)
+
+    @classmethod
+    def from_payload(cls, data):
+        items = data.get('list') or []
+        n = len(items)
+        dt = np.empty(n, dtype=np.int64)
+        temp = np.empty(n)
+        wind = np.empty(n)
+        rain = np.zeros(n)
+        humidity = np.full(n, np.nan)
+        pressure = np.full(n, np.nan)
+        clouds = np.zeros(n)
+        desc_code = np.empty(n, dtype=np.int32)
+        descs = []
+        desc_index = {}
+        for i, item in enumerate(items):
+            if 'dt' in item:
+                dt[i] = item['dt']
+            else:
+                dt[i] = int(datetime.datetime.strptime(item['dt_txt'], "%Y-%m-%d %H:%M:%S")
+                            .replace(tzinfo=datetime.timezone.utc).timestamp())
+            main = item['main']
+            temp[i] = main['temp']
+            wind[i] = item['wind']['speed']
+            rain[i] = (item.get('rain') or {}).get('3h', 0)
+            if main.get('humidity') is not None:
+                humidity[i] = main['humidity']
+            if main.get('pressure') is not None:
+                pressure[i] = main['pressure']
+            clouds[i] = (item.get('clouds') or {}).get('all', 0)
+            desc = item['weather'][0]['description']
+            code = desc_index.get(desc)
+            if code is None:
+                code = desc_index[desc] = len(descs)
+                descs.append(desc)
+            desc_code[i] = code
+        # Смещение часового пояса города в секундах; без него группируем по UTC, как раньше
+        tz_offset = int((data.get('city') or {}).get('timezone') or 0)
+        order = np.argsort(dt, kind='stable')
+        return cls(dt[order], tz_offset, temp[order], wind[order], rain[order], humidity[order],
+                   pressure[order], clouds[order], desc_code[order], descs)
+
+
+def local_date(day):
+    return EPOCH + datetime.timedelta(days=int(day))
+
+
+def hhmm(minute):
+    return f"{int(minute) // 60:02d}:{int(minute) % 60:02d}"
+
+
+def rain_windows(minutes, rainy):
+    # Непрерывные интервалы дождя по соседним 3-часовым отрезкам: [(начало, конец)] в минутах
+    rain_minutes = minutes[rainy]
+    if len(rain_minutes) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rain_minutes) != SLOT_HOURS * 60) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks - 1, [len(rain_minutes) - 1]))
+    return [(int(rain_minutes[s]), int(rain_minutes[e])) for s, e in zip(starts, ends)]
+
+
+def daylight_slots(minute):
+    # Сколько 3-часовых отрезков умещается в световой день, если сетка отрезков проходит через
+    # местную минуту minute (у поясов со смещением не кратным 3 часам отрезков бывает 5, а не 6)
+    first = DAY_START_HOUR * 60 + (int(minute) - DAY_START_HOUR * 60) % (SLOT_HOURS * 60)
+    return (DAY_END_HOUR * 60 - first) // (SLOT_HOURS * 60) + 1
+
+
+def daylight_summary(frame):
+    # Сводка на ближайший день (по местному времени города), у которого осталась хотя бы половина
+    # дневных отрезков. Вечером от сегодняшнего дня остаются один-два отрезка, и сводка по ним
+    # выдавала бы их за весь день, поэтому берётся следующий день
+    if len(frame) == 0:
+        return None
+    hours = frame.local_minute // 60
+    daylight = (hours >= DAY_START_HOUR) & (hours <= DAY_END_HOUR)
+    if not daylight.any():
+        return None
+    full = daylight_slots(frame.local_minute[0])
+    day = frame.local_day[np.argmax(daylight)]
+    mask = daylight & (frame.local_day == day)
+    later = daylight & (frame.local_day > day)
+    if mask.sum() * 2 < full and later.any():
+        day = frame.local_day[np.argmax(later)]
+        mask = daylight & (frame.local_day == day)
+    minutes = frame.local_minute[mask]
+    rainy = frame.rain[mask] > 0
+    return {
+        "date": local_date(day),
+        "temp_min": float(frame.temp[mask].min()),
+        "temp_max": float(frame.temp[mask].max()),
+        "wind_avg": round(float(frame.wind[mask].mean()), 1),
+        # Весь день - только если в прогнозе есть все дневные отрезки и дождь в каждом
+        "rain_all_day": bool(rainy.all()) and len(minutes) == full,
+        "rain_windows": rain_windows(minutes, rainy),
+    }
+
+
+def daily_summary(frame, days=5):
+    # Сводка по дням местного времени: строки отсортированы по дате
+    if len(frame) == 0:
+        return []
+    # Строки отсортированы по времени, поэтому каждый день - непрерывный отрезок
+    new_day = np.diff(frame.local_day) != 0
+    starts = np.concatenate(([0], np.flatnonzero(new_day) + 1))
+    day_values = frame.local_day[starts]
+    day_idx = np.concatenate(([0], np.cumsum(new_day)))
+    counts = np.diff(np.append(starts, len(frame)))
+    # Самое частое описание за день; при равенстве - то, что встретилось в ответе раньше
+    n_descs = len(frame.descs)
+    desc_counts = np.bincount(day_idx * n_descs + frame.desc_code, minlength=len(day_values) * n_descs)
+    dominant = desc_counts.reshape(len(day_values), n_descs).argmax(axis=1)
+    t_min = np.minimum.reduceat(frame.temp, starts)
+    t_max = np.maximum.reduceat(frame.temp, starts)
+    wind_avg = np.add.reduceat(frame.wind, starts) / counts
+    rain_sum = np.add.reduceat(frame.rain, starts)
+    rows = []
+    for i in range(min(days, len(day_values))):
+        rows.append({
+            "date": local_date(day_values[i]),
+            "temp_min": float(t_min[i]),
+            "temp_max": float(t_max[i]),
+            "wind_avg": round(float(wind_avg[i]), 1),
+            "rain_sum": round(float(rain_sum[i]), 1),
+            "desc": frame.descs[dominant[i]],
+        })
+    return rows
+
+
+def day_over_day(frame, day, past_dt, past_temp):
+    # Дневной максимум местного дня day по прогнозу и в те же часы накануне по истории (past_dt, past_temp):
+    # (сейчас, накануне) или None, если общих часов нет
+    hours = frame.local_minute // 60
+    mask = (frame.local_day == day) & (hours >= DAY_START_HOUR) & (hours <= DAY_END_HOUR)
+    past_local = past_dt + frame.tz_offset
+    past_minute = past_local % 86400 // 60
+    past_mask = (past_local // 86400 == day - 1) & np.isin(past_minute, frame.local_minute[mask])
+    if not past_mask.any():
+        return None
+    matched = np.isin(frame.local_minute[mask], past_minute[past_mask])
+    return float(frame.temp[mask][matched].max()), float(past_temp[past_mask].max())
+
+
+def upcoming(frame, start, end):
+    # Отрезки прогноза, которые начинаются в [start, end) (unix-время)
+    return (frame.dt >= start) & (frame.dt < end)
+
+
+def new_rain(previous, current, start, end):
+    # Окна дождя в [start, end) по новому прогнозу, если по прошлому на это время дождя не было вовсе
+    mask = upcoming(current, start, end)
+    rainy = current.rain[mask] > 0
+    if not rainy.any() or (previous.rain[upcoming(previous, start, end)] > 0).any():
+        return []
+    return rain_windows(current.local_minute[mask], rainy)
+
+
+def temp_drop(previous, current, start, end):
+    # Наибольшее похолодание на одно и то же время в [start, end) по сравнению с прошлым прогнозом:
+    # (местная минута, было, стало) или None, если общих отрезков нет
+    common, prev_idx, cur_idx = np.intersect1d(previous.dt, current.dt, assume_unique=True, return_indices=True)
+    inside = (common >= start) & (common < end)
+    if not inside.any():
+        return None
+    prev_idx, cur_idx = prev_idx[inside], cur_idx[inside]
+    worst = int(np.argmax(previous.temp[prev_idx] - current.temp[cur_idx]))
+    return (int(current.local_minute[cur_idx[worst]]), float(previous.temp[prev_idx[worst]]),
+            float(current.temp[cur_idx[worst]]))
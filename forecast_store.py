@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Сколько секунд процесс, взявшийся за запрос города, держит его за собой.
+# Если он упал, не дождавшись ответа, после этого срока город запросит другой процесс.
+LEASE_SECONDS = 15
+POLL_INTERVAL = 0.05
+
+
+class ForecastStore:
+    # Общий для процессов кэш ответов /forecast в SQLite (WAL). Город запрашивает у провайдера
+    # один процесс - тот, кто первым взял аренду; остальные ждут и читают его ответ из файла.
+    def __init__(self, path, lease=LEASE_SECONDS):
+        self.path = path
+        self.lease = lease
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.conn = None
+        # Соединение одно на процесс, а вызовы идут из потоков asyncio.to_thread
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.shared = 0
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS forecasts "
+                          "(city TEXT PRIMARY KEY, fetched_at REAL NOT NULL, payload TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS leases "
+                          "(city TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL)")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _claim(self, key, max_age):
+        # Свежий ответ (строка JSON), True - аренда наша и запрашивать нам, None - ждём чужой запрос
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT payload, fetched_at FROM forecasts WHERE city = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= max_age:
+                    self.conn.execute("COMMIT")
+                    return row[0]
+                cur = self.conn.execute(
+                    "INSERT INTO leases (city, owner, until) VALUES (?, ?, ?) "
+                    "ON CONFLICT(city) DO UPDATE SET owner = excluded.owner, until = excluded.until "
+                    "WHERE leases.until < ?", (key, self.owner, now + self.lease, now))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return True if cur.rowcount == 1 else None
+
+    def _save(self, key, payload):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if payload is not None:
+                    self.conn.execute("INSERT OR REPLACE INTO forecasts (city, fetched_at, payload) VALUES (?, ?, ?)",
+                                      (key, time.time(), payload))
+                self.conn.execute("DELETE FROM leases WHERE city = ? AND owner = ?", (key, self.owner))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    async def get(self, key, fetch, max_age):
+        # fetch - корутина-функция, возвращающая ответ провайдера (dict) или None
+        while True:
+            claim = await asyncio.to_thread(self._claim, key, max_age)
+            if claim is True:
+                break
+            if claim is not None:
+                self.shared += 1
+                return json.loads(claim)
+            await asyncio.sleep(POLL_INTERVAL)
+        try:
+            payload = await fetch()
+        except BaseException:
+            await asyncio.to_thread(self._save, key, None)
+            raise
+        text = json.dumps(payload, ensure_ascii=False, separators=(",", ":")) if payload is not None else None
+        await asyncio.to_thread(self._save, key, text)
+        self.fetched += 1
+        return payload
+
+    def stats(self):
+        return {"fetched": self.fetched, "shared": self.shared}
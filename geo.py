@@ -0,0 +1,147 @@
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+
+import http_client
+from disk_cache import PersistentDict
+from forecast_cache import normalize_city
+
+# Локальный индекс часовых поясов необязателен; сам timezonefinder (и numpy) загружается при первом поиске
+OFFLINE_INDEX = importlib.util.find_spec("timezonefinder") is not None
+
+# Адреса сервисов можно переопределить, например на локальные заглушки (benchmarks/standins.py).
+# OPENWEATHER_URL - общий для геокодера и прогноза
+OPENWEATHER_URL = os.getenv('OPENWEATHER_URL', 'https://api.openweathermap.org').rstrip('/')
+GEOCODE_URL = f"{OPENWEATHER_URL}/geo/1.0/direct"
+TIMEZONEDB_URL = os.getenv('TIMEZONEDB_URL', 'http://api.timezonedb.com').rstrip('/') + "/v2.1/get-time-zone"
+GEOCODE_CACHE_FILE = os.getenv('GEOCODE_CACHE_FILE', 'geocode.json')
+# Сколько секунд помнить, что геокодер не нашёл название (опечатки, старые записи без координат),
+# и не спрашивать его снова; и сколько таких названий держать в памяти
+NOT_FOUND_TTL = float(os.getenv('GEOCODE_NOT_FOUND_TTL', '600'))
+NOT_FOUND_MAX = 10000
+
+# city -> {"lat": ..., "lon": ..., "tz": ..., "names": {язык: название}} (в старых записях names нет)
+_cache = PersistentDict(GEOCODE_CACHE_FILE)
+_finder = None
+# Индекс загружается в потоке (asyncio.to_thread), первые поиски могут прийти одновременно
+_finder_lock = threading.Lock()
+# Не найденные геокодером названия: key -> monotonic-время, до которого не спрашивать снова
+_not_found = {}
+# Одновременные промахи по одному городу ждут один общий запрос: key -> asyncio.Task
+_inflight = {}
+hits = 0
+misses = 0
+not_found_hits = 0
+
+
+def _load_finder():
+    global _finder
+    with _finder_lock:
+        if _finder is None:
+            from timezonefinder import TimezoneFinder
+            _finder = TimezoneFinder()
+
+
+async def load_offline_index():
+    # Импорт timezonefinder и чтение его данных занимают заметное время - в потоке, не в event loop.
+    # Вызывается при старте в фоне и перед первым поиском пояса, если к нему индекс ещё не готов
+    if OFFLINE_INDEX and _finder is None:
+        await asyncio.to_thread(_load_finder)
+
+
+def timezone_offline(lat, lon):
+    # Локальный индекс границ часовых поясов (timezonefinder), без обращения к TimezoneDB;
+    # None, если индекса нет или он ещё не загружен (load_offline_index)
+    if _finder is None:
+        return None
+    return _finder.timezone_at(lat=lat, lng=lon)
+
+
+async def geocode(city, api_key):
+    # -> (lat, lon, {язык: название}) или None, если город не найден
+    resp = await http_client.get("geocode", GEOCODE_URL, params={"q": city, "limit": 1, "appid": api_key})
+    data = resp.json()
+    if not data:
+        return None
+    names = {"en": data[0].get("name"), **(data[0].get("local_names") or {})}
+    return data[0]['lat'], data[0]['lon'], {lang: names[lang] for lang in ("ru", "en") if names.get(lang)}
+
+
+async def timezone_online(lat, lon, api_key):
+    params = {"key": api_key, "format": "json", "by": "position", "lat": lat, "lng": lon}
+    resp = await http_client.get("timezone", TIMEZONEDB_URL, params=params)
+    data = resp.json()
+    if data.get('status') == 'OK':
+        return data.get('zoneName')
+    return None
+
+
+async def resolve_city(city, openweather_key, timezonedb_key):
+    global hits, misses, not_found_hits
+    key = normalize_city(city)
+    entry = _cache.get(key)
+    if entry is not None and entry.get("tz"):
+        hits += 1
+        return entry
+    if entry is None and _not_found.get(key, 0) > time.monotonic():
+        not_found_hits += 1
+        return None
+    task = _inflight.get(key)
+    if task is None:
+        misses += 1
+        task = _inflight[key] = asyncio.ensure_future(_resolve(key, city, entry, openweather_key, timezonedb_key))
+        task.add_done_callback(lambda done: _forget(key, done))
+    return await asyncio.shield(task)
+
+
+def _forget(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    # Помечаем исключение полученным: ждавшие запрос могли быть отменены
+    if not task.cancelled():
+        task.exception()
+
+
+async def _resolve(key, city, entry, openweather_key, timezonedb_key):
+    if entry is None:
+        try:
+            found = await geocode(city, openweather_key)
+        except http_client.ProviderUnavailable:
+            # Недоступность геокодера - не то же самое, что неизвестный город: пусть решает вызывающий
+            raise
+        except Exception:
+            return None
+        if found is None:
+            _remember_not_found(key)
+            return None
+        _not_found.pop(key, None)
+        entry = {"lat": found[0], "lon": found[1], "tz": None, "names": found[2]}
+    else:
+        entry = dict(entry)
+    await load_offline_index()
+    tz = timezone_offline(entry["lat"], entry["lon"])
+    if tz is None:
+        try:
+            tz = await timezone_online(entry["lat"], entry["lon"], timezonedb_key)
+        except Exception:
+            tz = None
+    entry["tz"] = tz
+    _cache.set(key, entry)
+    return entry
+
+
+def _remember_not_found(key):
+    now = time.monotonic()
+    if len(_not_found) >= NOT_FOUND_MAX:
+        for stale in [stale for stale, until in _not_found.items() if until <= now]:
+            del _not_found[stale]
+        while len(_not_found) >= NOT_FOUND_MAX:
+            del _not_found[next(iter(_not_found))]
+    _not_found[key] = now + NOT_FOUND_TTL
+
+
+def stats():
+    return {"hits": hits, "misses": misses, "not_found_hits": not_found_hits, "not_found": len(_not_found),
+            "cached": len(_cache), "offline_index": OFFLINE_INDEX}
@@ -0,0 +1,238 @@
+import asyncio
+import os
+import random
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+
+# Таймауты по типам запросов (секунды): connect, read
+ENDPOINT_TIMEOUTS = {
+    "geocode": httpx.Timeout(5.0, connect=3.0),
+    "timezone": httpx.Timeout(5.0, connect=3.0),
+    "translate": httpx.Timeout(5.0, connect=3.0),
+    "forecast": httpx.Timeout(10.0, connect=3.0),
+}
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+
+# Сколько одновременных запросов можно держать к одному хосту
+MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "20"))
+MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "40"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Предохранитель на провайдера (хост): после BREAKER_THRESHOLD ошибок подряд запросы к нему
+# сразу завершаются ProviderUnavailable, не дожидаясь таймаута. Через BREAKER_OPEN_SECONDS
+# пропускается один пробный запрос; если и он неудачен, пауза удваивается (до BREAKER_MAX_OPEN_SECONDS)
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "5"))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "120"))
+# Повторы GET-запросов при ошибке соединения или ответе 5xx/429: пауза RETRY_BASE_DELAY * 2^n
+# со случайным разбросом, не больше RETRY_MAX_DELAY
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.getenv("HTTP_RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("HTTP_RETRY_MAX_DELAY", "2"))
+
+REQUEST_SECONDS = metrics.histogram(
+    "weather_external_request_seconds", "Длительность запросов к внешним API", ["endpoint"])
+REQUEST_ERRORS = metrics.counter(
+    "weather_external_errors_total", "Ошибки запросов к внешним API: исключение или HTTP-статус", ["endpoint", "error"])
+REQUEST_RETRIES = metrics.counter(
+    "weather_external_retries_total", "Повторные запросы к внешним API", ["endpoint"])
+BREAKER_REJECTED = metrics.counter(
+    "weather_breaker_rejected_total", "Запросы, отклонённые открытым предохранителем", ["provider"])
+
+
+class ProviderUnavailable(Exception):
+    # Провайдер не отвечает: открыт предохранитель, ошибка соединения или ответ 5xx/429.
+    # retryable=False - повторять сейчас бесполезно (предохранитель открыт или истёк таймаут)
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitBreaker:
+    # Вызывается только из event loop процесса (у процессов-воркеров свои предохранители),
+    # поэтому состояние меняется без блокировок
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, open_seconds=BREAKER_OPEN_SECONDS,
+                 max_open_seconds=BREAKER_MAX_OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0  # открытий подряд без единого успешного запроса
+        self.open_until = 0.0
+        self._probing = False
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() < self.open_until:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        # Полуоткрыт: пропускаем ровно один пробный запрос, остальные ждут его результата
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def retry_in(self):
+        return max(0.0, self.open_until - time.monotonic())
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._probing = False
+
+    def release(self):
+        self._probing = False
+
+    def failure(self):
+        if self.state == self.OPEN:
+            # Ответы на запросы, начатые до открытия: пауза уже назначена
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            delay = min(self.max_open_seconds, self.open_seconds * 2 ** self.trips)
+            self.state = self.OPEN
+            self.open_until = time.monotonic() + delay
+            self.trips += 1
+            self.failures = 0
+            self._probing = False
+
+
+_breakers = {}  # хост -> CircuitBreaker, общие для всех loop процесса
+
+
+def breaker(host):
+    cb = _breakers.get(host)
+    if cb is None:
+        cb = _breakers[host] = CircuitBreaker()
+    return cb
+
+
+def breaker_states():
+    return [((host,), cb.state) for host, cb in sorted(_breakers.items())]
+
+
+metrics.callback("weather_breaker_state", "Состояние предохранителя провайдера: 0 - закрыт, 1 - пробный запрос, 2 - открыт",
+                 "gauge", breaker_states, ["provider"])
+
+
+def _retry_delay(attempt):
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+_pools = weakref.WeakKeyDictionary()
+# Транспорт для всех новых клиентов; бенчмарки подставляют сюда httpx.MockTransport
+_transport = None
+
+
+def configure(transport=None):
+    global _transport
+    _transport = transport
+    _pools.clear()
+    _breakers.clear()
+
+
+class _LoopPool:
+    # Клиент и семафоры привязаны к event loop, а loop у процесса бывает не один: перенос старых записей
+    # при запуске (asyncio.run в load_user_states) идёт до loop бота. Поэтому держим их отдельно для каждого loop
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=MAX_KEEPALIVE,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=DEFAULT_TIMEOUT,
+            transport=_transport,
+        )
+        self.host_limits = {}
+
+    def host_semaphore(self, host):
+        sem = self.host_limits.get(host)
+        if sem is None:
+            sem = self.host_limits[host] = asyncio.Semaphore(MAX_PER_HOST)
+        return sem
+
+
+def _get_pool():
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = _LoopPool()
+    return pool
+
+
+async def request(endpoint, method, url, **kwargs):
+    host = urlsplit(url).netloc
+    # Повторяем только идемпотентные запросы
+    attempts = 1 + (RETRIES if method == "GET" else 0)
+    for attempt in range(attempts):
+        if attempt:
+            REQUEST_RETRIES.inc(endpoint=endpoint)
+            await asyncio.sleep(_retry_delay(attempt - 1))
+        try:
+            return await _request_once(endpoint, method, url, host, kwargs)
+        except ProviderUnavailable as e:
+            if not e.retryable or attempt + 1 == attempts:
+                raise
+
+
+async def _request_once(endpoint, method, url, host, kwargs):
+    cb = breaker(host)
+    if not cb.allow():
+        BREAKER_REJECTED.inc(provider=host)
+        raise ProviderUnavailable(f"{host} недоступен, повтор через {cb.retry_in():.0f} с", retryable=False)
+    pool = _get_pool()
+    kwargs.setdefault("timeout", ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+    async with pool.host_semaphore(host):
+        # Время считаем без ожидания семафора: это задержка самого провайдера
+        started = time.perf_counter()
+        try:
+            response = await pool.client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            REQUEST_ERRORS.inc(endpoint=endpoint, error=type(e).__name__)
+            cb.failure()
+            # Таймаут уже исчерпал отведённое ожидание, повтор лишь удвоит его
+            raise ProviderUnavailable(f"{host}: {type(e).__name__}",
+                                      retryable=not isinstance(e, httpx.TimeoutException)) from e
+        except BaseException as e:
+            REQUEST_ERRORS.inc(endpoint=endpoint, error=type(e).__name__)
+            # Отмена или ошибка в нашем коде - не повод считать провайдера упавшим,
+            # но пробный запрос полуоткрытого предохранителя нужно освободить
+            cb.release()
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    if response.status_code >= 400:
+        REQUEST_ERRORS.inc(endpoint=endpoint, error=f"http_{response.status_code}")
+    if response.status_code >= 500 or response.status_code == 429:
+        cb.failure()
+        raise ProviderUnavailable(f"{host}: HTTP {response.status_code}")
+    cb.success()
+    return response
+
+
+async def get(endpoint, url, **kwargs):
+    return await request(endpoint, "GET", url, **kwargs)
+
+
+async def post(endpoint, url, **kwargs):
+    return await request(endpoint, "POST", url, **kwargs)
+
+
+async def close():
+    loop = asyncio.get_running_loop()
+    pool = _pools.pop(loop, None)
+    if pool is not None:
+        await pool.client.aclose()
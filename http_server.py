@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 1024 * 1024
+MAX_HEADER_LINES = 100
+READ_TIMEOUT = 30.0
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 429: "Too Many Requests",
+           500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class HttpServer:
+    # Минимальный HTTP/1.1 сервер на asyncio для служебных эндпоинтов (метрики, профиль).
+    # Обработчик маршрута: async (Request) -> (статус, content-type, тело в bytes или str)
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        sockets = self._server.sockets or []
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+        logger.info("HTTP сервер слушает %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            # Keep-alive: на одном соединении обрабатываем запросы, пока клиент не закроет его
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+                if request is None:
+                    break
+                if isinstance(request, int):
+                    await self._write(writer, request, "text/plain", REASONS.get(request, ""), close=True)
+                    break
+                status, content_type, body = await self._dispatch(request)
+                close = request.headers.get("connection", "").lower() == "close"
+                await self._write(writer, status, content_type, body, close)
+                if close:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return 400
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return 400
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            return 400
+        if length > MAX_BODY:
+            return 413
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            allowed = any(path == request.path for _, path in self.routes)
+            status = 405 if allowed else 404
+            return status, "text/plain", REASONS[status]
+        try:
+            return await handler(request)
+        except Exception:
+            logger.exception("Ошибка обработчика %s %s", request.method, request.path)
+            return 500, "text/plain", REASONS[500]
+
+    async def _write(self, writer, status, content_type, body, close=False):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
@@ -0,0 +1,44 @@
+import functools
+
+# Клавиатуры собираются при первом обращении: telegram импортируется только тогда, когда бот
+# уже отвечает пользователям, а постоянные клавиатуры создаются один раз на процесс
+HOME = "Домой 🏠"
+ADD_CITY = "➕ Добавить город"
+BACK = "⬅️ Назад"
+CUSTOM_TIME = "Ввести своё время"
+TIME_CHOICES = ("07:00", "07:30", "08:00", "08:30", "09:00", "09:30", "10:00", "10:30",
+                "18:00", "18:30", "19:00", "19:30", "20:00", "20:30")
+
+
+def _markup(rows):
+    from telegram import KeyboardButton, ReplyKeyboardMarkup
+    return ReplyKeyboardMarkup([[KeyboardButton(text) for text in row] for row in rows], resize_keyboard=True)
+
+
+@functools.cache
+def main_menu():
+    return _markup([
+        ["Добавить город 🏙️", "Удалить город 🗑️"],
+        ["Мои города 📋", "Расписание уведомлений 🕒"],
+        ["Показать погоду 🌦️(пока нет)", "Посмотреть погоду(пока нет) 🌍", "Установить время ⏰"],
+        ["Остановить уведомления ❌", "Помощь 🆘"],
+    ])
+
+
+@functools.cache
+def home():
+    return _markup([[HOME]])
+
+
+@functools.cache
+def time_choice(back=False):
+    # Своё время, затем готовые варианты по три в ряд; back - кнопка возврата к выбору города
+    rows = [[CUSTOM_TIME]] + [list(TIME_CHOICES[i:i + 3]) for i in range(0, len(TIME_CHOICES), 3)]
+    if back:
+        rows.append([BACK])
+    return _markup(rows)
+
+
+def cities(names, last):
+    # Города пользователя по одному в строке и кнопка last под ними
+    return _markup([[name] for name in names] + [[last]])
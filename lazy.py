@@ -0,0 +1,20 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    # Модуль, код которого выполняется при первом обращении к его атрибуту (importlib.util.LazyLoader).
+    # Только для модулей верхнего уровня: find_spec подмодуля сразу импортирует родительский пакет,
+    # поэтому telegram.ext и apscheduler импортируются внутри функций, где нужны впервые
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
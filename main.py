@@ -1,609 +1,963 @@
-def update_user_job(user_id):
-    state = user_states.get(user_id)
-    if not state:
-        print(f"[JobUpdate] Нет состояния для user_id={user_id}")
-        return
-    send_time = state.get("send_time")
-    notify_city = state.get("notify_city")
-    timezones = state.get("timezones", {})
-    timezone = timezones.get(notify_city, "Europe/Moscow")
-    job_id = f"weather_{user_id}"
-    print(f"[JobUpdate] user_id={user_id}, send_time={send_time}, notify_city={notify_city}, timezone={timezone}")
-    if send_time and notify_city:
-        hour, minute = map(int, send_time.split(":"))
-        print(f"[JobUpdate] Обновление задачи: user_id={user_id}, job_id={job_id}, time={send_time}, city={notify_city}, tz={timezone}")
-        scheduler.add_job(send_weather_job_sync, "cron", hour=hour, minute=minute, args=[user_id], id=job_id, replace_existing=True, timezone=timezone)
-        print(f"[JobUpdate] Задача добавлена: {scheduler.get_job(job_id)}")
-    else:
-        print(f"[JobUpdate] Не хватает данных для задачи: user_id={user_id}")
-        try:
-            scheduler.remove_job(job_id)
-        except Exception:
-            pass
-        # Предупреждение пользователю
-        # Найти update.message для user_id (через context не получится, поэтому только если есть активный update)
-        # Лучше отправлять предупреждение прямо в city_handler после выбора города, если нет времени
+from __future__ import annotations
+
+import asyncio
+import datetime
+import hmac
+import importlib
+import json
 import logging
 import os
 import random
 import re
-import requests
-import json
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, Bot
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
-from apscheduler.schedulers.background import BackgroundScheduler
-from dotenv import load_dotenv
+import signal
+import sqlite3
+import sys
+import time
+from typing import TYPE_CHECKING
+
+# config - первым: он читает .env до модулей, которые берут свои настройки из окружения при импорте
+import config
+from config import (
+    USER_DATA_FILE, USER_DB_FILE, TELEGRAM_TOKEN, TELEGRAM_API_URL, OPENWEATHER_API_KEY, TIMEZONEDB_API_KEY,
+    FORECAST_CACHE_TTL, FORECAST_CACHE_SIZE, FORECAST_STALE_TTL, FORECAST_STALE_WAIT,
+    NOTIFY_CONCURRENCY, PREFETCH_LEAD, PREFETCH_JITTER, PREFETCH_CONCURRENCY,
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_RATE, TELEGRAM_COORDINATOR_SHARE, METRICS_HOST, METRICS_PORT, UPDATE_CONCURRENCY,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WORKERS, FORECAST_STORE_FILE,
+    FORECAST_ARCHIVE_DIR, FORECAST_ARCHIVE_DAYS, ALERT_INTERVAL,
+)
+import alerts
+import geo
+import http_client
+import keyboards
+import log_config
+import metrics
+import storage
+import translation
+from http_server import HttpServer
+from profiler import profiler
+from workers import Coordinator
+from cities import CityRegistry
+from forecast_cache import ForecastCache, normalize_city
+from forecast_store import ForecastStore
+from send_queue import BULK, INTERACTIVE, SendQueue
+from storage import UserStore
+from summary_cache import SummaryCache
+from dispatcher import NotificationDispatcher
+from models import Dialog, UserRecord, interned
+from lazy import lazy_import
 
-load_dotenv()
+# telegram, telegram.ext и apscheduler импортируются там, где нужны впервые (build_application,
+# start_background, keyboards): импорт main для скриптов обслуживания и --check их не загружает
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
+# Разбор прогнозов на numpy - при первом прогнозе, а не при старте процесса
+forecast_frame = lazy_import("forecast_frame")
 
-USER_DATA_FILE = 'users.json'
 user_states = {}
-TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
-TIMEZONEDB_API_KEY = os.getenv('TIMEZONEDB_API_KEY')
+# Текущий шаг диалога, только в памяти: user_id -> Dialog
+dialogs = {}
 
-def save_user_states():
-    global user_states
-    with open(USER_DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(user_states, f, ensure_ascii=False, indent=2)
+forecast_cache = ForecastCache(ttl=FORECAST_CACHE_TTL, max_size=FORECAST_CACHE_SIZE,
+                               stale_ttl=FORECAST_STALE_TTL, stale_wait=FORECAST_STALE_WAIT)
+summary_cache = SummaryCache(max_size=FORECAST_CACHE_SIZE * 2)
+# Общий реестр городов; таблицы лежат в той же базе, что и пользователи
+city_registry = CityRegistry(USER_DB_FILE)
+user_store = UserStore(USER_DB_FILE, lambda user_id: user_states[user_id].to_dict() if user_id in user_states else None)
+send_queue = SendQueue(global_rate=TELEGRAM_GLOBAL_RATE, per_chat_rate=TELEGRAM_PER_CHAT_RATE, workers=NOTIFY_CONCURRENCY)
+
+forecast_store = None
+# История прогнозов; открывается в start_background вместе с numpy
+archive = None
+coordinator = None
+# Номер воркера в процессе-воркере; None - процесс, который отвечает пользователям
+worker_shard = None
+# Оповещения об изменении прогноза: подписчики - пользователи с настроенной ежедневной рассылкой
+alert_engine = alerts.AlertEngine()
+# Вызываются после каждой рассылки со сводкой (воркеры передают её координатору)
+job_listeners = []
+
+def save_user_state(user_id):
+    # Запись откладывается и пишется в базу пачкой вместе с другими изменениями
+    user_store.mark_dirty(user_id)
+    user = user_states.get(user_id)
+    alert_engine.index.set(user_id, alert_city(user))
+    if coordinator is not None:
+        coordinator.route(user_id, user.to_dict() if user else None)
+
+def alert_city(user):
+    # Город, об изменениях прогноза которого оповещать пользователя, или None
+    return user.notify_city if user is not None and user.send_time else None
+
+def subscription_for(user):
+    # (часовой пояс, время) для уведомлений пользователя или None, если они не настроены
+    if not (user.send_time and user.notify_city):
+        return None
+    city = city_registry.get(user.notify_city)
+    timezone = (city.tz if city is not None else None) or "Europe/Moscow"
+    return timezone, user.send_time
+
+def update_user_job(user_id):
+    # В режиме воркеров подписками занимается воркер-владелец: изменения уходят к нему из save_user_state
+    if coordinator is not None:
+        return
+    user = user_states.get(user_id)
+    if not user:
+        logger.warning("Нет состояния для user_id=%s", user_id)
+        return
+    subscription = subscription_for(user)
+    if subscription:
+        timezone, send_time = subscription
+        if dispatcher.subscribe(user_id, timezone, send_time):
+            schedule_dispatch()
+        logger.debug("Подписка обновлена: user_id=%s, time=%s, city=%s, tz=%s",
+                     user_id, send_time, user.notify_city, timezone)
+    else:
+        logger.debug("Не хватает данных для подписки: user_id=%s", user_id)
+        dispatcher.unsubscribe(user_id)
+        # Предупреждение пользователю
+        # Найти update.message для user_id (через context не получится, поэтому только если есть активный update)
+        # Лучше отправлять предупреждение прямо в city_handler после выбора города, если нет времени
+
+def restore_subscriptions():
+    # После перезапуска подписки восстанавливаются из сохранённых состояний одним проходом
+    entries = []
+    for user_id, user in user_states.items():
+        subscription = subscription_for(user)
+        if subscription:
+            entries.append((user_id, *subscription))
+    dispatcher.bulk_load(entries)
+    return len(entries)
 
 def load_user_states():
     global user_states
+    user_store.open()
+    user_store.migrate_json(USER_DATA_FILE)
+    city_registry.open()
+    # Записи старого формата (названия городов вместо id) переводим на id из реестра один раз
+    legacy = user_store.load_legacy()
+    if legacy:
+        started = time.perf_counter()
+        asyncio.run(migrate_city_names(legacy))
+        user_store.write_all(legacy)
+        logger.info("Города пользователей переведены на реестр: %s записей, городов в реестре %s, за %.1f с",
+                    len(legacy), len(city_registry), time.perf_counter() - started)
+    # user_id в базе целые (строковые ключи старого users.json приводятся при переносе)
+    user_states = user_store.load_all(UserRecord.from_dict)
+    for user_id, user in user_states.items():
+        alert_engine.index.set(user_id, alert_city(user))
+
+async def migrate_city_names(states):
+    # Каждое название геокодируется один раз на всю базу; если геокодер не знает город или недоступен,
+    # город попадает в реестр без координат, с часовым поясом из старой записи
+    names = {}
+    for state in states.values():
+        timezones = state.get("timezones") or {}
+        for name in [*state.get("cities", []), state.get("notify_city")]:
+            if isinstance(name, str):
+                names.setdefault(normalize_city(name), (name, timezones.get(name)))
+    limit = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+    async def locate(name, timezone):
+        async with limit:
+            try:
+                city = await resolve_city(name)
+            except http_client.ProviderUnavailable:
+                city = None
+        return city or city_registry.add(name, None, None, timezone)
+
     try:
-        with open(USER_DATA_FILE, 'r', encoding='utf-8') as f:
-            user_states = json.load(f)
-    except Exception:
-        user_states = {}
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
-
-main_keyboard = ReplyKeyboardMarkup([
-    [KeyboardButton("Добавить город 🏙️"), KeyboardButton("Удалить город 🗑️")],
-    [KeyboardButton("Мои города 📋"), KeyboardButton("Расписание уведомлений 🕒")],
-    [KeyboardButton("Показать погоду 🌦️(пока нет)"), KeyboardButton("Посмотреть погоду(пока нет) 🌍"), KeyboardButton("Установить время ⏰")],
-    [KeyboardButton("Остановить уведомления ❌"), KeyboardButton("Помощь 🆘")]
-], resize_keyboard=True)
-
-scheduler = BackgroundScheduler()
-
-def get_wish():
-    wishes = [
-        "Желаю отличного дня и прекрасного настроения! 😊🌞",
-        "Пусть сегодня всё получится! 💪✨",
-        "Солнечного настроения и удачи! ☀️🍀",
-        "Пусть день будет лёгким и радостным! 🕊️😃",
-        "Пусть погода радует, а дела спорятся! 🌤️📈",
-        "Хорошего дня и приятных сюрпризов! 🎁😄",
-        "Пусть каждый момент сегодня будет счастливым! 🥳🌈",
-        "Пусть улыбка не сходит с лица! 😁😊",
-        "Пусть день принесёт только хорошие новости! 📰👍",
-        "Пусть всё задуманное исполнится! 🎯🙌",
-        "Пусть этот день будет наполнен радостью и светом! 🌟",
-        "Пусть удача сопутствует во всех делах! 🍀",
-        "Пусть настроение будет на высоте! 😃",
-        "Пусть каждый час приносит приятные сюрпризы! 🎉",
-        "Пусть в душе будет тепло и гармония! 🧘‍♂️",
-        "Пусть все мечты сбудутся! ✨",
-        "Пусть день будет ярким и незабываемым! 🌈",
-        "Пусть вокруг будут только добрые люди! 🤗",
-        "Пусть будет много поводов для улыбки! 😄",
-        "Пусть всё задуманное реализуется легко и просто! 🚀"
+        found = await asyncio.gather(*(locate(name, tz) for name, tz in names.values()))
+    finally:
+        await http_client.close()
+    ids = {key: city.id for key, city in zip(names, found)}
+
+    def city_id(value):
+        return ids[normalize_city(value)] if isinstance(value, str) else value
+
+    for state in states.values():
+        cities = []
+        for value in state.get("cities", []):
+            if city_id(value) not in cities:
+                cities.append(city_id(value))
+        state["cities"] = cities
+        state.pop("timezones", None)
+        if state.get("notify_city") is not None:
+            state["notify_city"] = city_id(state["notify_city"])
+
+def open_forecast_store():
+    global forecast_store
+    forecast_store = ForecastStore(FORECAST_STORE_FILE)
+    forecast_store.open()
+
+def telegram_rates(shards):
+    # Лимит Telegram - на бота, а не на процесс: -> (лимит координатора, лимит каждого воркера),
+    # в сумме TELEGRAM_GLOBAL_RATE
+    own = TELEGRAM_GLOBAL_RATE * TELEGRAM_COORDINATOR_SHARE
+    return own, (TELEGRAM_GLOBAL_RATE - own) / shards
+
+def load_shard(shard, shards):
+    # Состояние процесса-воркера: только свои пользователи и своя доля лимита Telegram
+    global user_states, send_queue, METRICS_PORT, worker_shard
+    worker_shard = shard
+    open_forecast_store()
+    user_store.open()
+    city_registry.open()
+    user_states = user_store.load_all(UserRecord.from_dict, shard=shard, shards=shards)
+    restore_subscriptions()
+    send_queue = SendQueue(global_rate=telegram_rates(shards)[1], per_chat_rate=TELEGRAM_PER_CHAT_RATE,
+                           workers=NOTIFY_CONCURRENCY)
+    if METRICS_PORT > 0:
+        METRICS_PORT += 1 + shard
+
+def apply_routed_user(user_id, state):
+    # Изменение пользователя, пересланное координатором
+    if state is None:
+        user_states.pop(user_id, None)
+        dispatcher.unsubscribe(user_id)
+        schedule_dispatch()
+        return
+    user_states[user_id] = UserRecord.from_dict(state)
+    update_user_job(user_id)
+
+log_config.configure()
+logger = logging.getLogger("main")
+
+HANDLER_SECONDS = metrics.histogram("weather_handler_seconds", "Время обработки апдейта", ["handler"])
+HANDLER_ERRORS = metrics.counter("weather_handler_errors_total", "Исключения в обработчиках", ["handler", "error"])
+LAG_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+SCHEDULER_LAG = metrics.histogram(
+    "weather_scheduler_lag_seconds", "Опоздание запуска рассылки относительно запланированного времени",
+    buckets=LAG_BUCKETS)
+DELIVERY_LAG = metrics.histogram(
+    "weather_notification_delay_seconds", "Задержка доставки уведомления относительно запланированного времени",
+    buckets=LAG_BUCKETS)
+
+# Планировщик создаётся в start_background: apscheduler нужен только работающему боту
+scheduler = None
+dispatcher = NotificationDispatcher()
+DISPATCH_JOB_ID = "weather_dispatch"
+PREFETCH_JOB_ID = "weather_prefetch"
+ALERT_JOB_ID = "weather_alerts"
+ARCHIVE_JOB_ID = "weather_archive"
+prefetch_hits = 0
+prefetch_misses = 0
+metrics_server = None
+background_start = None
+# Рассылки и прогрев, запущенные из задач планировщика (см. spawn)
+background_tasks = set()
+update_processor = None
+
+def cache_counters():
+    forecast = forecast_cache.stats()
+    summaries = summary_cache.stats()
+    translations = translation.stats()
+    geocode = geo.stats()
+    return [
+        (("forecast", "hit"), forecast["hits"]), (("forecast", "miss"), forecast["misses"]),
+        (("forecast", "shared"), forecast["shared"]), (("forecast", "stale"), forecast["stale"]),
+        (("forecast", "failed"), forecast["failed"]),
+        (("summary", "hit"), summaries["hits"]), (("summary", "miss"), summaries["misses"]),
+        (("translation", "hit"), translations["hits"]), (("translation", "miss"), translations["misses"]),
+        (("geocode", "hit"), geocode["hits"]), (("geocode", "miss"), geocode["misses"]),
+        (("geocode", "not_found"), geocode["not_found_hits"]),
+        (("prefetch", "hit"), prefetch_hits), (("prefetch", "miss"), prefetch_misses),
     ]
-    return random.choice(wishes)
 
-async def get_timezone_by_city(city):
+metrics.callback("weather_cache_lookups_total", "Обращения к кэшам по результату", "counter",
+                 cache_counters, ["cache", "result"])
+metrics.callback("weather_send_queue_depth", "Сообщений в очереди отправки", "gauge",
+                 lambda: [(("interactive",), send_queue.depth[INTERACTIVE]), (("bulk",), send_queue.depth[BULK])],
+                 ["priority"])
+metrics.callback("weather_subscriptions", "Активные подписки на уведомления", "gauge",
+                 lambda: [((), len(dispatcher))])
+metrics.callback("weather_users", "Пользователей в памяти", "gauge", lambda: [((), len(user_states))])
+metrics.callback("weather_update_backlog", "Апдейтов в очередях пользователей", "gauge",
+                 lambda: [((), update_processor.backlog_size() if update_processor else 0)])
+metrics.callback("weather_updates_dropped_total", "Апдейты, отброшенные без обработки", "counter",
+                 lambda: [(("coalesced",), update_processor.coalesced), (("shed",), update_processor.shed)]
+                 if update_processor else [], ["reason"])
+
+WISHES = (
+    "Желаю отличного дня и прекрасного настроения! 😊🌞",
+    "Пусть сегодня всё получится! 💪✨",
+    "Солнечного настроения и удачи! ☀️🍀",
+    "Пусть день будет лёгким и радостным! 🕊️😃",
+    "Пусть погода радует, а дела спорятся! 🌤️📈",
+    "Хорошего дня и приятных сюрпризов! 🎁😄",
+    "Пусть каждый момент сегодня будет счастливым! 🥳🌈",
+    "Пусть улыбка не сходит с лица! 😁😊",
+    "Пусть день принесёт только хорошие новости! 📰👍",
+    "Пусть всё задуманное исполнится! 🎯🙌",
+    "Пусть этот день будет наполнен радостью и светом! 🌟",
+    "Пусть удача сопутствует во всех делах! 🍀",
+    "Пусть настроение будет на высоте! 😃",
+    "Пусть каждый час приносит приятные сюрпризы! 🎉",
+    "Пусть в душе будет тепло и гармония! 🧘‍♂️",
+    "Пусть все мечты сбудутся! ✨",
+    "Пусть день будет ярким и незабываемым! 🌈",
+    "Пусть вокруг будут только добрые люди! 🤗",
+    "Пусть будет много поводов для улыбки! 😄",
+    "Пусть всё задуманное реализуется легко и просто! 🚀",
+)
+# Пожелания вместе с переводом строки: к готовому тексту прогноза остаётся добавить одну строку
+WISH_SUFFIXES = tuple(f"\n{wish}" for wish in WISHES)
+
+def with_wish(text):
+    return text + random.choice(WISH_SUFFIXES)
+
+async def resolve_city(name):
+    # Город из реестра по любому известному написанию; новое написание геокодируется один раз.
+    # Город без координат или часового пояса (геокодер или TimezoneDB не ответили) уточняется заново.
+    # None - город не найден; ProviderUnavailable - геокодер сейчас недоступен
+    city = city_registry.find(name)
+    if city is not None and city.lat is not None and city.tz is not None:
+        return city
+    tz_unknown = city is not None and city.tz is None
     try:
-        url = f"http://api.openweathermap.org/geo/1.0/direct?q={city}&limit=1&appid={OPENWEATHER_API_KEY}"
-        resp = requests.get(url, timeout=5)
-        data = resp.json()
-        if not data:
-            return None
-        lat = data[0]['lat']
-        lon = data[0]['lon']
-    except Exception:
+        entry = await geo.resolve_city(name, OPENWEATHER_API_KEY, TIMEZONEDB_API_KEY)
+    except http_client.ProviderUnavailable:
+        if city is not None:
+            return city
+        raise
+    if entry is None:
+        return city
+    resolved = city_registry.add(name, entry["lat"], entry["lon"], entry["tz"], entry.get("names"))
+    if tz_unknown and resolved is city and city.tz is not None:
+        # Подписки на город шли по часовому поясу по умолчанию - переводим их на настоящий
+        for user_id in list(alert_engine.index.users(city.id)):
+            update_user_job(user_id)
+    return resolved
+
+async def fetch_forecast_payload(city):
+    url = f"{geo.OPENWEATHER_URL}/data/2.5/forecast"
+    params = {"appid": OPENWEATHER_API_KEY, "units": "metric", "lang": "ru"}
+    if city.lat is not None:
+        # По координатам: без перевода названия, и все написания города - один запрос
+        params.update(lat=city.lat, lon=city.lon)
+    else:
+        # Город перенесён из старых записей без координат - запрос по названию, как раньше
+        params["q"] = await translation.translate_city(city.name)
+    response = await http_client.get("forecast", url, params=params)
+    data = response.json()
+    if data.get('cod') != "200":
+        return None
+    return data
+
+async def fetch_forecast(city, max_age=FORECAST_CACHE_TTL):
+    if forecast_store is not None:
+        # Несколько процессов: город запрашивает один из них, остальные берут ответ из общего файла
+        data = await forecast_store.get(str(city.id), lambda: fetch_forecast_payload(city), max_age)
+    else:
+        data = await fetch_forecast_payload(city)
+    if data is None:
+        return None
+    # Разбираем ответ в столбцы один раз; дальше кэш хранит уже готовую таблицу
+    frame = forecast_frame.ForecastFrame.from_payload(data)
+    if archive is not None:
+        try:
+            archive.append(city.id, frame)
+        except OSError as e:
+            logger.warning("Архив прогнозов: не удалось записать %s: %s", city.name, e)
+    return frame
+
+async def get_forecast(city, refresh=False):
+    # Один и тот же ответ /forecast используется и для краткой сводки, и для прогноза на 5 дней.
+    # При прогреве подходит только ответ, полученный за последние PREFETCH_LEAD секунд
+    max_age = PREFETCH_LEAD if refresh else FORECAST_CACHE_TTL
+    return await forecast_cache.get(city.id, lambda: fetch_forecast(city, max_age), refresh=refresh)
+
+async def get_forecast_or_stale(city):
+    # Для ответов пользователю: пока сервис погоды недоступен, подходит и последний полученный прогноз.
+    # -> (frame, None) или (frame, возраст в секундах), если прогноз просрочен
+    return await forecast_cache.get_or_stale(city.id, lambda: fetch_forecast(city))
+
+def stale_note(age):
+    minutes = int(age // 60)
+    ago = f"{minutes // 60} ч" if minutes >= 120 else f"{max(minutes, 1)} мин"
+    return f"⚠️ Сервис погоды не отвечает, показан прогноз, полученный {ago} назад.\n"
+
+def local_today(frame):
+    return int((time.time() + frame.tz_offset) // 86400)
+
+def read_history(method, city_id, *args):
+    # Чтение архива для сводок: без архива или при ошибке чтения сводка просто обходится без истории.
+    # IndexError - столбцы суток разной длины: сутки пересжимали прямо во время чтения
+    if archive is None or city_id is None:
         return None
     try:
-        tz_url = f"http://api.timezonedb.com/v2.1/get-time-zone?key={TIMEZONEDB_API_KEY}&format=json&by=position&lat={lat}&lng={lon}"
-        tz_resp = requests.get(tz_url, timeout=5)
-        tz_data = tz_resp.json()
-        if tz_data.get('status') == 'OK':
-            return tz_data.get('zoneName')
+        return getattr(archive, method)(city_id, *args)
+    except (OSError, ValueError, IndexError) as e:
+        logger.warning("Архив прогнозов: ошибка чтения города %s: %s", city_id, e)
+        return None
+
+def compare_with_yesterday(city_id, frame, summary):
+    day = (summary["date"] - forecast_frame.EPOCH).days
+    start = (day - 1) * 86400 - frame.tz_offset
+    history = read_history("read", city_id, start, start + 86400)
+    if history is None:
+        return None
+    compared = forecast_frame.day_over_day(frame, day, history[0], history[1]["temp"])
+    if compared is None:
+        return None
+    now, before = round(compared[0]), round(compared[1])
+    label = "вчера" if day == local_today(frame) else "накануне"
+    if now == before:
+        return f"Днём как {label}: до {before}°C"
+    return f"Днём {'теплее' if now > before else 'холоднее'}, чем {label}: до {now}°C (было до {before}°C)"
+
+def format_weather_brief(city, frame, city_id=None):
+    # city_id - для сравнения с прошлыми днями по архиву
+    summary = forecast_frame.daylight_summary(frame)
+    if summary is None:
+        return f"Нет данных о прогнозе на световой день для {city}."
+    # Вечером сводка - уже на следующий день
+    ahead = (summary["date"] - forecast_frame.EPOCH).days - local_today(frame)
+    title = city if ahead <= 0 else f"{city}, завтра" if ahead == 1 else f"{city}, {summary['date']:%d.%m}"
+    rain_ranges = [(forecast_frame.hhmm(start), forecast_frame.hhmm(end)) for start, end in summary["rain_windows"]]
+    if rain_ranges:
+        # Если дождь почти весь день (например, с 6 до 21)
+        if summary["rain_all_day"]:
+            rain_text = "Дождь весь день"
+        elif len(rain_ranges) == 1 and rain_ranges[0][0] == rain_ranges[0][1]:
+            rain_text = f"Дождь ожидается в {rain_ranges[0][0]}"
         else:
-            return None
-    except Exception:
+            rain_text = "Дождь:\n" + '\n'.join([f"• с {r[0]} по {r[1]}" if r[0] != r[1] else f"• в {r[0]}" for r in rain_ranges])
+    else:
+        rain_text = "Без дождя"
+    text = f"{title}:\n{rain_text}\nВетер: {summary['wind_avg']} м/с\nТемпература: от {summary['temp_min']}°C до {summary['temp_max']}°C"
+    comparison = compare_with_yesterday(city_id, frame, summary)
+    return text if comparison is None else f"{text}\n{comparison}"
+
+WEATHER_EMOJIS = {
+    "ясно": "☀️",
+    "облачно": "☁️",
+    "дождь": "🌧️",
+    "небольшой дождь": "🌦️",
+    "гроза": "⛈️",
+    "снег": "❄️",
+    "переменная облачность": "🌤️",
+    "облачно с прояснениями": "🌤️",
+    "туман": "🌫️"
+}
+WEEKDAYS_RU = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+# За сколько прошедших дней архива считать тренд в прогнозе на 5 дней
+TREND_DAYS = 7
+
+def weekly_trend(city_id, frame, days):
+    today = local_today(frame)
+    past = read_history("daylight_temps", city_id, frame.tz_offset, today - TREND_DAYS, today - 1)
+    if not past or len(past) < 2 or not days:
         return None
+    past_avg = round(sum(high for _, high in past.values()) / len(past))
+    future_avg = round(sum(day["temp_max"] for day in days) / len(days))
+    if future_avg - past_avg >= 2:
+        word = "теплеет"
+    elif future_avg - past_avg <= -2:
+        word = "холодает"
+    else:
+        word = "без резких перемен"
+    return f"📈 За {len(past)} дн. днём в среднем до {past_avg}°C, в ближайшие дни до {future_avg}°C: {word}"
 
-async def get_weather_brief(city):
-    try:
-        translate_url = "https://libretranslate.de/translate"
-        payload = {"q": city, "source": "ru", "target": "en", "format": "text"}
-        resp = requests.post(translate_url, json=payload, timeout=5)
-        city_en = resp.json().get("translatedText", city) if resp.status_code == 200 else city
-    except Exception:
-        city_en = city
-    url = f"https://api.openweathermap.org/data/2.5/forecast?q={city_en}&appid={OPENWEATHER_API_KEY}&units=metric&lang=ru"
+def format_weather_5days(city, frame, city_id=None):
+    msg = f"Прогноз на 5 дней для {city}:\n"
+    days = forecast_frame.daily_summary(frame, days=5)
+    for day in days:
+        date = day["date"]
+        desc_main = day["desc"].capitalize()
+        emoji = ""
+        for k, v in WEATHER_EMOJIS.items():
+            if k in desc_main.lower():
+                emoji = v
+                break
+        msg += f"\n{WEEKDAYS_RU[date.weekday()]} {date.strftime('%d.%m.%Y')} {emoji} {desc_main}: {int(day['temp_min'])}…{int(day['temp_max'])}°C, 💨 {day['wind_avg']} м/с"
+        if day["rain_sum"] > 0:
+            msg += f", 🌧️ {day['rain_sum']} мм"
+    trend = weekly_trend(city_id, frame, days)
+    if trend:
+        msg += f"\n\n{trend}"
+    return msg
+
+async def render_forecast(kind, city, render):
     try:
-        response = requests.get(url)
-        data = response.json()
-        if data.get('cod') != "200":
-            return f"Не удалось получить прогноз для {city}."
-        temps, winds, rain_hours = [], [], []
-        for item in data['list']:
-            hour = int(item['dt_txt'][11:13])
-            if 6 <= hour <= 21:
-                temps.append(item['main']['temp'])
-                winds.append(item['wind']['speed'])
-                if 'rain' in item and item['rain'].get('3h', 0) > 0:
-                    rain_hours.append(item['dt_txt'][11:16])
-        if not temps:
-            return f"Нет данных о прогнозе на световой день для {city}."
-        temp_max = max(temps)
-        temp_min = min(temps)
-        wind_avg = round(sum(winds) / len(winds), 1)
-        rain_hours = sorted(set(rain_hours), key=lambda x: x)
-        rain_ranges = []
-        if rain_hours:
-            start = end = rain_hours[0]
-            for h in rain_hours[1:]:
-                prev_hour = int(end[:2])
-                curr_hour = int(h[:2])
-                if curr_hour == prev_hour + 3:
-                    end = h
-                else:
-                    rain_ranges.append((start, end))
-                    start = end = h
-            rain_ranges.append((start, end))
-            # Если дождь почти весь день (например, с 6 до 21)
-            day_start, day_end = "06:00", "21:00"
-            if len(rain_ranges) == 1 and rain_ranges[0][0] == day_start and rain_ranges[0][1] == day_end:
-                rain_text = "Дождь весь день"
-            elif len(rain_ranges) == 1 and rain_ranges[0][0] == rain_ranges[0][1]:
-                rain_text = f"Дождь ожидается в {rain_ranges[0][0]}"
-            else:
-                rain_text = "Дождь:\n" + '\n'.join([f"• с {r[0]} по {r[1]}" if r[0] != r[1] else f"• в {r[0]}" for r in rain_ranges])
-        else:
-            rain_text = "Без дождя"
-        return f"{city}:\n{rain_text}\nВетер: {wind_avg} м/с\nТемпература: от {temp_min}°C до {temp_max}°C"
+        data, age = await get_forecast_or_stale(city)
+        if data is None:
+            return f"Не удалось получить прогноз для {city.name}."
+        # Текст зависит и от архива за прошлые дни, но тот за местную дату уже не меняется
+        text = summary_cache.get(kind, city.id, city.name, data, lambda name, frame: render(name, frame, city.id))
+    except http_client.ProviderUnavailable:
+        return "Сервис погоды временно недоступен, попробуйте позже."
     except Exception as e:
         return f"Ошибка: {e}"
+    return text if age is None else stale_note(age) + text
+
+async def get_weather_brief(city):
+    return await render_forecast("brief", city, format_weather_brief)
 
 async def get_weather_5days(city):
-    try:
-        translate_url = "https://libretranslate.de/translate"
-        payload = {"q": city, "source": "ru", "target": "en", "format": "text"}
-        resp = requests.post(translate_url, json=payload, timeout=5)
-        city_en = resp.json().get("translatedText", city) if resp.status_code == 200 else city
-    except Exception:
-        city_en = city
-    url = f"https://api.openweathermap.org/data/2.5/forecast?q={city_en}&appid={OPENWEATHER_API_KEY}&units=metric&lang=ru"
-    try:
-        response = requests.get(url)
-        data = response.json()
-        if data.get('cod') != "200":
-            return f"Не удалось получить прогноз для {city}."
-        import datetime
-        days = {}
-        for item in data['list']:
-            date = item['dt_txt'][:10]
-            temp = item['main']['temp']
-            desc = item['weather'][0]['description']
-            wind = item['wind']['speed']
-            humidity = item['main'].get('humidity')
-            pressure = item['main'].get('pressure')
-            rain = item.get('rain', {}).get('3h', 0)
-            clouds = item.get('clouds', {}).get('all', 0)
-            if date not in days:
-                days[date] = {"temps": [], "descs": [], "winds": [], "humidity": [], "pressure": [], "rain": [], "clouds": []}
-            days[date]["temps"].append(temp)
-            days[date]["descs"].append(desc)
-            days[date]["winds"].append(wind)
-            days[date]["humidity"].append(humidity)
-            days[date]["pressure"].append(pressure)
-            days[date]["rain"].append(rain)
-            days[date]["clouds"].append(clouds)
-        msg = f"Прогноз на 5 дней для {city}:\n"
-        weather_emojis = {
-            "ясно": "☀️",
-            "облачно": "☁️",
-            "дождь": "🌧️",
-            "небольшой дождь": "🌦️",
-            "гроза": "⛈️",
-            "снег": "❄️",
-            "переменная облачность": "🌤️",
-            "облачно с прояснениями": "🌤️",
-            "туман": "🌫️"
-        }
-        for i, (date, info) in enumerate(days.items()):
-            if i >= 5:
-                break
-            dt = datetime.datetime.strptime(date, "%Y-%m-%d")
-            weekday = dt.strftime("%A")
-            weekday_ru = {
-                "Monday": "Пн",
-                "Tuesday": "Вт",
-                "Wednesday": "Ср",
-                "Thursday": "Чт",
-                "Friday": "Пт",
-                "Saturday": "Сб",
-                "Sunday": "Вс"
-            }[weekday]
-            date_fmt = dt.strftime("%d.%m.%Y")
-            t_min = int(min(info["temps"]))
-            t_max = int(max(info["temps"]))
-            wind_avg = round(sum(info["winds"]) / len(info["winds"]), 1)
-            rain_sum = round(sum(info["rain"]), 1)
-            desc_main = max(set(info["descs"]), key=info["descs"].count).capitalize()
-            emoji = ""
-            for k, v in weather_emojis.items():
-                if k in desc_main.lower():
-                    emoji = v
-                    break
-            msg += f"\n{weekday_ru} {date_fmt} {emoji} {desc_main}: {t_min}…{t_max}°C, 💨 {wind_avg} м/с"
-            if rain_sum > 0:
-                msg += f", 🌧️ {rain_sum} мм"
-        return msg
-    except Exception as e:
-        return f"Ошибка: {e}"
+    return await render_forecast("5days", city, format_weather_5days)
 
-async def send_weather_job(user_id):
-        state = user_states.get(user_id)
-        print(f"[Job] user_id={user_id}, state={state}")
-        if not state or not state.get("cities"):
-            print(f"[Job] Нет городов для user_id={user_id}")
-            return
-        notify_city = state.get("notify_city")
-        if not notify_city:
-            print(f"[Job] Нет выбранного города для уведомлений у user_id={user_id}")
-            return
-        print(f"[Job] Получение прогноза для города: {notify_city}")
-        weather_text = await get_weather_brief(notify_city)
-        wish = get_wish()
-        if TELEGRAM_TOKEN is None:
-            print("[Job] TELEGRAM_TOKEN не задан в .env")
-            raise ValueError("TELEGRAM_TOKEN не задан в .env")
-        bot = Bot(token=TELEGRAM_TOKEN)
+def schedule_dispatch():
+    # Одна задача планировщика на ближайший занятый слот вместо cron-задачи на каждого пользователя
+    if scheduler is None:
+        # Ещё не запущен: start_background сам запланирует ближайший слот
+        return
+    wake = dispatcher.next_wake()
+    if wake is None:
         try:
-            await bot.send_message(chat_id=user_id, text=f"{weather_text}\n{wish}")
-            print(f"[Job] Уведомление отправлено user_id={user_id}")
-        except Exception as e:
-            print(f"[Job] Ошибка при отправке сообщения: {e}")
-
-def send_weather_job_sync(user_id):
-    import asyncio
-    print(f"[Scheduler] Запуск уведомления для user_id={user_id}")
+            scheduler.remove_job(DISPATCH_JOB_ID)
+        except Exception:
+            pass
+        return
+    scheduler.add_job(dispatch_due_notifications, "date", run_date=wake, args=[wake], id=DISPATCH_JOB_ID,
+                      replace_existing=True, misfire_grace_time=None, coalesce=True)
+    # Прогрев прогнозов за несколько минут до отправки
+    now = datetime.datetime.now(datetime.timezone.utc)
+    prefetch_at = max(now, wake - datetime.timedelta(seconds=PREFETCH_LEAD))
+    scheduler.add_job(start_prefetch, "date", run_date=prefetch_at, args=[wake], id=PREFETCH_JOB_ID,
+                      replace_existing=True, misfire_grace_time=None, coalesce=True)
+
+def spawn(coro):
+    # Долгая работа, запущенная задачей планировщика, идёт отдельной задачей, а сама задача планировщика
+    # сразу завершается. Иначе волна, которая длится дольше, чем до следующего слота, заняла бы
+    # единственный экземпляр задачи (max_instances=1): следующий запуск пропускается, и рассылка встаёт
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def start_prefetch(wake):
+    spawn(prefetch_forecasts(wake))
+
+async def prefetch_forecasts(wake):
+    # Обновляем прогнозы городов, по которым скоро уйдут уведомления, чтобы при отправке они уже были в кэше
+    cities = {}
+    for fire_at, user_ids in dispatcher.upcoming(wake):
+        for user_id in user_ids:
+            user = user_states.get(user_id)
+            city = city_registry.get(user.notify_city) if user else None
+            if city is not None:
+                cities[city.id] = (city, fire_at)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    limit = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+    async def warm(city, fire_at):
+        # Запись должна дожить до отправки с запасом
+        needed = (fire_at - now).total_seconds() + 60
+        if forecast_cache.ttl_left(city.id) >= needed:
+            return False
+        async with limit:
+            await asyncio.sleep(random.uniform(0, PREFETCH_JITTER))
+            try:
+                await get_forecast(city, refresh=True)
+            except Exception as e:
+                logger.warning("Ошибка прогрева %s: %s", city.name, e)
+            return True
+
+    with profiler.section("prefetch"):
+        results = await asyncio.gather(*(warm(city, fire_at) for city, fire_at in cities.values()))
+    logger.info("Прогрев: городов к отправке %s, обновлено %s", len(cities), sum(results),
+                extra={"cities": len(cities), "refreshed": sum(results)})
+
+async def check_alerts():
+    # Прогноз каждого города с подписчиками берётся из кэша или запрашивается один раз на город,
+    # сравнивается с прошлым, и оповещение уходит всем подписчикам города одним и тем же текстом
+    now = time.time()
+    alert_engine.expire(now)
+    limit = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+    async def check(city_id):
+        city = city_registry.get(city_id)
+        if city is None or alert_engine.quiet(city_id, now):
+            return None, []
+        async with limit:
+            try:
+                frame = await get_forecast(city)
+            except Exception as e:
+                logger.warning("Ошибка проверки прогноза %s: %s", city.name, e)
+                return None, []
+        changes = alert_engine.observe(city_id, frame, now) if frame is not None else []
+        if not changes:
+            return None, []
+        return alerts.format_alert(city.name, changes), alert_engine.recipients(city_id, now)
+
+    with profiler.section("alerts"):
+        cities = alert_engine.index.cities()
+        results = await asyncio.gather(*(check(city_id) for city_id in cities))
+        futures = [send_queue.submit(user_id, text, priority=BULK)
+                   for text, user_ids in results for user_id in user_ids]
+        sent = await asyncio.gather(*futures, return_exceptions=True)
+    failed = sum(1 for result in sent if isinstance(result, Exception))
+    changed = sum(1 for text, _ in results if text is not None)
+    logger.info("Оповещения: городов %s, с изменениями %s, отправлено %s, ошибок %s",
+                len(cities), changed, len(sent) - failed, failed,
+                extra={"cities": len(cities), "changed": changed, "sent": len(sent) - failed, "failed": failed})
+
+async def send_weather_job(user_ids, planned=None):
+    with profiler.section("send_weather_job"):
+        await _send_weather_job(user_ids, planned)
+
+async def _send_weather_job(user_ids, planned):
+    by_city = {}
+    for user_id in user_ids:
+        user = user_states.get(user_id)
+        if not user or not user.cities:
+            logger.debug("Нет городов для user_id=%s", user_id)
+            continue
+        city = city_registry.get(user.notify_city)
+        if city is None:
+            logger.debug("Нет выбранного города для уведомлений у user_id=%s", user_id)
+            continue
+        by_city.setdefault(city.id, []).append(user_id)
+    if not by_city:
+        return
+    # Каждый город запрашиваем один раз на весь слот
+    global prefetch_hits, prefetch_misses
+    cities = [city_registry.get(city_id) for city_id in by_city]
+    warm = sum(1 for city in cities if forecast_cache.peek(city.id) is not None)
+    prefetch_hits += warm
+    prefetch_misses += len(cities) - warm
+    logger.info("Получение прогноза для городов: %s, прогрето заранее: %s", len(cities), warm,
+                extra={"cities": len(cities), "prefetched": warm})
+    texts = await asyncio.gather(*(get_weather_brief(city) for city in cities))
+    # Уведомления идут в общую очередь с низким приоритетом, ответы пользователям их обгоняют
+    wave_start = time.monotonic()
+    futures = [send_queue.submit(user_id, with_wish(text), priority=BULK)
+               for city, text in zip(cities, texts)
+               for user_id in by_city[city.id]]
+    if planned is not None:
+        # Задержка доставки считается от времени, на которое уведомление было назначено
+        planned_ts = planned.timestamp()
+
+        def record_delay(future):
+            if not future.cancelled() and future.exception() is None:
+                DELIVERY_LAG.observe(max(0.0, time.time() - planned_ts))
+
+        for future in futures:
+            future.add_done_callback(record_delay)
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    elapsed = time.monotonic() - wave_start
+    logger.info("Уведомления отправлены: %s из %s за %.1f с", len(results) - failed, len(results), elapsed,
+                extra={"sent": len(results) - failed, "failed": failed, "seconds": round(elapsed, 3),
+                       "queue": send_queue.stats()})
+    summary = {"sent": len(results) - failed, "failed": failed, "seconds": round(elapsed, 3),
+               "planned": planned.timestamp() if planned else None, "finished": time.time()}
+    for listener in job_listeners:
+        listener(summary)
+
+async def dispatch_due_notifications(planned=None):
+    if planned is not None:
+        SCHEDULER_LAG.observe(max(0.0, (datetime.datetime.now(datetime.timezone.utc) - planned).total_seconds()))
+    user_ids = dispatcher.pop_due()
+    schedule_dispatch()
+    logger.info("Запуск уведомлений: %s пользователей", len(user_ids), extra={"users": len(user_ids)})
+    if user_ids:
+        spawn(notification_wave(user_ids, planned))
+
+async def notification_wave(user_ids, planned):
     try:
-        print(f"[Scheduler] Перед запуском: user_states={user_states.get(user_id)}")
-        asyncio.run(send_weather_job(user_id))
-        print(f"[Scheduler] После запуска: user_states={user_states.get(user_id)}")
-    except Exception as e:
-        print(f"[Scheduler] Ошибка при отправке уведомления: {e}")
+        await send_weather_job(user_ids, planned)
+    except Exception:
+        logger.exception("Ошибка при отправке уведомлений")
+
+async def reply(update, text, reply_markup=None):
+    # Ответы пользователю идут через общую очередь отправки с высоким приоритетом
+    return await send_queue.send(update.effective_chat.id, text, priority=INTERACTIVE, reply_markup=reply_markup)
+
+def get_user(user_id):
+    record = user_states.get(user_id)
+    if record is None:
+        record = user_states[user_id] = UserRecord()
+    return record
+
+def get_dialog(user_id):
+    return dialogs.get(user_id, Dialog.IDLE)
+
+def set_dialog(user_id, dialog):
+    if dialog is Dialog.IDLE:
+        dialogs.pop(user_id, None)
+    else:
+        dialogs[user_id] = dialog
+
+def user_cities(user):
+    return [city for city in map(city_registry.get, user.cities) if city is not None]
+
+def city_keyboard(user, last):
+    return keyboards.cities([city.name for city in user_cities(user)], last)
+
+def find_user_city(user, text):
+    # Город из списка пользователя по названию с кнопки или любому известному написанию
+    city = city_registry.find(text)
+    return city if city is not None and city.id in user.cities else None
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    if user_id not in user_states:
-        user_states[user_id] = {"cities": [], "remove_mode": False, "add_mode": False, "time_mode": False, "send_time": None}
-    user_states[user_id]["remove_mode"] = False
-    user_states[user_id]["add_mode"] = False
-    user_states[user_id]["time_mode"] = False
+    user = get_user(user_id)
+    set_dialog(user_id, Dialog.IDLE)
     text = "Привет! Я бот прогноза погоды и хорошего настроения. Выберите действие:"
-    if user_states[user_id].get("send_time") is None:
+    if user.send_time is None:
         text += "\n\n❗ Для автоматических напоминаний о погоде установите время (кнопка \"Установить время ⏰\")."
-    await update.message.reply_text(text, reply_markup=main_keyboard)
+    await reply(update, text, reply_markup=keyboards.main_menu())
 
 async def add_city(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    if user_id not in user_states:
-        user_states[user_id] = {"cities": [], "remove_mode": False, "add_mode": False, "time_mode": False, "send_time": None}
-    user_states[user_id]["add_mode"] = True
-    await update.message.reply_text("Введите название города для добавления:",
-        reply_markup=ReplyKeyboardMarkup([[KeyboardButton("Домой 🏠")]], resize_keyboard=True))
+    set_dialog(user_id, Dialog.ADD_CITY)
+    await reply(update, "Введите название города для добавления:",
+        reply_markup=keyboards.home())
 
 async def remove_city(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    if user_id not in user_states:
-        user_states[user_id] = {"cities": [], "remove_mode": False, "add_mode": False, "time_mode": False, "send_time": None}
-    state = user_states[user_id]
-    cities = state["cities"]
+    cities = user_cities(get_user(user_id))
     if not cities:
-        await update.message.reply_text("У вас нет городов для удаления.", reply_markup=main_keyboard)
+        await reply(update, "У вас нет городов для удаления.", reply_markup=keyboards.main_menu())
         return
-    state["remove_mode"] = True
-    state["add_mode"] = False
-    state["time_mode"] = False
-    await update.message.reply_text(f"Ваши города: {', '.join(cities)}\nВведите название города для удаления:",
-        reply_markup=ReplyKeyboardMarkup([[KeyboardButton("Домой 🏠")]], resize_keyboard=True))
+    set_dialog(user_id, Dialog.REMOVE_CITY)
+    await reply(update, f"Ваши города: {', '.join(city.name for city in cities)}\nВведите название города для удаления:",
+        reply_markup=keyboards.home())
 
 async def set_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    if user_id not in user_states:
-        user_states[user_id] = {"cities": [], "remove_mode": False, "add_mode": False, "time_mode": False, "send_time": None}
-    state = user_states[user_id]
-    state["time_mode"] = True
-    state["add_mode"] = False
-    state["remove_mode"] = False
-    cities = state["cities"]
-    if cities:
-        state["choose_time_city_mode"] = True
-        await update.message.reply_text(
+    user = get_user(user_id)
+    if user.cities:
+        set_dialog(user_id, Dialog.CHOOSE_TIME_CITY)
+        await reply(update,
             "Выберите город для которого хотите установить время:",
-            reply_markup=ReplyKeyboardMarkup([[KeyboardButton(c)] for c in cities] + [[KeyboardButton("Домой 🏠")]], resize_keyboard=True)
+            reply_markup=city_keyboard(user, keyboards.HOME)
         )
         # После выбора города сразу предложить время (дизайн как выше)
         # Это реализовано в city_handler, но если город уже выбран, можно сразу показать клавиатуру времени
     else:
-        await update.message.reply_text("Сначала добавьте хотя бы один город.", reply_markup=main_keyboard)
+        set_dialog(user_id, Dialog.IDLE)
+        await reply(update, "Сначала добавьте хотя бы один город.", reply_markup=keyboards.main_menu())
 
-async def city_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id if update.effective_user else None
-    if user_id is None or update.message is None:
+async def on_choose_time_city(update, user_id, user, text):
+    city = find_user_city(user, text)
+    if city is not None:
+        user.notify_city = city.id
+        # Предложить выбрать время сразу после выбора города
+        # Новый дизайн клавиатуры времени
+        await reply(update,
+            f"Вы выбрали город {city.name} для уведомлений.\nВыберите время для получения ежедневных уведомлений или нажмите 'Ввести своё время':",
+            reply_markup=keyboards.time_choice()
+        )
+        set_dialog(user_id, Dialog.CHOOSE_TIME)
+        save_user_state(user_id)
+    else:
+        await reply(update,
+            f"Город {text.title()} не найден в вашем списке. Выберите город из списка:",
+            reply_markup=city_keyboard(user, keyboards.HOME)
+        )
+
+async def on_add_city(update, user_id, user, text):
+    set_dialog(user_id, Dialog.IDLE)
+    try:
+        city = await resolve_city(text.title())
+    except http_client.ProviderUnavailable:
+        await reply(update, "Поиск городов временно недоступен, попробуйте позже.", reply_markup=keyboards.main_menu())
         return
-    if user_id not in user_states:
-        user_states[user_id] = {"cities": [], "remove_mode": False, "add_mode": False, "time_mode": False, "send_time": None}
-    state = user_states[user_id]
-    # Handle city selection for time setting
-    if state.get("choose_time_city_mode"):
-        if update.message and update.message.text:
-            chosen_city = update.message.text.strip().title()
-        else:
-            chosen_city = ""
-        if chosen_city in state["cities"]:
-            state["notify_city"] = chosen_city
-            state["choose_time_city_mode"] = False
-            # Предложить выбрать время сразу после выбора города
-            # Новый дизайн клавиатуры времени
-            await update.message.reply_text(
-                f"Вы выбрали город {chosen_city} для уведомлений.\nВыберите время для получения ежедневных уведомлений или нажмите 'Ввести своё время':",
-                reply_markup=ReplyKeyboardMarkup(
-                    [[KeyboardButton('Ввести своё время')]] +
-                    [
-                        [KeyboardButton('07:00'), KeyboardButton('07:30'), KeyboardButton('08:00')],
-                        [KeyboardButton('08:30'), KeyboardButton('09:00'), KeyboardButton('09:30')],
-                        [KeyboardButton('10:00'), KeyboardButton('10:30'), KeyboardButton('18:00')],
-                        [KeyboardButton('18:30'), KeyboardButton('19:00'), KeyboardButton('19:30')],
-                        [KeyboardButton('20:00'), KeyboardButton('20:30')]
-                    ], resize_keyboard=True)
-                )
-            state["choose_time_mode"] = True
-            save_user_states()
-            return
-        else:
-            await update.message.reply_text(
-                f"Город {chosen_city} не найден в вашем списке. Выберите город из списка:",
-                reply_markup=ReplyKeyboardMarkup([[KeyboardButton(c)] for c in state["cities"]] + [[KeyboardButton("Домой 🏠")]], resize_keyboard=True)
-            )
-            return
-    city = update.message.text
+    if city is None:
+        await reply(update, f"⚠️ Город {text.title()} не найден.", reply_markup=keyboards.main_menu())
+    elif city.id not in user.cities:
+        user.add_city(city.id)
+        await reply(update,
+            f"✅ Город {city.name} добавлен! Часовой пояс: {city.tz if city.tz else 'не найден'}.\n\nХотите получать ежедневные уведомления по этому городу? Выберите его ниже или используйте команду 'Показать погоду 🌦️' для выбора.",
+            reply_markup=city_keyboard(user, keyboards.ADD_CITY)
+        )
+        set_dialog(user_id, Dialog.CHOOSE_CITY)
+        save_user_state(user_id)
+    else:
+        await reply(update, f"⚠️ Город {city.name} уже есть в вашем списке.", reply_markup=keyboards.main_menu())
+
+async def on_remove_city(update, user_id, user, text):
+    city = find_user_city(user, text)
+    set_dialog(user_id, Dialog.IDLE)
     if city is not None:
-        city = city.strip()
-        city = city.title()
+        user.cities.remove(city.id)
+        await reply(update, f"Город {city.name} удалён.", reply_markup=keyboards.main_menu())
+        save_user_state(user_id)
     else:
-        city = ""
-    if state.get("add_mode"):
-        state["add_mode"] = False
-        cities_lower = [c.lower() for c in state["cities"]]
-        if city.lower() not in cities_lower:
-            state["cities"].append(city)
-            timezone = await get_timezone_by_city(city)
-            if "timezones" not in state:
-                state["timezones"] = {}
-            state["timezones"][city] = timezone
-            await update.message.reply_text(
-                f"✅ Город {city} добавлен! Часовой пояс: {timezone if timezone else 'не найден'}.\n\nХотите получать ежедневные уведомления по этому городу? Выберите его ниже или используйте команду 'Показать погоду 🌦️' для выбора.",
-                reply_markup=ReplyKeyboardMarkup([[KeyboardButton(c)] for c in state["cities"]] + [[KeyboardButton('➕ Добавить город')]], resize_keyboard=True)
-            )
-            state["choose_city_mode"] = True
-            save_user_states()
-        else:
-            await update.message.reply_text(f"⚠️ Город {city} уже есть в вашем списке.", reply_markup=main_keyboard)
-        return
-    if state.get("remove_mode"):
-        state["remove_mode"] = False
-        if city in state["cities"]:
-            state["cities"].remove(city)
-            await update.message.reply_text(f"Город {city} удалён.", reply_markup=main_keyboard)
-            save_user_states()
-        else:
-            await update.message.reply_text(f"Город {city} не найден в вашем списке.", reply_markup=main_keyboard)
+        await reply(update, f"Город {text.title()} не найден в вашем списке.", reply_markup=keyboards.main_menu())
+
+async def on_choose_city(update, user_id, user, text):
+    if text.lower() == keyboards.ADD_CITY.lower():
+        set_dialog(user_id, Dialog.ADD_CITY)
+        await reply(update, "Введите название города для добавления:")
         return
-    if state.get("choose_city_mode"):
-        chosen_city = update.message.text
-        if chosen_city is not None:
-            chosen_city = chosen_city.strip().title()
-        else:
-            chosen_city = ""
-        city_buttons = [[KeyboardButton(c)] for c in state["cities"]]
-        city_buttons.append([KeyboardButton('➕ Добавить город')])
-        if chosen_city.strip().lower() == '➕ добавить город'.lower():
-            state["add_mode"] = True
-            state["choose_city_mode"] = False
-            await update.message.reply_text("Введите название города для добавления:")
-            save_user_states()
-            return
-        if chosen_city in state["cities"]:
-            state["notify_city"] = chosen_city
-            state["choose_city_mode"] = False
-            save_user_states()
-            update_user_job(user_id)
-            send_time = state.get("send_time")
-            if send_time:
-                await update.message.reply_text(
-                    f"✅ Город {chosen_city} выбран для уведомлений!\nУведомления будут приходить каждый день в {send_time}.",
-                    reply_markup=main_keyboard
-                )
-            else:
-                await update.message.reply_text(
-                    f"✅ Город {chosen_city} выбран для уведомлений!\n❗ Уведомления будут приходить только после выбора времени!\nВыберите время для получения ежедневных уведомлений или нажмите 'Ввести своё время':",
-                        reply_markup=ReplyKeyboardMarkup(
-                            [[KeyboardButton('Ввести своё время')]] +
-                            [
-                                [KeyboardButton('07:00'), KeyboardButton('07:30'), KeyboardButton('08:00')],
-                                [KeyboardButton('08:30'), KeyboardButton('09:00'), KeyboardButton('09:30')],
-                                [KeyboardButton('10:00'), KeyboardButton('10:30'), KeyboardButton('18:00')],
-                                [KeyboardButton('18:30'), KeyboardButton('19:00'), KeyboardButton('19:30')],
-                                [KeyboardButton('20:00'), KeyboardButton('20:30')],
-                                [KeyboardButton('⬅️ Назад')]
-                            ], resize_keyboard=True)
-                    )
-                state["choose_time_mode"] = True
-            return
-        else:
-            await update.message.reply_text(
-                f"⚠️ Город {chosen_city} не найден в вашем списке.\nВыберите город или добавьте новый:",
-                reply_markup=ReplyKeyboardMarkup(city_buttons, resize_keyboard=True)
-            )
-        return
-    if state.get("choose_time_mode"):
-        time_text = update.message.text
-        if time_text is not None:
-            time_text = time_text.strip()
-        else:
-            time_text = ""
-        time_options = ['07:00', '07:30', '08:00', '08:30', '09:00', '09:30', '10:00', '10:30',
-                        '18:00', '18:30', '19:00', '19:30', '20:00', '20:30']
-        if time_text == '⬅️ Назад':
-            state["choose_time_mode"] = False
-            state["choose_city_mode"] = True
-            await update.message.reply_text(
-                "Выберите город для уведомлений:",
-                reply_markup=ReplyKeyboardMarkup(
-                    [[KeyboardButton(c)] for c in state["cities"]] + [[KeyboardButton('➕ Добавить город')]], resize_keyboard=True)
-            )
-            save_user_states()
-            return
-        if time_text == 'Ввести своё время':
-            state["custom_time_mode"] = True
-            state["choose_time_mode"] = False
-            await update.message.reply_text("Введите время в формате ЧЧ:ММ (например, 06:45):")
-            save_user_states()
-            return
-        if time_text in time_options:
-            state["send_time"] = time_text
-            state["choose_time_mode"] = False
-            save_user_states()
-            update_user_job(user_id)
-            await update.message.reply_text(
-                f"⏰ Уведомления по городу {state['notify_city']} будут приходить каждый день в {time_text}!",
-                reply_markup=main_keyboard
-            )
-            return
-    if state.get("custom_time_mode"):
-        time_text = update.message.text
-        if time_text is not None:
-            time_text = time_text.strip()
-        else:
-            time_text = ""
-        if re.match(r'^([01]\d|2[0-3]):[0-5]\d$', time_text):
-            state["send_time"] = time_text
-            state["custom_time_mode"] = False
-            save_user_states()
-            update_user_job(user_id)
-            await update.message.reply_text(
-                f"⏰ Уведомления по городу {state['notify_city']} будут приходить каждый день в {time_text}!",
-                reply_markup=main_keyboard
-            )
-        else:
-            await update.message.reply_text("Некорректный формат времени. Введите в формате ЧЧ:ММ, например 06:45.")
+    city = find_user_city(user, text)
+    if city is None:
+        await reply(update,
+            f"⚠️ Город {text.title()} не найден в вашем списке.\nВыберите город или добавьте новый:",
+            reply_markup=city_keyboard(user, keyboards.ADD_CITY)
+        )
+        return
+    user.notify_city = city.id
+    set_dialog(user_id, Dialog.IDLE)
+    save_user_state(user_id)
+    update_user_job(user_id)
+    if user.send_time:
+        await reply(update,
+            f"✅ Город {city.name} выбран для уведомлений!\nУведомления будут приходить каждый день в {user.send_time}.",
+            reply_markup=keyboards.main_menu()
+        )
+    else:
+        await reply(update,
+            f"✅ Город {city.name} выбран для уведомлений!\n❗ Уведомления будут приходить только после выбора времени!\nВыберите время для получения ежедневных уведомлений или нажмите 'Ввести своё время':",
+            reply_markup=keyboards.time_choice(back=True)
+        )
+        set_dialog(user_id, Dialog.CHOOSE_TIME)
+
+TIME_OPTIONS = frozenset(keyboards.TIME_CHOICES)
+TIME_RE = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+
+async def on_choose_time(update, user_id, user, text):
+    if text == keyboards.BACK:
+        set_dialog(user_id, Dialog.CHOOSE_CITY)
+        await reply(update,
+            "Выберите город для уведомлений:",
+            reply_markup=city_keyboard(user, keyboards.ADD_CITY)
+        )
         return
+    if text == keyboards.CUSTOM_TIME:
+        set_dialog(user_id, Dialog.CUSTOM_TIME)
+        await reply(update, "Введите время в формате ЧЧ:ММ (например, 06:45):")
+        return
+    if text in TIME_OPTIONS:
+        await apply_send_time(update, user_id, user, text)
+
+async def on_custom_time(update, user_id, user, text):
+    # Здесь регулярное выражение действительно нужно: время вводится вручную
+    if TIME_RE.match(text):
+        await apply_send_time(update, user_id, user, text)
+    else:
+        await reply(update, "Некорректный формат времени. Введите в формате ЧЧ:ММ, например 06:45.")
+
+async def apply_send_time(update, user_id, user, time_text):
+    user.send_time = interned(time_text)
+    set_dialog(user_id, Dialog.IDLE)
+    save_user_state(user_id)
+    update_user_job(user_id)
+    city = city_registry.get(user.notify_city)
+    await reply(update,
+        f"⏰ Уведомления по городу {city.name if city else '?'} будут приходить каждый день в {time_text}!",
+        reply_markup=keyboards.main_menu()
+    )
+
+async def on_view_weather(update, user_id, user, text):
+    set_dialog(user_id, Dialog.IDLE)
+    try:
+        city = await resolve_city(text.title())
+    except http_client.ProviderUnavailable:
+        await reply(update, "Поиск городов временно недоступен, попробуйте позже.", reply_markup=keyboards.main_menu())
+        return
+    if city is None:
+        await reply(update, f"Не удалось получить прогноз для {text.title()}.", reply_markup=keyboards.main_menu())
+        return
+    weather_text = await get_weather_5days(city)
+    await reply(update, with_wish(weather_text), reply_markup=keyboards.main_menu())
+
+DIALOG_HANDLERS = {
+    Dialog.CHOOSE_TIME_CITY: on_choose_time_city,
+    Dialog.ADD_CITY: on_add_city,
+    Dialog.REMOVE_CITY: on_remove_city,
+    Dialog.CHOOSE_CITY: on_choose_city,
+    Dialog.CHOOSE_TIME: on_choose_time,
+    Dialog.CUSTOM_TIME: on_custom_time,
+    Dialog.VIEW_WEATHER: on_view_weather,
+}
+
+async def city_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Свободный текст обрабатывается в зависимости от текущего шага диалога
+    user_id = update.effective_user.id if update.effective_user else None
+    if user_id is None or update.message is None:
+        return
+    handler = DIALOG_HANDLERS.get(get_dialog(user_id))
+    if handler is None:
+        return
+    text = update.message.text.strip() if update.message.text else ""
+    await handler(update, user_id, get_user(user_id), text)
 
 async def weather(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    if user_id not in user_states:
-        user_states[user_id] = {"cities": [], "remove_mode": False, "add_mode": False, "time_mode": False, "send_time": None}
-    state = user_states[user_id]
-    cities = state["cities"]
-    if not cities:
-        await update.message.reply_text("Сначала добавьте хотя бы один город.", reply_markup=main_keyboard)
+    user = get_user(user_id)
+    if not user.cities:
+        await reply(update, "Сначала добавьте хотя бы один город.", reply_markup=keyboards.main_menu())
         return
-    notify_city = state.get("notify_city")
-    if not notify_city or notify_city not in cities:
-        await update.message.reply_text(
+    city = city_registry.get(user.notify_city) if user.notify_city in user.cities else None
+    if city is None:
+        await reply(update,
             "Выберите город для прогноза:",
-            reply_markup=ReplyKeyboardMarkup([[KeyboardButton(c)] for c in cities] + [[KeyboardButton('➕ Добавить город')]], resize_keyboard=True)
+            reply_markup=city_keyboard(user, keyboards.ADD_CITY)
         )
-        state["choose_city_mode"] = True
+        set_dialog(user_id, Dialog.CHOOSE_CITY)
         return
-    weather_text = await get_weather_brief(notify_city)
-    wish = get_wish()
-    await update.message.reply_text(f"{weather_text}\n{wish}", reply_markup=main_keyboard)
+    weather_text = await get_weather_brief(city)
+    await reply(update, with_wish(weather_text), reply_markup=keyboards.main_menu())
 
 async def view_weather_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    if user_id not in user_states:
-        user_states[user_id] = {"cities": [], "remove_mode": False, "add_mode": False, "time_mode": False, "send_time": None}
-    state = user_states[user_id]
-    state["view_weather_mode"] = True
-    cities = state.get("cities", [])
+    user = get_user(user_id)
+    cities = user_cities(user)
     if not cities:
-        await update.message.reply_text("Сначала добавьте хотя бы один город.", reply_markup=main_keyboard)
-        save_user_states()
+        await reply(update, "Сначала добавьте хотя бы один город.", reply_markup=keyboards.main_menu())
         return
     if len(cities) == 1:
-        city = cities[0]
-        weather_text = await get_weather_5days(city)
-        wish = get_wish()
-        await update.message.reply_text(f"{weather_text}\n{wish}", reply_markup=main_keyboard)
-        save_user_states()
+        weather_text = await get_weather_5days(cities[0])
+        await reply(update, with_wish(weather_text), reply_markup=keyboards.main_menu())
         return
-    await update.message.reply_text("🌍 Выберите город из списка или введите название:",
-        reply_markup=ReplyKeyboardMarkup([[KeyboardButton(c)] for c in cities] + [[KeyboardButton("Домой 🏠")]], resize_keyboard=True))
-    save_user_states()
+    set_dialog(user_id, Dialog.VIEW_WEATHER)
+    await reply(update, "🌍 Выберите город из списка или введите название:",
+        reply_markup=city_keyboard(user, keyboards.HOME))
 
 async def show_cities(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    state = user_states.get(user_id, {})
-    cities = state.get("cities", [])
-    timezones = state.get("timezones", {})
-    if not cities:
-        await update.message.reply_text("У вас пока нет добавленных городов.", reply_markup=main_keyboard)
+    user = user_states.get(user_id) or UserRecord()
+    if not user.cities:
+        await reply(update, "У вас пока нет добавленных городов.", reply_markup=keyboards.main_menu())
         return
     msg = "Ваши города:\n"
-    for c in cities:
-        tz = timezones.get(c, "?")
-        msg += f"• {c} (часовой пояс: {tz})\n"
-    await update.message.reply_text(msg, reply_markup=main_keyboard)
-    save_user_states()
+    for city in user_cities(user):
+        msg += f"• {city.name} (часовой пояс: {city.tz or '?'})\n"
+    await reply(update, msg, reply_markup=keyboards.main_menu())
 
 async def show_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    state = user_states.get(user_id, {})
-    notify_city = state.get("notify_city")
-    send_time = state.get("send_time")
-    timezones = state.get("timezones", {})
-    if notify_city and send_time:
-        tz = timezones.get(notify_city, "?")
-        await update.message.reply_text(
-            f"Уведомления настроены:\nГород: {notify_city}\nВремя: {send_time}\nЧасовой пояс: {tz}",
-            reply_markup=main_keyboard
+    user = user_states.get(user_id) or UserRecord()
+    city = city_registry.get(user.notify_city)
+    if city is not None and user.send_time:
+        await reply(update,
+            f"Уведомления настроены:\nГород: {city.name}\nВремя: {user.send_time}\nЧасовой пояс: {city.tz or '?'}",
+            reply_markup=keyboards.main_menu()
         )
     else:
-        await update.message.reply_text("Уведомления не настроены.", reply_markup=main_keyboard)
-    save_user_states()
+        await reply(update, "Уведомления не настроены.", reply_markup=keyboards.main_menu())
 
 async def stop_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
-    state = user_states.get(user_id, {})
-    state["send_time"] = None
-    update_user_job(user_id)
-    await update.message.reply_text("Уведомления остановлены. Вы можете включить их снова, выбрав город и время.", reply_markup=main_keyboard)
-    save_user_states()
+    user = user_states.get(user_id)
+    if user is not None:
+        user.send_time = None
+        update_user_job(user_id)
+        save_user_state(user_id)
+    await reply(update, "Уведомления остановлены. Вы можете включить их снова, выбрав город и время.", reply_markup=keyboards.main_menu())
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = (
@@ -619,44 +973,338 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• Установить время — выбрать время для уведомлений\n"
         "• Помощь — показать это сообщение\n"
     )
-    await update.message.reply_text(msg, reply_markup=main_keyboard)
+    await reply(update, msg, reply_markup=keyboards.main_menu())
 
 async def go_home(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is None or update.message is None:
         return
     # Сброс всех временных режимов
-    state = user_states.get(user_id, {})
-    for key in ["add_mode", "remove_mode", "time_mode", "choose_city_mode", "choose_time_mode", "custom_time_mode", "choose_time_city_mode", "view_weather_mode"]:
-        state[key] = False
-    await update.message.reply_text("Главное меню:", reply_markup=main_keyboard)
-    save_user_states()
+    set_dialog(user_id, Dialog.IDLE)
+    await reply(update, "Главное меню:", reply_markup=keyboards.main_menu())
+
+# Кнопки главного меню: точное совпадение текста. Подписи с "(пока нет)" - те, что реально на клавиатуре.
+BUTTON_HANDLERS = {
+    "Добавить город 🏙️": add_city,
+    "Удалить город 🗑️": remove_city,
+    "Мои города 📋": show_cities,
+    "Расписание уведомлений 🕒": show_schedule,
+    "Остановить уведомления ❌": stop_notifications,
+    "Показать погоду 🌦️": weather,
+    "Показать погоду 🌦️(пока нет)": weather,
+    "Посмотреть погоду 🌍": view_weather_cmd,
+    "Посмотреть погоду(пока нет) 🌍": view_weather_cmd,
+    "Установить время ⏰": set_time,
+    "Помощь 🆘": help_cmd,
+    "Помощь /help": help_cmd,
+    "Домой 🏠": go_home,
+}
+
+async def run_handler(label, handler, update, context):
+    started = time.perf_counter()
+    try:
+        with profiler.section("handlers"):
+            await handler(update, context)
+    except Exception as e:
+        HANDLER_ERRORS.inc(handler=label, error=type(e).__name__)
+        raise
+    finally:
+        HANDLER_SECONDS.observe(time.perf_counter() - started, handler=label)
+
+def instrumented(handler):
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await run_handler(handler.__name__, handler, update, context)
+    return wrapper
+
+async def route_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Один обработчик на весь текст: сначала кнопка по словарю, иначе шаг диалога пользователя
+    text = update.message.text if update.message else None
+    handler = BUTTON_HANDLERS.get(text) if text else None
+    if handler is not None:
+        label = handler.__name__
+    else:
+        handler = city_handler
+        dialog = get_dialog(update.effective_user.id) if update.effective_user else Dialog.IDLE
+        label = f"dialog_{dialog.name.lower()}"
+    await run_handler(label, handler, update, context)
+
+async def metrics_endpoint(request):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", metrics.render()
+
+async def profile_endpoint(request):
+    return 200, "text/plain; charset=utf-8", profiler.collapsed()
+
+async def start_metrics_server():
+    global metrics_server
+    if METRICS_PORT <= 0:
+        return None
+    metrics_server = HttpServer(METRICS_HOST, METRICS_PORT)
+    metrics_server.route("GET", "/metrics", metrics_endpoint)
+    metrics_server.route("GET", "/debug/profile", profile_endpoint)
+    await metrics_server.start()
+    return metrics_server
+
+async def start_pipeline(api):
+    global background_start
+    send_queue.start(api)
+    await start_metrics_server()
+    profiler.start()
+    # Планировщик и numpy не нужны для первого ответа: бот начинает принимать апдейты, не дожидаясь их
+    background_start = asyncio.create_task(start_background())
+
+async def start_background():
+    global scheduler
+    # Импорт - в потоке, чтобы не держать event loop (у каждого модуля своя блокировка импорта,
+    # так что обработчик, которому модуль понадобится раньше, просто дождётся его)
+    try:
+        module = await asyncio.to_thread(importlib.import_module, "apscheduler.schedulers.asyncio")
+        # Планировщик работает в event loop приложения; подписки, изменённые до его запуска, уже в dispatcher
+        scheduler = module.AsyncIOScheduler()
+        scheduler.start()
+        schedule_dispatch()
+        if ALERT_INTERVAL > 0 and worker_shard is None:
+            # Первый проход - сразу: он запоминает прогнозы, с которыми будут сравниваться следующие
+            scheduler.add_job(check_alerts, "interval", seconds=ALERT_INTERVAL, id=ALERT_JOB_ID,
+                              next_run_time=datetime.datetime.now(datetime.timezone.utc),
+                              misfire_grace_time=None, coalesce=True)
+        logger.info("Планировщик запущен, задач: %s", len(scheduler.get_jobs()))
+        # numpy нужен forecast_frame: первый прогноз не будет ждать его импорта
+        await asyncio.to_thread(importlib.import_module, "numpy")
+        # Индекс часовых поясов - заранее, а не на первом новом городе
+        await geo.load_offline_index()
+        if FORECAST_ARCHIVE_DIR:
+            await open_archive()
+    except Exception:
+        logger.exception("Ошибка фонового запуска")
+
+async def open_archive():
+    global archive
+    module = await asyncio.to_thread(importlib.import_module, "forecast_archive")
+    # Каждый процесс дописывает свои файлы; сжимает и чистит архив только основной
+    writer = "main" if worker_shard is None else f"worker{worker_shard}"
+    archive = module.ForecastArchive(FORECAST_ARCHIVE_DIR, FORECAST_ARCHIVE_DAYS, writer)
+    archive.open()
+    if worker_shard is None:
+        # Сутки сжимаются, как только они устоялись (SETTLE_SECONDS после конца суток UTC): до сжатия
+        # каждое чтение истории за них перебирает строки всех процессов. Первый проход - при запуске
+        settled_at = module.SETTLE_SECONDS + 60
+        scheduler.add_job(maintain_archive, "cron", hour=settled_at // 3600 % 24, minute=settled_at % 3600 // 60,
+                          timezone=datetime.timezone.utc, id=ARCHIVE_JOB_ID,
+                          next_run_time=datetime.datetime.now(datetime.timezone.utc),
+                          misfire_grace_time=None, coalesce=True)
+
+async def maintain_archive():
+    if archive is None:
+        return
+    started = time.perf_counter()
+    compacted, removed = await asyncio.to_thread(archive.compact)
+    if compacted or removed:
+        logger.info("Архив прогнозов: сжато суток %s, удалено %s, за %.1f с", compacted, removed,
+                    time.perf_counter() - started, extra={"compacted": compacted, "removed": removed})
+
+async def stop_pipeline():
+    global scheduler, archive
+    if background_start is not None and not background_start.done():
+        background_start.cancel()
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+        scheduler = None
+    if metrics_server is not None:
+        await metrics_server.stop()
+    profiler.stop()
+    if profiler.dump():
+        logger.info("Профиль сохранён: %s выборок", profiler.taken)
+    await send_queue.stop()
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await http_client.close()
+    await user_store.flush()
+    user_store.close()
+    city_registry.close()
+    if forecast_store is not None:
+        forecast_store.close()
+    if archive is not None:
+        archive.close()
+        archive = None
+
+async def post_init(app):
+    await start_pipeline(app.bot)
+    if coordinator is not None:
+        coordinator.start_monitor(user_store.flush)
+
+async def post_shutdown(app):
+    if coordinator is not None:
+        await asyncio.to_thread(coordinator.stop)
+    await stop_pipeline()
+
+def coalesce_key(update):
+    # Повторное нажатие кнопки меню или команда даёт тот же ответ, что и первое, поэтому такие
+    # апдейты подряд обрабатываются один раз. Ввод в диалоге (город, время) не склеивается никогда:
+    # одинаковый текст на разных шагах означает разное (например, "Москва" - добавить, затем выбрать)
+    text = update.message.text if update.message else None
+    if text in BUTTON_HANDLERS or text in ("/start", "/help"):
+        return text
+    return None
+
+def bot_api_urls():
+    # Аргументы telegram.Bot для сервера из TELEGRAM_API_URL (токен дописывается к ним самим Bot)
+    return {"base_url": f"{TELEGRAM_API_URL}/bot", "base_file_url": f"{TELEGRAM_API_URL}/file/bot"}
+
+def build_application(token, request=None, concurrency=UPDATE_CONCURRENCY):
+    global update_processor
+    from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+    from update_processor import PerUserUpdateProcessor
+    update_processor = PerUserUpdateProcessor(concurrency, coalesce=coalesce_key)
+    builder = (ApplicationBuilder().token(token)
+               .concurrent_updates(update_processor)
+               .post_init(post_init).post_shutdown(post_shutdown))
+    urls = bot_api_urls()
+    builder = builder.base_url(urls["base_url"]).base_file_url(urls["base_file_url"])
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
+    app.add_handler(CommandHandler('start', instrumented(start)))
+    app.add_handler(CommandHandler('help', instrumented(help_cmd)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, route_text))
+    return app
+
+def webhook_endpoint(app):
+    from telegram import Update
+
+    async def handle(request):
+        # Сравнение за постоянное время, чтобы секрет нельзя было подобрать по времени ответа
+        secret = request.headers.get("x-telegram-bot-api-secret-token", "").encode()
+        if not WEBHOOK_SECRET or not hmac.compare_digest(secret, WEBHOOK_SECRET.encode()):
+            return 401, "text/plain", "Unauthorized"
+        try:
+            update = Update.de_json(json.loads(request.body), app.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, "text/plain", "Bad Request"
+        # Отвечаем сразу: обработка идёт в фоне, Telegram не ждёт её и не повторяет запрос
+        await app.update_queue.put(update)
+        return 200, "text/plain", ""
+    return handle
+
+async def start_webhook(app, url=WEBHOOK_URL):
+    # То же, что run_polling делает для polling: initialize -> post_init -> start, плюс свой HTTP сервер
+    await app.initialize()
+    await post_init(app)
+    await app.start()
+    server = HttpServer(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    server.route("POST", WEBHOOK_PATH, webhook_endpoint(app))
+    await server.start()
+    if url:
+        from telegram import Update
+        await app.bot.set_webhook(url, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES,
+                                  max_connections=100)
+    logger.info("Webhook: %s -> %s:%s%s", url, WEBHOOK_LISTEN, server.port, WEBHOOK_PATH)
+    return server
+
+async def stop_webhook(app, server):
+    await server.stop()
+    await app.stop()
+    await post_shutdown(app)
+    await app.shutdown()
+
+async def serve_webhook(app):
+    server = await start_webhook(app)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await stop_webhook(app, server)
+
+def start_workers(shards, setup=None):
+    # Рассылка уходит в процессы-воркеры; этот процесс отвечает пользователям и пишет базу
+    global coordinator, send_queue
+    open_forecast_store()
+    send_queue = SendQueue(global_rate=telegram_rates(shards)[0], per_chat_rate=TELEGRAM_PER_CHAT_RATE,
+                           workers=NOTIFY_CONCURRENCY)
+    coordinator = Coordinator(shards, setup)
+    coordinator.start()
+    return coordinator
+
+def check_database(path, tables):
+    # -> (ошибки, строки отчёта) по файлу SQLite; tables - таблицы, число строк которых показать
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        counts = storage.inspect(path)
+    except sqlite3.Error as e:
+        return [f"{path}: {e}"], []
+    if counts is None:
+        if not os.access(directory, os.W_OK):
+            return [f"{path}: файла нет, и создать его в {directory} нельзя"], []
+        return [], [f"{path}: файла нет, будет создан при запуске"]
+    # WAL: рядом с базой создаются файлы -wal и -shm, поэтому писать нужно и в каталог
+    if not (os.access(path, os.W_OK) and os.access(directory, os.W_OK)):
+        return [f"{path}: нет прав на запись в файл или каталог {directory}"], []
+    return [], [f"{path}: " + ", ".join(f"{table} {counts.get(table, 0)}" for table in tables)]
+
+def check():
+    # python main.py --check: настройки и базы без подключения к Telegram и провайдерам погоды.
+    # Ничего не пишет; код выхода 0 - бота можно запускать с этими настройками
+    errors, warnings = config.validate()
+    if not TIMEZONEDB_API_KEY and not geo.OFFLINE_INDEX:
+        warnings.append("Нет ни TIMEZONEDB_API_KEY, ни timezonefinder: часовые пояса новых городов будут неизвестны")
+    for name, url in (("OPENWEATHER_URL", geo.OPENWEATHER_URL), ("TIMEZONEDB_URL", geo.TIMEZONEDB_URL),
+                      ("TRANSLATE_URL", translation.TRANSLATE_URL)):
+        if not url.startswith(("https://", "http://")):
+            errors.append(f"{name} должен начинаться с https:// или http://: {url}")
+    databases = [(USER_DB_FILE, ("users", "cities", "city_aliases"))]
+    if WORKERS > 0:
+        databases.append((FORECAST_STORE_FILE, ("forecasts",)))
+    if FORECAST_ARCHIVE_DIR:
+        target = FORECAST_ARCHIVE_DIR if os.path.isdir(FORECAST_ARCHIVE_DIR) else os.path.dirname(os.path.abspath(FORECAST_ARCHIVE_DIR))
+        if not os.access(target, os.W_OK):
+            errors.append(f"{FORECAST_ARCHIVE_DIR}: нет прав на запись в каталог архива прогнозов")
+    for path, tables in databases:
+        db_errors, lines = check_database(path, tables)
+        errors += db_errors
+        for line in lines:
+            logger.info("%s", line)
+    return report_problems(errors, warnings)
+
+def report_problems(errors, warnings):
+    for warning in warnings:
+        logger.warning("%s", warning)
+    for error in errors:
+        logger.error("%s", error)
+    return 1 if errors else 0
 
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Телеграм-бот прогноза погоды")
+    parser.add_argument("--check", action="store_true",
+                        help="проверить настройки и базу и выйти, не подключаясь к Telegram")
+    args = parser.parse_args()
+    if args.check:
+        status = check()
+        if status == 0:
+            logger.info("Проверка пройдена")
+        sys.exit(status)
+    # Настройки - до загрузки пользователей и запуска воркеров: с неверным токеном дальше идти незачем
+    if report_problems(*config.validate()):
+        sys.exit(1)
+
+    started = time.perf_counter()
     load_user_states()
-    print(f"[Main] user_states: {user_states}")
-    scheduler.start()
-    print("[Main] Scheduler запущен")
-    print(f"[Main] Список задач: {scheduler.get_jobs()}")
-
-    if TELEGRAM_TOKEN is None:
-        raise ValueError("TELEGRAM_TOKEN не задан в .env")
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-
-    app.add_handler(CommandHandler('start', start))
-    app.add_handler(CommandHandler('help', help_cmd))
-    app.add_handler(MessageHandler(filters.Regex("^Добавить город 🏙️$"), add_city))
-    app.add_handler(MessageHandler(filters.Regex("^Удалить город 🗑️$"), remove_city))
-    app.add_handler(MessageHandler(filters.Regex("^Мои города 📋$"), show_cities))
-    app.add_handler(MessageHandler(filters.Regex("^Расписание уведомлений 🕒$"), show_schedule))
-    app.add_handler(MessageHandler(filters.Regex("^Остановить уведомления ❌$"), stop_notifications))
-    app.add_handler(MessageHandler(filters.Regex("^Показать погоду 🌦️$"), weather))
-    app.add_handler(MessageHandler(filters.Regex("^Посмотреть погоду 🌍$"), view_weather_cmd))
-    app.add_handler(MessageHandler(filters.Regex("^Установить время ⏰$"), set_time))
-    app.add_handler(MessageHandler(filters.Regex("^Помощь /help$|^/help$"), help_cmd))
-    app.add_handler(MessageHandler(filters.Regex("^Домой 🏠$"), go_home))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, city_handler))
-    app.run_polling()
+    if WORKERS > 0:
+        start_workers(WORKERS)
+        restored = 0
+    else:
+        restored = restore_subscriptions()
+    logger.info("Загружено пользователей: %s, подписок: %s, за %.2f с",
+                len(user_states), restored, time.perf_counter() - started)
+
+    app = build_application(TELEGRAM_TOKEN)
+    if WEBHOOK_URL:
+        asyncio.run(serve_webhook(app))
+    else:
+        app.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,52 @@
+import sys
+from dataclasses import dataclass, field
+from enum import Enum
+
+
+class Dialog(Enum):
+    # Текущий шаг диалога с пользователем. Хранится только в памяти и в базу не пишется.
+    IDLE = 0
+    ADD_CITY = 1
+    REMOVE_CITY = 2
+    CHOOSE_TIME_CITY = 3
+    CHOOSE_CITY = 4
+    CHOOSE_TIME = 5
+    CUSTOM_TIME = 6
+    VIEW_WEATHER = 7
+
+
+def interned(value):
+    # Одинаковое время отправки у разных пользователей ссылается на одну строку
+    return sys.intern(value) if value is not None else None
+
+
+@dataclass(slots=True)
+class UserRecord:
+    # Постоянные данные пользователя: только то, что нужно сохранять между перезапусками.
+    # Города - id из общего реестра (cities.CityRegistry), часовой пояс хранится там же
+    cities: list = field(default_factory=list)
+    notify_city: int | None = None
+    send_time: str | None = None
+
+    def add_city(self, city_id):
+        if city_id not in self.cities:
+            self.cities.append(city_id)
+
+    def to_dict(self):
+        data = {"cities": self.cities}
+        if self.notify_city is not None:
+            data["notify_city"] = self.notify_city
+        if self.send_time is not None:
+            data["send_time"] = self.send_time
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        # Старые записи содержат флаги режимов (add_mode, remove_mode, ...), они отбрасываются.
+        # Записи с названиями городов вместо id переводятся до этого, при загрузке (main.migrate_city_names)
+        return cls(
+            cities=list(data.get("cities", [])),
+            notify_city=data.get("notify_city"),
+            send_time=interned(data.get("send_time")),
+        )
+
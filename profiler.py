@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+# Выборочный профилировщик горячих путей. Выключен, пока PROFILE_INTERVAL = 0;
+# включённый раз в PROFILE_INTERVAL секунд снимает стек основного потока, но только
+# пока выполняется хотя бы одна секция profiler.section(...), и копит стеки в формате
+# collapsed stacks (подходит для flamegraph.pl / speedscope).
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0'))
+PROFILE_OUTPUT = os.getenv('PROFILE_OUTPUT', 'profile.collapsed')
+MAX_DEPTH = 64
+
+
+class _NoopSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSection()
+
+
+class _Section:
+    __slots__ = ("profiler", "name")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._active[self.name] += 1
+        return self
+
+    def __exit__(self, *exc):
+        active = self.profiler._active
+        active[self.name] -= 1
+        if active[self.name] <= 0:
+            del active[self.name]
+        return False
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.taken = 0
+        self._active = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = threading.main_thread().ident
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def section(self, name):
+        if self._thread is None:
+            return _NOOP
+        return _Section(self, name)
+
+    def start(self, thread_id=None):
+        if not self.enabled or self._thread is not None:
+            return
+        self._target = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._active:
+                continue
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            # tuple() копирует ключи атомарно под GIL: секции меняются в потоке event loop
+            sections = "+".join(sorted(tuple(self._active)))
+            self.samples[f"{sections};" + ";".join(reversed(stack))] += 1
+            self.taken += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def dump(self, path=PROFILE_OUTPUT):
+        if not self.samples:
+            return False
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return True
+
+
+profiler = SamplingProfiler()
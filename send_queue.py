@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: ответы пользователю обгоняют массовые уведомления
+INTERACTIVE = 0
+BULK = 1
+
+MAX_RETRIES = 5
+# Сколько чатов держать в памяти: сверх этого забываются давно не использованные чаты без очереди
+MAX_CHATS = 100000
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+SEND_SECONDS = metrics.histogram(
+    "weather_send_seconds", "Время от постановки сообщения в очередь до отправки", ["priority"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0))
+SEND_FAILURES = metrics.counter(
+    "weather_send_failures_total", "Неотправленные сообщения по типу ошибки", ["error"])
+SEND_RETRIES = metrics.counter("weather_send_retries_total", "Повторы после RetryAfter")
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now=None):
+        # Забирает токен в долг и возвращает, сколько секунд нужно подождать до отправки
+        now = now or time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self, now=None):
+        # Забирает токен, только если он есть; иначе возвращает время ожидания
+        now = now or time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Message:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "future", "enqueued_at", "attempts", "ticket", "rank")
+
+    def __init__(self, chat_id, text, kwargs, priority, future):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.ticket = None  # номер записи в очереди; None - сообщение сейчас не в очереди
+        self.rank = priority  # приоритет, с которым оно туда поставлено
+
+
+class _Chat:
+    # Сообщения одного чата уходят строго по порядку: в общей очереди только первое из них
+    __slots__ = ("bucket", "messages")
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.messages = deque()
+
+
+class SendQueue:
+    # Общая очередь исходящих сообщений для обработчиков и уведомлений.
+    # Ограничения Telegram: ~30 сообщений в секунду на бота и ~1 в секунду на чат.
+    def __init__(self, global_rate=30.0, per_chat_rate=1.0, per_chat_burst=3, workers=8):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.workers = workers
+        self.bot = None
+        self._queue = None
+        self._tasks = []
+        self._chats = OrderedDict()  # chat_id -> _Chat, от давно не использованных к недавним
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self.depth = {INTERACTIVE: 0, BULK: 0}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latencies = deque(maxlen=10000)
+
+    def start(self, bot):
+        self.bot = bot
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def pending(self):
+        return sum(self.depth.values())
+
+    async def stop(self, timeout=5.0):
+        # Даём очереди дослать сообщения, но не дольше timeout
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending():
+            logger.warning("Не отправлено при остановке: %s", self.pending())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, chat_id, text, priority=BULK, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        msg = _Message(chat_id, text, kwargs, priority, future)
+        self.depth[priority] += 1
+        chat = self._chat(chat_id)
+        chat.messages.append(msg)
+        head = chat.messages[0]
+        if head is msg:
+            self._put(msg)
+        elif head.ticket is not None and priority < head.rank:
+            # Ответ пользователю не ждёт уведомлений других чатов: первое сообщение чата переставляется
+            # в очереди с приоритетом ответа
+            self._put(head)
+        return future
+
+    async def send(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def _put(self, msg):
+        # Запись с прежним номером, если она ещё в очереди, воркер пропустит
+        msg.ticket = next(self._seq)
+        msg.rank = min(queued.priority for queued in self._chats[msg.chat_id].messages)
+        self._queue.put_nowait((msg.rank, msg.ticket, msg))
+
+    def _requeue_later(self, msg, delay):
+        # Сообщение возвращается в очередь позже, а воркер тем временем отправляет сообщения других чатов;
+        # следующие сообщения этого чата ждут его
+        asyncio.get_running_loop().call_later(delay, self._put, msg)
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Забытый чат без очереди давно не писал, так что его лимит всё равно восстановился полностью
+            while len(self._chats) >= MAX_CHATS and not next(iter(self._chats.values())).messages:
+                self._chats.popitem(last=False)
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.per_chat_rate, self.per_chat_burst))
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    async def _worker(self):
+        # telegram импортируется при запуске очереди, а не при импорте модуля: к этому моменту бот его уже загрузил
+        from telegram.error import RetryAfter
+        while True:
+            _, ticket, msg = await self._queue.get()
+            self._queue.task_done()
+            if ticket != msg.ticket:
+                continue
+            msg.ticket = None
+            if msg.future.done():
+                self._finish(msg)
+                continue
+            now = time.monotonic()
+            if self._paused_until > now:
+                self._requeue_later(msg, self._paused_until - now)
+                continue
+            wait = self._chats[msg.chat_id].bucket.try_take(now)
+            if wait > 0:
+                self._requeue_later(msg, wait)
+                continue
+            wait = self.global_bucket.reserve(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await self.bot.send_message(chat_id=msg.chat_id, text=msg.text, **msg.kwargs)
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                msg.attempts += 1
+                self.retried += 1
+                SEND_RETRIES.inc()
+                if msg.attempts > MAX_RETRIES:
+                    self._fail(msg, e)
+                    continue
+                # Флуд-контроль Telegram: притормаживаем все отправки, а не только этот чат
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self._requeue_later(msg, delay)
+                continue
+            except Exception as e:
+                self._fail(msg, e)
+                continue
+            self.sent += 1
+            latency = time.monotonic() - msg.enqueued_at
+            self.latencies.append(latency)
+            SEND_SECONDS.observe(latency, priority=PRIORITY_NAMES[msg.priority])
+            if not msg.future.done():
+                msg.future.set_result(result)
+            self._finish(msg)
+
+    def _fail(self, msg, error):
+        self.failed += 1
+        SEND_FAILURES.inc(error=type(error).__name__)
+        logger.warning("Ошибка отправки chat_id=%s: %s: %s", msg.chat_id, type(error).__name__, error)
+        if not msg.future.done():
+            msg.future.set_exception(error)
+        self._finish(msg)
+
+    def _finish(self, msg):
+        # Сообщение отправлено или отброшено - в очередь встаёт следующее сообщение его чата
+        self.depth[msg.priority] -= 1
+        chat = self._chats[msg.chat_id]
+        chat.messages.popleft()
+        if chat.messages:
+            self._put(chat.messages[0])
+
+    def stats(self):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(len(lat) * p))], 3) if lat else None
+
+        return {
+            "depth_interactive": self.depth[INTERACTIVE],
+            "depth_bulk": self.depth[BULK],
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "latency_p50": pct(0.5),
+            "latency_p99": pct(0.99),
+        }
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.histogram("weather_storage_flush_seconds", "Запись пачки изменённых пользователей в SQLite")
+FLUSH_FAILURES = metrics.counter("weather_storage_flush_failures_total", "Неудачные записи пачки пользователей")
+# Через сколько секунд повторить запись пачки после ошибки
+FLUSH_RETRY_SECONDS = 5.0
+
+
+class UserStore:
+    # Хранилище пользователей в SQLite (WAL). Пишутся только изменённые записи,
+    # пачкой в одной транзакции, с небольшой задержкой после последнего изменения.
+    def __init__(self, path, get_record, flush_delay=0.5):
+        self.path = path
+        self.get_record = get_record
+        self.flush_delay = flush_delay
+        self.conn = None
+        self._dirty = set()
+        self._flush_handle = None
+        self._flush_lock = None
+        self.flushes = 0
+        self.written = 0
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def load_all(self, factory=None, shard=None, shards=1):
+        # factory превращает сохранённый dict в объект записи прямо при чтении, без промежуточного словаря.
+        # shard/shards - только пользователи одного воркера (user_id % shards == shard)
+        if shard is None:
+            rows = self.conn.execute("SELECT user_id, data FROM users")
+        else:
+            rows = self.conn.execute("SELECT user_id, data FROM users WHERE user_id % ? = ?", (shards, shard))
+        if factory is None:
+            return {user_id: json.loads(data) for user_id, data in rows}
+        return {user_id: factory(json.loads(data)) for user_id, data in rows}
+
+    def load_legacy(self):
+        # Записи старого формата: города в них - названия (строки), а не id из реестра. Поле timezones
+        # для отбора не годится: запись без часовых поясов сохранялась и без него.
+        # Строка в списке cities - кавычка в его JSON (в разы быстрее, чем json_each по каждой записи)
+        rows = self.conn.execute(
+            "SELECT user_id, data FROM users WHERE json_type(data, '$.notify_city') = 'text' "
+            "OR json_type(data, '$.timezones') IS NOT NULL "
+            "OR instr(json_extract(data, '$.cities'), '\"') > 0")
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def write_all(self, states):
+        self._write([(user_id, json.dumps(state, ensure_ascii=False, separators=(",", ":")))
+                     for user_id, state in states.items()], [])
+
+    def migrate_json(self, json_path):
+        # Одноразовый перенос из старого users.json; файл переименовывается, чтобы не импортировать его повторно
+        if not os.path.exists(json_path):
+            return 0
+        if self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None:
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Не удалось прочитать %s: %s", json_path, e)
+            return 0
+        # В JSON ключи стали строками, в базе user_id снова целые
+        rows = [(int(user_id), json.dumps(state, ensure_ascii=False)) for user_id, state in data.items()]
+        self._write(rows, [])
+        os.replace(json_path, f"{json_path}.migrated")
+        logger.info("Перенесено из %s: %s пользователей", json_path, len(rows))
+        return len(rows)
+
+    def mark_dirty(self, user_id):
+        self._dirty.add(user_id)
+        if self._flush_handle is not None:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        self._schedule_flush(self.flush_delay)
+
+    def _schedule_flush(self, delay):
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()))
+
+    def _take_dirty(self):
+        # Снимок записей делаем в потоке event loop, пока их никто не меняет
+        dirty, self._dirty = self._dirty, set()
+        rows, deletes = [], []
+        for user_id in dirty:
+            record = self.get_record(user_id)
+            if record is None:
+                deletes.append((user_id,))
+            else:
+                rows.append((user_id, json.dumps(record, ensure_ascii=False, separators=(",", ":"))))
+        return rows, deletes
+
+    def _write_failed(self, rows, deletes):
+        # Пачка не записана: её пользователи снова ждут записи (уже в своём последнем состоянии)
+        FLUSH_FAILURES.inc()
+        self._dirty.update(row[0] for row in rows)
+        self._dirty.update(row[0] for row in deletes)
+
+    async def flush(self):
+        # Явный вызов заменяет отложенный: его таймер иначе запустил бы ещё один, пустой проход
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            rows, deletes = self._take_dirty()
+            if not (rows or deletes):
+                return
+            try:
+                await asyncio.to_thread(self._write, rows, deletes)
+            except Exception:
+                self._write_failed(rows, deletes)
+                logger.exception("Не удалось записать пользователей (%s), повтор через %.0f с",
+                                 len(rows) + len(deletes), FLUSH_RETRY_SECONDS)
+                if self._flush_handle is None:
+                    self._schedule_flush(FLUSH_RETRY_SECONDS)
+
+    def flush_sync(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        rows, deletes = self._take_dirty()
+        if not (rows or deletes):
+            return
+        try:
+            self._write(rows, deletes)
+        except Exception:
+            self._write_failed(rows, deletes)
+            raise
+
+    def _write(self, rows, deletes):
+        # Одна транзакция на пачку: после сбоя в базе либо вся пачка, либо ничего
+        started = time.perf_counter()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data", rows)
+            self.conn.executemany("DELETE FROM users WHERE user_id = ?", deletes)
+        FLUSH_SECONDS.observe(time.perf_counter() - started)
+        self.flushes += 1
+        self.written += len(rows) + len(deletes)
+
+
+def inspect(path):
+    # Проверка файла базы без записи в него (для main.py --check): таблица -> число строк.
+    # None - файла ещё нет; sqlite3.DatabaseError - файл повреждён или это не база SQLite
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        status = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if status != "ok":
+            raise sqlite3.DatabaseError(status)
+        tables = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {name: conn.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0] for name in tables}
+    finally:
+        conn.close()
@@ -0,0 +1,34 @@
+import datetime
+from collections import OrderedDict
+
+
+class SummaryCache:
+    # Готовые тексты прогноза на город: (вид, id города) -> (версия прогноза, местная дата, текст).
+    # Текст зависит только от ответа /forecast и даты, поэтому все подписчики города получают
+    # одну и ту же строку. Новая версия прогноза или смена даты - просто перерисовка.
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, city_id, name, frame, render, now=None):
+        # render(name, frame) вызывается только при промахе
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        local_date = (now + datetime.timedelta(seconds=frame.tz_offset)).date()
+        key = (kind, city_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == frame.version and entry[1] == local_date:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+        text = render(name, frame)
+        self.misses += 1
+        self._entries[key] = (frame.version, local_date, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return text
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,49 @@
+# Тесты запускаются из корня репозитория: python -m pytest
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Файлы бота (база, кэши) - во временном каталоге. Настройки читаются при импорте config,
+# поэтому задаются здесь, до первого импорта main в тестах
+WORKDIR = tempfile.mkdtemp(prefix="weather_tests_")
+os.environ.update(
+    USER_DB_FILE=os.path.join(WORKDIR, "users.db"),
+    FORECAST_STORE_FILE=os.path.join(WORKDIR, "forecasts.db"),
+    TRANSLATION_CACHE_FILE=os.path.join(WORKDIR, "translations.json"),
+    GEOCODE_CACHE_FILE=os.path.join(WORKDIR, "geocode.json"),
+    FORECAST_ARCHIVE_DIR="",
+    METRICS_PORT="0",
+    LOG_LEVEL="WARNING",
+)
+
+
+@pytest.fixture
+def bot():
+    import main
+    return main
+
+
+@pytest.fixture
+def fresh_bot(bot, tmp_path, monkeypatch):
+    # main со своей базой, реестром городов и расписанием на каждый тест
+    import alerts
+    from cities import CityRegistry
+    from dispatcher import NotificationDispatcher
+    from storage import UserStore
+    path = str(tmp_path / "users.db")
+    monkeypatch.setattr(bot, "USER_DATA_FILE", str(tmp_path / "users.json"))
+    monkeypatch.setattr(bot, "user_states", {})
+    monkeypatch.setattr(bot, "user_store", UserStore(
+        path, lambda user_id: bot.user_states[user_id].to_dict() if user_id in bot.user_states else None))
+    monkeypatch.setattr(bot, "city_registry", CityRegistry(path))
+    monkeypatch.setattr(bot, "dispatcher", NotificationDispatcher())
+    monkeypatch.setattr(bot, "alert_engine", alerts.AlertEngine())
+    yield bot
+    bot.user_store.close()
+    bot.city_registry.close()
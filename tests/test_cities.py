@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+import http_client
+from cities import CityRegistry
+from models import UserRecord
+
+MOSCOW = {"lat": 55.7558, "lon": 37.6173, "tz": "Europe/Moscow", "names": {"ru": "Москва", "en": "Moscow"}}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = CityRegistry(str(tmp_path / "cities.db"))
+    registry.open()
+    yield registry
+    registry.close()
+
+
+def fake_geocoder(monkeypatch, bot, entries):
+    # entries: название -> результат geo.resolve_city или исключение
+    calls = []
+
+    async def resolve_city(name, openweather_key, timezonedb_key):
+        calls.append(name)
+        result = entries.get(name)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(bot.geo, "resolve_city", resolve_city)
+    return calls
+
+
+def test_spellings_with_same_coordinates_share_a_city(registry):
+    city = registry.add("Москва", 55.7558, 37.6173, "Europe/Moscow", {"en": "Moscow"})
+    assert registry.add("moscow", 55.7561, 37.6169, "Europe/Moscow").id == city.id
+    assert registry.find("  МОСКВА ") is city and registry.find("Moscow") is city
+    assert len(registry) == 1
+
+
+def test_unlocated_city_gets_coordinates_later(registry):
+    city = registry.add("Казань", None, None, "Europe/Moscow")
+    assert registry.add("Казань", 55.79, 49.12, None).id == city.id
+    assert (city.lat, city.tz) == (55.79, "Europe/Moscow")
+
+
+def test_registry_reads_cities_added_by_other_process(registry, tmp_path):
+    other = CityRegistry(registry.path)
+    other.open()
+    city_id = other.add("Омск", 54.99, 73.37, "Asia/Omsk").id
+    other.close()
+    assert registry.get(city_id).tz == "Asia/Omsk"
+
+
+def test_known_city_is_not_geocoded_again(fresh_bot, monkeypatch):
+    fresh_bot.city_registry.open()
+    city = fresh_bot.city_registry.add("Москва", MOSCOW["lat"], MOSCOW["lon"], MOSCOW["tz"])
+    calls = fake_geocoder(monkeypatch, fresh_bot, {})
+    assert asyncio.run(fresh_bot.resolve_city("Москва")) is city
+    assert calls == []
+
+
+def test_city_without_timezone_is_resolved_again(fresh_bot, monkeypatch):
+    # Город добавлен, пока TimezoneDB не отвечал: пояс уточняется при следующем обращении,
+    # и подписки на город переходят с пояса по умолчанию на настоящий
+    bot = fresh_bot
+    bot.city_registry.open()
+    city = bot.city_registry.add("Новосибирск", 55.03, 82.92, None)
+    bot.user_states[5] = UserRecord(cities=[city.id], notify_city=city.id, send_time="08:00")
+    bot.alert_engine.index.set(5, city.id)
+    bot.update_user_job(5)
+    assert bot.dispatcher.subscriptions[5] == ("Europe/Moscow", "08:00")
+
+    fake_geocoder(monkeypatch, bot, {"Новосибирск": {"lat": 55.03, "lon": 82.92, "tz": "Asia/Novosibirsk"}})
+    assert asyncio.run(bot.resolve_city("Новосибирск")).tz == "Asia/Novosibirsk"
+    assert bot.dispatcher.subscriptions[5] == ("Asia/Novosibirsk", "08:00")
+    reopened = CityRegistry(bot.city_registry.path)
+    reopened.open()
+    assert reopened.get(city.id).tz == "Asia/Novosibirsk"
+    reopened.close()
+
+
+def test_city_without_timezone_kept_while_geocoder_down(fresh_bot, monkeypatch):
+    bot = fresh_bot
+    bot.city_registry.open()
+    city = bot.city_registry.add("Новосибирск", 55.03, 82.92, None)
+    down = http_client.ProviderUnavailable("down")
+    fake_geocoder(monkeypatch, bot, {"Новосибирск": down, "Томск": down})
+    assert asyncio.run(bot.resolve_city("Новосибирск")) is city
+    with pytest.raises(http_client.ProviderUnavailable):
+        asyncio.run(bot.resolve_city("Томск"))
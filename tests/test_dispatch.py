@@ -0,0 +1,61 @@
+import asyncio
+import datetime
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from dispatcher import NotificationDispatcher
+
+UTC = datetime.timezone.utc
+
+
+def due_dispatcher(now):
+    # Одна корзина, время которой наступило минуту назад
+    dispatcher = NotificationDispatcher()
+    send_time = (now - datetime.timedelta(minutes=1)).strftime("%H:%M")
+    dispatcher.bulk_load([(1, "UTC", send_time), (2, "UTC", send_time)], now - datetime.timedelta(minutes=5))
+    return dispatcher
+
+
+def test_dispatch_job_does_not_wait_for_wave(bot, monkeypatch):
+    # Задача планировщика завершается сразу, и следующий слот уже запланирован, пока волна ещё идёт:
+    # долгая волна не должна занимать экземпляр задачи, иначе следующий запуск пропустится
+    now = datetime.datetime.now(UTC)
+    started = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_wave(user_ids, planned):
+            started.append(sorted(user_ids))
+            await release.wait()
+
+        monkeypatch.setattr(bot, "send_weather_job", slow_wave)
+        monkeypatch.setattr(bot, "dispatcher", due_dispatcher(now))
+        monkeypatch.setattr(bot, "scheduler", AsyncIOScheduler())
+        await asyncio.wait_for(bot.dispatch_due_notifications(), 1)
+        job = bot.scheduler.get_job(bot.DISPATCH_JOB_ID)
+        assert job is not None and job.trigger.run_date > now
+        assert bot.scheduler.get_job(bot.PREFETCH_JOB_ID) is not None
+        await asyncio.sleep(0)
+        assert started == [[1, 2]] and bot.background_tasks
+        release.set()
+        await asyncio.gather(*bot.background_tasks)
+
+    asyncio.run(scenario())
+    assert not bot.background_tasks
+
+
+def test_prefetch_job_does_not_wait_for_refresh(bot, monkeypatch):
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_prefetch(wake):
+            await release.wait()
+
+        monkeypatch.setattr(bot, "prefetch_forecasts", slow_prefetch)
+        await asyncio.wait_for(bot.start_prefetch(datetime.datetime.now(UTC)), 1)
+        assert len(bot.background_tasks) == 1
+        release.set()
+        await asyncio.gather(*bot.background_tasks)
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+import datetime
+
+from dispatcher import NotificationDispatcher, next_fire
+
+UTC = datetime.timezone.utc
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=UTC)
+
+
+def test_next_fire_follows_dst():
+    # Берлин: 29.03.2026 переход на летнее время (UTC+1 -> UTC+2), 25.10.2026 - обратно
+    assert next_fire("Europe/Berlin", "08:00", utc(2026, 3, 28, 6)) == utc(2026, 3, 28, 7)
+    assert next_fire("Europe/Berlin", "08:00", utc(2026, 3, 28, 7)) == utc(2026, 3, 29, 6)
+    assert next_fire("Europe/Berlin", "08:00", utc(2026, 10, 24, 7)) == utc(2026, 10, 25, 7)
+
+
+def test_next_fire_in_skipped_and_repeated_hour():
+    # 02:30 29 марта в Берлине нет, а 02:30 25 октября бывает дважды: отправка всё равно одна в сутки
+    assert next_fire("Europe/Berlin", "02:30", utc(2026, 3, 29, 0)) == utc(2026, 3, 29, 1, 30)
+    assert next_fire("Europe/Berlin", "02:30", utc(2026, 10, 25, 0)) == utc(2026, 10, 25, 0, 30)
+    assert next_fire("Europe/Berlin", "02:30", utc(2026, 10, 25, 0, 30)) == utc(2026, 10, 26, 1, 30)
+
+
+def test_unknown_timezone_falls_back_to_default():
+    assert next_fire("Mars/Olympus", "08:00", utc(2026, 1, 10)) == utc(2026, 1, 10, 5)
+    assert next_fire(None, "08:00", utc(2026, 1, 10)) == utc(2026, 1, 10, 5)
+
+
+def test_bucket_fires_on_local_time_across_dst():
+    dispatcher = NotificationDispatcher()
+    dispatcher.bulk_load([(1, "Europe/Berlin", "08:00"), (2, "Europe/Berlin", "08:00"), (3, "UTC", "08:00")],
+                         now=utc(2026, 3, 28, 0))
+    assert dispatcher.next_wake() == utc(2026, 3, 28, 7)
+    assert sorted(dispatcher.pop_due(utc(2026, 3, 28, 7))) == [1, 2]
+    assert dispatcher.next_wake() == utc(2026, 3, 28, 8)
+    assert dispatcher.pop_due(utc(2026, 3, 28, 8)) == [3]
+    # После перехода берлинская корзина срабатывает на час раньше по UTC
+    assert dispatcher.next_wake() == utc(2026, 3, 29, 6)
+    assert dispatcher.pop_due(utc(2026, 3, 29, 5, 59)) == []
+
+
+def test_subscribe_reports_earlier_wake():
+    now = utc(2026, 1, 10)
+    dispatcher = NotificationDispatcher()
+    assert dispatcher.subscribe(1, "UTC", "09:00", now)
+    assert dispatcher.next_wake() == utc(2026, 1, 10, 9)
+    assert not dispatcher.subscribe(2, "UTC", "10:00", now)
+    assert not dispatcher.subscribe(3, "UTC", "09:00", now)
+    assert dispatcher.subscribe(2, "UTC", "07:00", now)
+    assert dispatcher.next_wake() == utc(2026, 1, 10, 7)
+    assert not dispatcher.subscribe(2, "UTC", "07:00", now)
+
+
+def test_unsubscribe_drops_empty_buckets():
+    now = utc(2026, 1, 10)
+    dispatcher = NotificationDispatcher()
+    dispatcher.subscribe(1, "UTC", "07:00", now)
+    dispatcher.subscribe(2, "UTC", "09:00", now)
+    dispatcher.subscribe(1, "Europe/Moscow", "09:00", now)
+    assert set(dispatcher.buckets) == {("UTC", "09:00"), ("Europe/Moscow", "09:00")}
+    dispatcher.unsubscribe(2)
+    dispatcher.unsubscribe(2)
+    assert list(dispatcher.buckets) == [("Europe/Moscow", "09:00")] and len(dispatcher) == 1
+    assert dispatcher.next_wake() == utc(2026, 1, 10, 6)
+    assert dispatcher.upcoming(utc(2026, 1, 10, 6)) == [(utc(2026, 1, 10, 6), [1])]
+    dispatcher.unsubscribe(1)
+    assert dispatcher.next_wake() is None and dispatcher.buckets == {}
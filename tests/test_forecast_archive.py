@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+import os
+import types
+
+import numpy as np
+import pytest
+
+from forecast_archive import RAW_SUFFIX, SETTLE_SECONDS, VALUES, ForecastArchive, day_name
+
+DAY = 20000  # сутки UTC от 1970-01-01
+START = DAY * 86400
+
+
+def frame(temps, version, start=START, wind=0):
+    temps = np.asarray(temps, dtype=np.float64)
+    columns = {name: np.zeros(len(temps)) for name in VALUES}
+    columns["temp"], columns["wind"] = temps, np.full(len(temps), wind)
+    return types.SimpleNamespace(dt=start + np.arange(len(temps)) * 10800, version=version, **columns)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = ForecastArchive(str(tmp_path / "archive"), retention_days=30)
+    archive.open()
+    yield archive
+    archive.close()
+
+
+def settled(day=DAY):
+    # Момент, когда сутки day уже можно сжимать
+    return (day + 1) * 86400 + SETTLE_SECONDS + 1
+
+
+def test_compaction_keeps_latest_row_per_slot(archive):
+    assert archive.append(1, frame([10, 11, 12, 13, 14, 15, 16, 17], "a"), now=START) == 8
+    assert archive.append(1, frame([10, 11, 12, 13, 14, 15, 16, 17], "a"), now=START) == 0
+    archive.append(1, frame([20, 21], "b"), now=START + 60)
+    archive.append(2, frame([-5] * 8, "c"), now=START)
+    before = archive.read(1, START, START + 86400)
+
+    assert archive.compact(now=settled()) == (1, 0)
+    assert sorted(os.listdir(archive.path)) == [day_name(DAY)]
+    dt, values = archive.read(1, START, START + 86400)
+    assert np.array_equal(dt, before[0]) and np.array_equal(values["temp"], before[1]["temp"])
+    assert values["temp"].tolist() == [20, 21, 12, 13, 14, 15, 16, 17]
+    assert archive.read(2, START, START + 86400)[1]["temp"].tolist() == [-5] * 8
+    assert len(archive.read(3, START, START + 86400)[0]) == 0
+
+
+def test_late_rows_are_merged_into_compacted_day(archive):
+    archive.append(1, frame([10] * 8, "a"), now=START)
+    archive.compact(now=settled())
+    # Другой процесс дописал сутки уже после сжатия
+    late = ForecastArchive(archive.path, writer="worker0")
+    late.append(1, frame([30], "b", start=START + 3 * 10800), now=START + 3600)
+    late.append(2, frame([7] * 8, "c"), now=START + 3600)
+    late.close()
+    assert os.path.isdir(os.path.join(archive.path, day_name(DAY) + RAW_SUFFIX))
+
+    assert archive.compact(now=settled()) == (1, 0)
+    assert archive.read(1, START, START + 86400)[1]["temp"].tolist() == [10, 10, 10, 30, 10, 10, 10, 10]
+    assert archive.read(2, START, START + 86400)[1]["temp"].tolist() == [7] * 8
+    assert sorted(os.listdir(archive.path)) == [day_name(DAY)]
+
+
+def test_read_sees_compaction_by_other_process(archive):
+    archive.append(2, frame([10] * 8, "a", wind=2), now=START)
+    archive.compact(now=settled())
+    assert archive.read(2, START, START + 86400)[1]["temp"].tolist() == [10] * 8
+    # Сутки пересжал другой процесс, добавив город 1 перед городом 2. "city" у читателя отображён
+    # из прежнего файла, а "wind" отобразится уже из нового
+    other = ForecastArchive(archive.path, writer="main")
+    other.append(1, frame([5] * 8, "b", wind=9), now=START + 3600)
+    other.compact(now=settled())
+    other.close()
+    values = archive.read(2, START, START + 86400, fields=("temp", "wind"))[1]
+    assert values["temp"].tolist() == [10] * 8 and values["wind"].tolist() == [2] * 8
+
+
+def test_old_days_are_removed(archive):
+    archive.append(1, frame([10] * 8, "a"), now=START)
+    archive.compact(now=settled())
+    assert archive.compact(now=settled(DAY + 31)) == (0, 1)
+    assert os.listdir(archive.path) == []
+
+
+def test_daylight_temps_by_local_day(archive):
+    for day in range(DAY - 2, DAY + 1):
+        archive.append(1, frame([0, 3, 9, 12, 15, 6, 2, 1], f"v{day}", start=day * 86400), now=day * 86400)
+    archive.compact(now=settled())
+    # UTC+3: в световой день (06:00-21:00 местного) попадают отрезки 03:00-18:00 UTC
+    temps = archive.daylight_temps(1, 10800, DAY - 1, DAY)
+    assert temps == {DAY - 1: (2.0, 15.0), DAY: (2.0, 15.0)}
+
+
+def test_days_are_compacted_right_after_they_settle(bot, tmp_path, monkeypatch):
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+    async def scenario():
+        monkeypatch.setattr(bot, "scheduler", AsyncIOScheduler())
+        monkeypatch.setattr(bot, "FORECAST_ARCHIVE_DIR", str(tmp_path / "archive"))
+        monkeypatch.setattr(bot, "worker_shard", None)
+        await bot.open_archive()
+        job = bot.scheduler.get_job(bot.ARCHIVE_JOB_ID)
+        bot.archive.close()
+        monkeypatch.setattr(bot, "archive", None)
+        return job
+
+    job = asyncio.run(scenario())
+    # После прохода при запуске - каждые сутки, через SETTLE_SECONDS (с минутой запаса) после полуночи UTC
+    later = job.trigger.get_next_fire_time(job.next_run_time, job.next_run_time).astimezone(datetime.timezone.utc)
+    assert later > job.next_run_time and later.hour * 3600 + later.minute * 60 == SETTLE_SECONDS + 60
+    assert job.trigger.get_next_fire_time(later, later) - later == datetime.timedelta(days=1)
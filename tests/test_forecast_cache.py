@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from forecast_cache import ForecastCache
+
+
+def expired_cache():
+    # Кэш с одной уже просроченной, но ещё пригодной записью
+    cache = ForecastCache(ttl=0, stale_ttl=3600, stale_wait=0.5)
+    cache.put("moscow", "old")
+    return cache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ForecastCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "fresh"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("moscow", loader) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["fresh"] * 5
+    assert len(calls) == 1 and cache.stats()["shared"] == 4
+
+
+def test_stale_entry_replaced_by_fresh_payload():
+    async def loader():
+        return "fresh"
+
+    cache = expired_cache()
+    assert asyncio.run(cache.get_or_stale("moscow", loader)) == ("fresh", None)
+
+
+@pytest.mark.parametrize("result", [None, RuntimeError("503")])
+def test_stale_entry_served_when_refresh_fails(result):
+    # Ошибка загрузки и ответ без прогноза (None) одинаково отдают просроченную запись
+    async def loader():
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    cache = expired_cache()
+    payload, age = asyncio.run(cache.get_or_stale("moscow", loader))
+    assert payload == "old" and age is not None
+    assert cache.stats()["stale"] == 1
+
+
+def test_stale_entry_served_without_waiting_for_slow_provider():
+    async def loader():
+        await asyncio.sleep(5)
+        return "fresh"
+
+    async def scenario():
+        cache = expired_cache()
+        cache.stale_wait = 0.05
+        result = await asyncio.wait_for(cache.get_or_stale("moscow", loader), 1)
+        for task in list(cache._inflight.values()):
+            task.cancel()
+        return result
+
+    assert asyncio.run(scenario())[0] == "old"
+
+
+def test_no_stale_entry_returns_load_result():
+    async def loader():
+        return None
+
+    assert asyncio.run(ForecastCache().get_or_stale("moscow", loader)) == (None, None)
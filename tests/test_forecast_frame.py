@@ -0,0 +1,53 @@
+import datetime
+import time
+
+from forecast_frame import ForecastFrame, daylight_summary, daylight_slots
+
+MSK = 10800
+DAY = 20000  # сутки UTC от 1970-01-01
+
+
+def frame(start, temps, rain=(), tz_offset=MSK):
+    # Ответ /forecast с 3-часовыми отрезками от start (unix-время); rain - номера дождливых отрезков
+    items = [{"dt": start + i * 10800, "main": {"temp": temp}, "wind": {"speed": 2.0},
+              "weather": [{"description": "дождь" if i in rain else "ясно"}],
+              **({"rain": {"3h": 1.0}} if i in rain else {})}
+             for i, temp in enumerate(temps)]
+    return ForecastFrame.from_payload({"list": items, "city": {"timezone": tz_offset}})
+
+
+def test_daylight_slots_follow_slot_grid():
+    assert daylight_slots(0) == 6  # 06:00 ... 21:00
+    assert daylight_slots(300) == 5  # UTC+5: 08:00 ... 20:00
+    assert daylight_slots(21 * 60) == 6
+
+
+def test_evening_fetch_summarizes_next_day():
+    # Первый отрезок - 21:00 по Москве, дождливый; следующий день сухой
+    temps = [9, 7, 6, 8, 12, 15, 14, 11, 9, 8]
+    summary = daylight_summary(frame(DAY * 86400 + 18 * 3600, temps, rain={0}))
+    assert summary["date"] == datetime.date(1970, 1, 1) + datetime.timedelta(days=DAY + 1)
+    # Дневные отрезки следующего дня: 06:00 ... 21:00 по Москве
+    assert (summary["temp_min"], summary["temp_max"]) == (8.0, 15.0)
+    assert not summary["rain_all_day"] and summary["rain_windows"] == []
+
+
+def test_afternoon_fetch_keeps_today_without_claiming_all_day_rain():
+    # С 12:00 по Москве: четыре из шести дневных отрезков, все дождливые
+    summary = daylight_summary(frame(DAY * 86400 + 9 * 3600, [10, 11, 9, 8, 6], rain={0, 1, 2, 3, 4}))
+    assert summary["date"] == datetime.date(1970, 1, 1) + datetime.timedelta(days=DAY)
+    assert not summary["rain_all_day"] and summary["rain_windows"] == [(720, 1260)]
+
+
+def test_rain_all_day_needs_every_daylight_slot():
+    # С 06:00 по Москве: весь световой день под дождём
+    summary = daylight_summary(frame(DAY * 86400 + 3 * 3600, [5, 6, 7, 8, 7, 6], rain=set(range(6))))
+    assert summary["rain_all_day"]
+
+
+def test_brief_names_next_day(bot):
+    now = int(time.time())
+    # Отрезок, который по местному времени начинается в 21:00 сегодняшнего дня
+    start = (now + MSK) // 86400 * 86400 + 21 * 3600 - MSK
+    brief = bot.format_weather_brief("Москва", frame(start, [9, 7, 6, 8, 12, 15, 14, 11, 9, 8], rain={0}))
+    assert brief.startswith("Москва, завтра:\nБез дождя") and "от 8.0°C до 15.0°C" in brief
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+import geo
+
+
+@pytest.fixture
+def geocoder(monkeypatch):
+    # Геокодер без сети: название -> (lat, lon, names) или None
+    found, calls = {}, []
+
+    async def geocode(city, api_key):
+        calls.append(city)
+        return found.get(city)
+
+    async def timezone_online(lat, lon, api_key):
+        return "Europe/Moscow"
+
+    monkeypatch.setattr(geo, "geocode", geocode)
+    monkeypatch.setattr(geo, "timezone_online", timezone_online)
+    monkeypatch.setattr(geo, "_not_found", {})
+    return found, calls
+
+
+def test_not_found_name_is_not_geocoded_again(geocoder, monkeypatch):
+    found, calls = geocoder
+    assert asyncio.run(geo.resolve_city("Масква-опечатка", "key", "")) is None
+    assert asyncio.run(geo.resolve_city("масква-опечатка ", "key", "")) is None
+    assert calls == ["Масква-опечатка"]
+    # После NOT_FOUND_TTL название спрашивается снова
+    monkeypatch.setattr(geo, "NOT_FOUND_TTL", 0)
+    geo._not_found.clear()
+    found["Масква-опечатка"] = (55.75, 37.62, {"ru": "Москва"})
+    assert asyncio.run(geo.resolve_city("Масква-опечатка", "key", ""))["lat"] == 55.75
+    assert len(calls) == 2 and geo._not_found == {}
+
+
+def test_not_found_memory_is_bounded(geocoder, monkeypatch):
+    monkeypatch.setattr(geo, "NOT_FOUND_MAX", 3)
+    for i in range(5):
+        asyncio.run(geo.resolve_city(f"нет-такого-{i}", "key", ""))
+    assert list(geo._not_found) == ["нет-такого-2", "нет-такого-3", "нет-такого-4"]
+
+
+@pytest.mark.skipif(not geo.OFFLINE_INDEX, reason="timezonefinder не установлен")
+def test_offline_index_loads_in_background(monkeypatch):
+    monkeypatch.setattr(geo, "_finder", None)
+    assert geo.timezone_offline(55.75, 37.62) is None
+    asyncio.run(geo.load_offline_index())
+    assert geo.timezone_offline(55.75, 37.62) == "Europe/Moscow"
@@ -0,0 +1,82 @@
+import asyncio
+
+import httpx
+import pytest
+
+import http_client
+from http_client import CircuitBreaker, ProviderUnavailable
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Время предохранителя двигает тест
+    now = [1000.0]
+    monkeypatch.setattr(http_client.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_threshold(clock):
+    cb = CircuitBreaker(threshold=3, open_seconds=5, max_open_seconds=60)
+    for _ in range(2):
+        assert cb.allow()
+        cb.failure()
+    assert cb.state == CircuitBreaker.CLOSED
+    cb.failure()
+    assert cb.state == CircuitBreaker.OPEN and not cb.allow()
+    assert cb.retry_in() == 5
+
+
+def test_half_open_lets_one_probe_through(clock):
+    cb = CircuitBreaker(threshold=1, open_seconds=5, max_open_seconds=60)
+    cb.failure()
+    clock[0] += 5
+    assert cb.allow() and cb.state == CircuitBreaker.HALF_OPEN
+    assert not cb.allow()
+    cb.success()
+    assert cb.state == CircuitBreaker.CLOSED and cb.allow()
+
+
+def test_failed_probe_doubles_pause_up_to_max(clock):
+    cb = CircuitBreaker(threshold=1, open_seconds=5, max_open_seconds=12)
+    cb.failure()
+    pauses = []
+    for _ in range(3):
+        clock[0] += cb.retry_in()
+        assert cb.allow()
+        cb.failure()
+        pauses.append(cb.retry_in())
+    assert pauses == [10, 12, 12]
+
+
+def test_released_probe_can_be_retried(clock):
+    # Отменённый пробный запрос не оставляет предохранитель закрытым для всех
+    cb = CircuitBreaker(threshold=1, open_seconds=5)
+    cb.failure()
+    clock[0] += 5
+    assert cb.allow()
+    cb.release()
+    assert cb.allow()
+
+
+def test_request_fails_fast_when_breaker_open():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    async def scenario():
+        http_client.configure(httpx.MockTransport(handler))
+        try:
+            for _ in range(http_client.BREAKER_THRESHOLD):
+                with pytest.raises(ProviderUnavailable):
+                    await http_client.request("forecast", "POST", "http://weather.test/forecast")
+            with pytest.raises(ProviderUnavailable) as error:
+                await http_client.get("forecast", "http://weather.test/forecast")
+            assert not error.value.retryable
+        finally:
+            await http_client.close()
+            http_client.configure()
+
+    asyncio.run(scenario())
+    assert len(calls) == http_client.BREAKER_THRESHOLD
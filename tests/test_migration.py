@@ -0,0 +1,44 @@
+import http_client
+from models import UserRecord
+
+from test_cities import MOSCOW, fake_geocoder
+
+LEGACY = {
+    # Самый старый формат: названия городов и часовые пояса по названию
+    1: {"cities": ["Москва", "Казань"], "notify_city": "Москва", "send_time": "08:00",
+        "timezones": {"Москва": "Europe/Moscow", "Казань": "Europe/Moscow"}, "add_mode": False},
+    # Формат UserRecord до реестра: пустой timezones не сохранялся, города - по-прежнему названия
+    2: {"cities": ["Казань"], "notify_city": "Казань", "send_time": "07:30"},
+    3: {"cities": ["  москва "]},
+}
+
+
+def store_users(bot, states):
+    bot.user_store.open()
+    bot.user_store.write_all(states)
+    bot.user_store.close()
+
+
+def test_legacy_records_get_registry_ids(fresh_bot, monkeypatch):
+    bot = fresh_bot
+    store_users(bot, LEGACY)
+    # Казань геокодер не нашёл из-за сбоя: город попадает в реестр без координат
+    fake_geocoder(monkeypatch, bot, {"Москва": MOSCOW, "Казань": http_client.ProviderUnavailable("down")})
+    bot.load_user_states()
+
+    moscow, kazan = bot.city_registry.find("Москва"), bot.city_registry.find("Казань")
+    assert moscow.lat is not None and kazan.lat is None and kazan.tz == "Europe/Moscow"
+    assert bot.user_states[1] == UserRecord([moscow.id, kazan.id], moscow.id, "08:00")
+    assert bot.user_states[2] == UserRecord([kazan.id], kazan.id, "07:30")
+    assert bot.user_states[3] == UserRecord([moscow.id])
+    assert bot.user_store.load_legacy() == {}
+    assert set(bot.alert_engine.index.users(kazan.id)) == {2}
+
+
+def test_current_records_are_left_alone(fresh_bot, monkeypatch):
+    bot = fresh_bot
+    store_users(bot, {7: {"cities": [3, 4], "notify_city": 4, "send_time": "09:00"}})
+    calls = fake_geocoder(monkeypatch, bot, {})
+    bot.load_user_states()
+    assert bot.user_states[7] == UserRecord([3, 4], 4, "09:00")
+    assert calls == []
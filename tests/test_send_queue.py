@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+
+from telegram.error import RetryAfter
+
+import send_queue
+from send_queue import BULK, INTERACTIVE, SendQueue
+
+
+class RecordingBot:
+    # Запоминает порядок отправки; fail - тексты, на которые один раз ответить RetryAfter
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = set(fail)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if text in self.fail:
+            self.fail.discard(text)
+            raise RetryAfter(datetime.timedelta(milliseconds=50))
+        self.sent.append((chat_id, text))
+
+
+def run_queue(bot, messages, **options):
+    # messages - (chat_id, текст, приоритет); -> порядок отправки
+    async def scenario():
+        queue = SendQueue(**{"global_rate": 1000, "per_chat_rate": 50, "per_chat_burst": 1, "workers": 4, **options})
+        queue.start(bot)
+        futures = [queue.submit(chat_id, text, priority) for chat_id, text, priority in messages]
+        await asyncio.wait_for(asyncio.gather(*futures), 5)
+        await queue.stop()
+        return queue
+
+    return asyncio.run(scenario())
+
+
+def texts(bot, chat_id):
+    return [text for sent_to, text in bot.sent if sent_to == chat_id]
+
+
+def test_chat_order_kept_under_per_chat_limit():
+    bot = RecordingBot()
+    messages = [(1, f"same{i}", BULK) for i in range(4)] + [(2, f"other{i}", BULK) for i in range(4)]
+    run_queue(bot, messages)
+    assert texts(bot, 1) == ["same0", "same1", "same2", "same3"]
+    assert texts(bot, 2) == ["other0", "other1", "other2", "other3"]
+
+
+def test_chat_order_kept_after_retry_after():
+    bot = RecordingBot(fail={"same0"})
+    queue = run_queue(bot, [(1, f"same{i}", BULK) for i in range(4)], per_chat_rate=1000, per_chat_burst=10)
+    assert texts(bot, 1) == ["same0", "same1", "same2", "same3"]
+    assert queue.retried == 1
+
+
+def test_reply_overtakes_other_chats_but_not_own_chat():
+    # Ответ чату 1 стоит за его же уведомлением, но вместе с ним обгоняет рассылку другим чатам
+    bot = RecordingBot()
+    messages = [(chat_id, "notify", BULK) for chat_id in range(2, 40)]
+    messages += [(1, "notify", BULK), (1, "reply", INTERACTIVE)]
+    run_queue(bot, messages, workers=1, per_chat_rate=1000, per_chat_burst=10)
+    assert bot.sent[:2] == [(1, "notify"), (1, "reply")]
+
+
+def test_only_idle_chats_are_evicted(monkeypatch):
+    monkeypatch.setattr(send_queue, "MAX_CHATS", 2)
+
+    async def scenario():
+        # Без воркеров: сообщение чата 1 так и ждёт в очереди
+        queue = SendQueue()
+        queue._queue = asyncio.PriorityQueue()
+        queue.submit(1, "waiting")
+        queue._chat(2)
+        queue._chat(3)
+        assert list(queue._chats) == [1, 2, 3]
+        queue._finish(queue._chats[1].messages[0])
+        queue._chat(4)
+        assert list(queue._chats) == [3, 4]
+
+    asyncio.run(scenario())
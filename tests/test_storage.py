@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import sqlite3
+
+import pytest
+
+from storage import UserStore
+
+
+@pytest.fixture
+def users():
+    return {}
+
+
+@pytest.fixture
+def store(tmp_path, users):
+    store = UserStore(str(tmp_path / "users.db"), users.get, flush_delay=0.01)
+    store.open()
+    yield store
+    store.close()
+
+
+def test_changes_are_written_in_one_batch(store, users):
+    async def scenario():
+        for user_id in range(1, 4):
+            users[user_id] = {"cities": [user_id]}
+            store.mark_dirty(user_id)
+        store.mark_dirty(1)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert store.flushes == 1 and store.written == 3
+    assert store.load_all() == {1: {"cities": [1]}, 2: {"cities": [2]}, 3: {"cities": [3]}}
+
+
+def test_explicit_flush_cancels_pending_timer(store, users, monkeypatch):
+    calls = []
+    flush = store.flush
+
+    async def counting_flush():
+        calls.append(1)
+        await flush()
+
+    monkeypatch.setattr(store, "flush", counting_flush)
+
+    async def scenario():
+        users[1] = {"cities": [1]}
+        store.mark_dirty(1)
+        await store.flush()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert calls == [1] and store.flushes == 1 and store._flush_handle is None
+
+
+def test_deleted_user_is_removed(store, users):
+    users[1] = {"cities": [1]}
+    store.mark_dirty(1)
+    del users[1]
+    store.mark_dirty(1)
+    assert store.load_all() == {}
+
+
+def test_failed_write_keeps_users_dirty(store, users, monkeypatch, caplog):
+    write = store._write
+    failures = []
+
+    def failing_write(rows, deletes):
+        if not failures:
+            failures.append(rows)
+            raise sqlite3.OperationalError("disk I/O error")
+        write(rows, deletes)
+
+    monkeypatch.setattr(store, "_write", failing_write)
+
+    async def scenario():
+        users[1] = {"cities": [1]}
+        store.mark_dirty(1)
+        await store.flush()
+        assert store._dirty == {1} and store.load_all() == {}
+        # Повтор пишет уже последнее состояние пользователя
+        users[1] = {"cities": [1, 2]}
+        await store.flush()
+
+    with caplog.at_level(logging.ERROR, logger="storage"):
+        asyncio.run(scenario())
+    assert "Не удалось записать пользователей" in caplog.text
+    assert store.load_all() == {1: {"cities": [1, 2]}}
+
+
+def test_failed_sync_write_raises_and_keeps_users_dirty(store, users, monkeypatch):
+    def failing_write(rows, deletes):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(store, "_write", failing_write)
+    users[1] = {"cities": [1]}
+    with pytest.raises(sqlite3.OperationalError):
+        store.mark_dirty(1)
+    assert store._dirty == {1}
+
+
+def test_load_all_by_shard(store):
+    store.write_all({user_id: {"cities": []} for user_id in range(10)})
+    assert sorted(store.load_all(shard=1, shards=3)) == [1, 4, 7]
+
+
+def test_json_file_migrated_once(store, tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"5": {"cities": ["Москва"]}}), encoding="utf-8")
+    assert store.migrate_json(str(path)) == 1
+    assert store.load_all() == {5: {"cities": ["Москва"]}}
+    assert not path.exists() and (tmp_path / "users.json.migrated").exists()
@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+import config
+from http_server import Request
+
+TOKEN = "123456:" + "A" * 35
+
+
+def check(monkeypatch, **settings):
+    monkeypatch.setattr(config, "TELEGRAM_TOKEN", TOKEN)
+    for name, value in settings.items():
+        monkeypatch.setattr(config, name, value)
+    return config.validate()[0]
+
+
+def test_webhook_mode_requires_secret(monkeypatch):
+    errors = check(monkeypatch, WEBHOOK_URL="https://bot.example.com", WEBHOOK_SECRET=None)
+    assert any("WEBHOOK_SECRET" in error for error in errors)
+    assert check(monkeypatch, WEBHOOK_URL="https://bot.example.com", WEBHOOK_SECRET="s3cret_-") == []
+
+
+def test_polling_does_not_need_secret(monkeypatch):
+    assert check(monkeypatch, WEBHOOK_URL=None, WEBHOOK_SECRET=None) == []
+    assert any("WEBHOOK_SECRET" in error for error in check(monkeypatch, WEBHOOK_URL=None, WEBHOOK_SECRET="no spaces"))
+
+
+class FakeApp:
+    bot = None
+
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+
+def post(bot, headers):
+    app = FakeApp()
+    request = Request("POST", "/webhook", {}, headers, json.dumps({"update_id": 1}).encode())
+    status = asyncio.run(bot.webhook_endpoint(app)(request))[0]
+    return status, app.update_queue.qsize()
+
+
+def test_endpoint_checks_secret(bot, monkeypatch):
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", "s3cret")
+    assert post(bot, {"x-telegram-bot-api-secret-token": "s3cret"}) == (200, 1)
+    assert post(bot, {"x-telegram-bot-api-secret-token": "s3creT"}) == (401, 0)
+    assert post(bot, {}) == (401, 0)
+
+
+def test_endpoint_without_secret_rejects_everything(bot, monkeypatch):
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", None)
+    assert post(bot, {"x-telegram-bot-api-secret-token": ""}) == (401, 0)
@@ -0,0 +1,31 @@
+import sys
+import types
+
+import pytest
+
+from workers import bot_module, shard_of
+
+
+@pytest.mark.parametrize("shards", [1, 2, 4, 7])
+def test_rates_add_up_to_global_limit(bot, shards):
+    own, per_worker = bot.telegram_rates(shards)
+    assert own > 0 and per_worker > 0
+    assert own + per_worker * shards == pytest.approx(bot.TELEGRAM_GLOBAL_RATE)
+
+
+def test_shard_of_covers_all_shards():
+    assert {shard_of(user_id, 4) for user_id in range(100)} == {0, 1, 2, 3}
+
+
+def test_worker_reuses_main_run_as_mp_main(monkeypatch):
+    # python main.py: воркер, запущенный через spawn, уже выполнил main.py как __mp_main__
+    parent_main = types.ModuleType("__mp_main__")
+    parent_main.__file__ = "/srv/bot/main.py"
+    monkeypatch.setitem(sys.modules, "__mp_main__", parent_main)
+    monkeypatch.delitem(sys.modules, "main", raising=False)
+    assert bot_module() is parent_main and sys.modules["main"] is parent_main
+
+
+def test_worker_imports_main_under_other_entry_point(bot, monkeypatch):
+    monkeypatch.setitem(sys.modules, "__mp_main__", types.ModuleType("__mp_main__"))
+    assert bot_module() is bot
@@ -0,0 +1,164 @@
+import os
+import re
+
+import http_client
+from disk_cache import PersistentDict
+from forecast_cache import normalize_city
+
+TRANSLATE_URL = os.getenv('TRANSLATE_URL', 'https://libretranslate.de').rstrip('/') + "/translate"
+TRANSLATION_CACHE_FILE = os.getenv('TRANSLATION_CACHE_FILE', 'translations.json')
+
+# Названия, которые OpenWeather понимает только в английском написании
+# или которые транслитерация даёт неправильно
+KNOWN_CITIES = {
+    "москва": "Moscow",
+    "санкт-петербург": "Saint Petersburg",
+    "питер": "Saint Petersburg",
+    "спб": "Saint Petersburg",
+    "новосибирск": "Novosibirsk",
+    "екатеринбург": "Yekaterinburg",
+    "казань": "Kazan",
+    "нижний новгород": "Nizhny Novgorod",
+    "челябинск": "Chelyabinsk",
+    "самара": "Samara",
+    "омск": "Omsk",
+    "ростов-на-дону": "Rostov-on-Don",
+    "уфа": "Ufa",
+    "красноярск": "Krasnoyarsk",
+    "воронеж": "Voronezh",
+    "пермь": "Perm",
+    "волгоград": "Volgograd",
+    "краснодар": "Krasnodar",
+    "саратов": "Saratov",
+    "тюмень": "Tyumen",
+    "тольятти": "Tolyatti",
+    "ижевск": "Izhevsk",
+    "барнаул": "Barnaul",
+    "ульяновск": "Ulyanovsk",
+    "иркутск": "Irkutsk",
+    "хабаровск": "Khabarovsk",
+    "ярославль": "Yaroslavl",
+    "владивосток": "Vladivostok",
+    "махачкала": "Makhachkala",
+    "томск": "Tomsk",
+    "оренбург": "Orenburg",
+    "кемерово": "Kemerovo",
+    "новокузнецк": "Novokuznetsk",
+    "рязань": "Ryazan",
+    "астрахань": "Astrakhan",
+    "пенза": "Penza",
+    "липецк": "Lipetsk",
+    "киров": "Kirov",
+    "чебоксары": "Cheboksary",
+    "тула": "Tula",
+    "калининград": "Kaliningrad",
+    "курск": "Kursk",
+    "ставрополь": "Stavropol",
+    "сочи": "Sochi",
+    "тверь": "Tver",
+    "мурманск": "Murmansk",
+    "архангельск": "Arkhangelsk",
+    "якутск": "Yakutsk",
+    "сургут": "Surgut",
+    "владимир": "Vladimir",
+    "белгород": "Belgorod",
+    "смоленск": "Smolensk",
+    "калуга": "Kaluga",
+    "чита": "Chita",
+    "вологда": "Vologda",
+    "петрозаводск": "Petrozavodsk",
+    "великий новгород": "Veliky Novgorod",
+    "псков": "Pskov",
+    "севастополь": "Sevastopol",
+    "симферополь": "Simferopol",
+    "минск": "Minsk",
+    "киев": "Kyiv",
+    "алматы": "Almaty",
+    "астана": "Astana",
+    "ташкент": "Tashkent",
+    "бишкек": "Bishkek",
+    "ереван": "Yerevan",
+    "тбилиси": "Tbilisi",
+    "баку": "Baku",
+    "кишинёв": "Chisinau",
+    "кишинев": "Chisinau",
+    "рига": "Riga",
+    "вильнюс": "Vilnius",
+    "таллин": "Tallinn",
+    "лондон": "London",
+    "париж": "Paris",
+    "берлин": "Berlin",
+    "рим": "Rome",
+    "мадрид": "Madrid",
+    "прага": "Prague",
+    "вена": "Vienna",
+    "варшава": "Warsaw",
+    "стамбул": "Istanbul",
+    "анталья": "Antalya",
+    "дубай": "Dubai",
+    "пекин": "Beijing",
+    "токио": "Tokyo",
+    "нью-йорк": "New York",
+}
+
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "zh",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+}
+
+_CYRILLIC = re.compile('[а-яё]', re.IGNORECASE)
+
+_cache = PersistentDict(TRANSLATION_CACHE_FILE)
+hits = 0
+misses = 0
+
+
+def transliterate(city):
+    out = []
+    for ch in city:
+        lat = TRANSLIT.get(ch.lower())
+        if lat is None:
+            out.append(ch)
+        elif ch.isupper():
+            out.append(lat.capitalize())
+        else:
+            out.append(lat)
+    return "".join(out)
+
+
+def lookup(city):
+    # Перевод без обращения к сети: латиница, сохранённый перевод или встроенный словарь
+    if not _CYRILLIC.search(city):
+        return city
+    key = normalize_city(city)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    return KNOWN_CITIES.get(key)
+
+
+async def translate_city(city):
+    global hits, misses
+    city_en = lookup(city)
+    if city_en is not None:
+        hits += 1
+        return city_en
+    misses += 1
+    try:
+        payload = {"q": city, "source": "ru", "target": "en", "format": "text"}
+        resp = await http_client.post("translate", TRANSLATE_URL, json=payload)
+        city_en = resp.json().get("translatedText") if resp.status_code == 200 else None
+    except Exception:
+        city_en = None
+    if not city_en:
+        # Сервис недоступен: транслитерация, но в кэш её не пишем, чтобы потом получить нормальный перевод
+        return transliterate(city)
+    _cache.set(normalize_city(city), city_en)
+    return city_en
+
+
+def stats():
+    return {"hits": hits, "misses": misses, "cached": len(_cache)}
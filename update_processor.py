@@ -0,0 +1,130 @@
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов одного пользователя может ждать своей очереди; лишние отбрасываются
+MAX_USER_BACKLOG = int(os.getenv('MAX_USER_BACKLOG', '20'))
+# Повтор того же запроса в течение этого времени после обработки предыдущего отбрасывается
+COALESCE_WINDOW = float(os.getenv('COALESCE_WINDOW', '1.0'))
+
+
+def user_key(update):
+    # Порядок гарантируется в пределах пользователя (или чата, если пользователя нет)
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, "effective_chat", None)
+    return chat.id if chat is not None else None
+
+
+class _Mailbox:
+    __slots__ = ("current", "pending")
+
+    def __init__(self, current):
+        self.current = current  # метка апдейта, который обрабатывается сейчас
+        self.pending = deque()  # (метка, корутина) в порядке поступления
+
+    def last_tag(self):
+        return self.pending[-1][0] if self.pending else self.current
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Апдейты разных пользователей обрабатываются параллельно (до max_concurrent_updates),
+    # апдейты одного пользователя - строго по очереди, в порядке поступления:
+    # шаги диалога зависят от предыдущего сообщения.
+    # Если пользователь уже обрабатывается, новый апдейт кладётся в его очередь и слот сразу
+    # освобождается: очередь дорабатывает тот же вызов, что держит слот. Ожидание блокировки
+    # внутри слота заняло бы все слоты апдейтами пары активных пользователей.
+    # coalesce(update) -> метка или None: апдейт с той же меткой, что у предыдущего апдейта
+    # пользователя (ждущего, выполняемого или выполненного меньше coalesce_window назад), не
+    # обрабатывается - так пять нажатий одной кнопки дают один ответ. None - не склеивать никогда.
+    __slots__ = ("_backlogs", "_recent", "coalesce", "coalesce_window", "max_backlog", "coalesced", "shed")
+
+    def __init__(self, max_concurrent_updates, coalesce=None, coalesce_window=COALESCE_WINDOW,
+                 max_backlog=MAX_USER_BACKLOG):
+        super().__init__(max_concurrent_updates)
+        self._backlogs = {}  # ключ -> _Mailbox пользователя, пока он обрабатывается
+        self._recent = OrderedDict()  # ключ -> (метка, когда закончена), от старых к новым
+        self.coalesce = coalesce
+        self.coalesce_window = coalesce_window
+        self.max_backlog = max_backlog
+        self.coalesced = 0
+        self.shed = 0
+
+    async def do_process_update(self, update, coroutine):
+        key = user_key(update)
+        if key is None:
+            await coroutine
+            return
+        tag = self.coalesce(update) if self.coalesce is not None else None
+        mailbox = self._backlogs.get(key)
+        if mailbox is not None:
+            if tag is not None and tag == mailbox.last_tag():
+                self._drop(coroutine, "coalesced")
+            elif len(mailbox.pending) >= self.max_backlog:
+                self._drop(coroutine, "shed")
+            else:
+                mailbox.pending.append((tag, coroutine))
+            return
+        if tag is not None and self._recently_done(key, tag):
+            self._drop(coroutine, "coalesced")
+            return
+        mailbox = self._backlogs[key] = _Mailbox(tag)
+        try:
+            await self._run(coroutine)
+            while mailbox.pending:
+                mailbox.current, coroutine = mailbox.pending.popleft()
+                await self._run(coroutine)
+        finally:
+            del self._backlogs[key]
+            # Сюда попадаем с непустой очередью только при отмене задачи (остановка приложения)
+            for _, pending in mailbox.pending:
+                pending.close()
+        self._remember(key, mailbox.current)
+
+    def _drop(self, coroutine, reason):
+        # Корутина Application.process_update ещё не запускалась: закрываем, чтобы не было
+        # предупреждения "coroutine was never awaited"
+        coroutine.close()
+        if reason == "coalesced":
+            self.coalesced += 1
+        else:
+            self.shed += 1
+            logger.debug("Очередь пользователя переполнена, апдейт отброшен")
+
+    def _recently_done(self, key, tag):
+        entry = self._recent.get(key)
+        return entry is not None and entry[0] == tag and time.monotonic() - entry[1] < self.coalesce_window
+
+    def _remember(self, key, tag):
+        now = time.monotonic()
+        self._recent.pop(key, None)
+        if tag is not None:
+            self._recent[key] = (tag, now)
+        # Записи добавляются по времени, поэтому устаревшие - всегда в начале
+        while self._recent:
+            oldest_key, (_, done_at) = next(iter(self._recent.items()))
+            if now - done_at < self.coalesce_window:
+                break
+            del self._recent[oldest_key]
+
+    async def _run(self, coroutine):
+        # Ошибки обработчиков Application разбирает сам; здесь - чтобы не потерять очередь пользователя
+        try:
+            await coroutine
+        except Exception:
+            logger.exception("Ошибка при обработке апдейта")
+
+    def backlog_size(self):
+        return sum(len(mailbox.pending) for mailbox in self._backlogs.values())
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
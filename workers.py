@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Процессы запускаются через spawn: координатор к этому моменту уже держит потоки и event loop,
+# а fork такого процесса небезопасен
+_context = multiprocessing.get_context("spawn")
+
+
+def shard_of(user_id, shards):
+    # Тот же разбор, что в UserStore.load_all(shard=...): user_id у Telegram распределены равномерно
+    return user_id % shards
+
+
+class Coordinator:
+    # Основной процесс: принимает апдейты и сохраняет пользователей, а уведомления рассылают
+    # воркеры. Каждый воркер владеет своей долей пользователей (shard_of), своим расписанием и
+    # своей очередью отправки; изменения подписок координатор пересылает владельцу.
+    def __init__(self, shards, setup=None):
+        self.shards = shards
+        self.setup = setup
+        self.processes = [None] * shards
+        self.inboxes = [None] * shards
+        self.events = _context.Queue()
+        self.restarts = 0
+        self._monitor = None
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+    def _spawn(self, shard):
+        # Новая очередь на каждый запуск: упавший процесс мог оставить старую в неисправном состоянии
+        inbox = _context.Queue()
+        self.inboxes[shard] = inbox
+        process = _context.Process(target=worker_main, args=(shard, self.shards, inbox, self.events, self.setup),
+                                   name=f"weather-worker-{shard}", daemon=True)
+        process.start()
+        self.processes[shard] = process
+
+    def route(self, user_id, state):
+        # state - dict записи пользователя или None, если пользователь удалён
+        self.inboxes[shard_of(user_id, self.shards)].put(("upsert", user_id, state))
+
+    def dead_shards(self):
+        return [shard for shard, process in enumerate(self.processes) if process is not None and not process.is_alive()]
+
+    def respawn(self, shard):
+        logger.warning("Воркер %s завершился с кодом %s, перезапуск", shard, self.processes[shard].exitcode)
+        self._spawn(shard)
+        self.restarts += 1
+
+    def drain_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    async def monitor(self, before_respawn=None, interval=2.0):
+        # before_respawn - корутина-функция: сбросить в базу несохранённые изменения,
+        # ведь перезапущенный воркер читает свою долю пользователей оттуда
+        while True:
+            await asyncio.sleep(interval)
+            for event in self.drain_events():
+                logger.info("Воркер %s: %s %s", event[1], event[0], event[2])
+            dead = self.dead_shards()
+            if dead and before_respawn is not None:
+                await before_respawn()
+            for shard in dead:
+                self.respawn(shard)
+
+    def start_monitor(self, before_respawn=None):
+        self._monitor = asyncio.get_running_loop().create_task(self.monitor(before_respawn))
+
+    def stop(self, timeout=10.0):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for inbox, process in zip(self.inboxes, self.processes):
+            if process is not None and process.is_alive():
+                inbox.put(("stop",))
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes = [None] * self.shards
+
+
+def bot_module():
+    # При запуске python main.py процесс, запущенный через spawn, уже выполнил main.py как __mp_main__:
+    # import main выполнил бы модуль второй раз и построил бы все его глобальные объекты заново
+    parent_main = sys.modules.get("__mp_main__")
+    path = getattr(parent_main, "__file__", None) or ""
+    if "main" not in sys.modules and os.path.splitext(os.path.basename(path))[0] == "main":
+        sys.modules["main"] = parent_main
+    import main
+    return main
+
+
+def worker_main(shard, shards, inbox, events, setup=None):
+    bot = bot_module()
+    asyncio.run(serve_worker(bot, shard, shards, inbox, events, setup))
+
+
+async def serve_worker(bot, shard, shards, inbox, events, setup=None):
+    # setup() в дочернем процессе возвращает объект с send_message (по умолчанию - telegram.Bot);
+    # в бенчмарках через него подставляются заглушки провайдеров и Bot API
+    bot.load_shard(shard, shards)
+    if setup is not None:
+        api = setup()
+    else:
+        from telegram import Bot
+        api = Bot(bot.TELEGRAM_TOKEN, **bot.bot_api_urls())
+    if hasattr(api, "initialize"):
+        await api.initialize()
+    bot.job_listeners.append(
+        lambda result: events.put(("job", shard, {**result, "forecast_store": bot.forecast_store.stats()})))
+    await bot.start_pipeline(api)
+    events.put(("ready", shard, {"users": len(bot.user_states), "subscriptions": len(bot.dispatcher)}))
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(1, thread_name_prefix="inbox") as reader:
+        while True:
+            message = await loop.run_in_executor(reader, inbox.get)
+            if message[0] == "stop":
+                break
+            _, user_id, state = message
+            bot.apply_routed_user(user_id, state)
+    await bot.stop_pipeline()
+    if hasattr(api, "shutdown"):
+        await api.shutdown()